@@ -0,0 +1,6 @@
+#
+# Copyright (C) 2018-2022 S[&]T, The Netherlands.
+#
+'''
+Synthetic muninn archive for the benchmarks (see benchmarks/run_benchmarks.py)
+'''
@@ -0,0 +1,127 @@
+#
+# Copyright (C) 2018-2022 S[&]T, The Netherlands.
+#
+
+from __future__ import absolute_import, division, print_function
+
+import datetime
+import math
+import uuid
+
+from django.conf import settings
+from django.contrib.gis.db.models import GeometryField
+from django.contrib.gis.geos import Polygon
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from django.utils.module_loading import import_string
+
+from muninn_django.geometry import wrap_geometry
+
+EPOCH = datetime.datetime(2020, 1, 1)
+
+
+def make_footprint(rnd, points):
+    '''
+    Random polygon with `points` vertices (before wrapping), roughly a circle of 1-10 degrees; longitudes are not
+    normalized, so polygons near the dateline still need to be wrapped (see `wrap_geometry`)
+    '''
+    lon, lat = rnd.uniform(-180, 180), rnd.uniform(-75, 75)
+    radius = rnd.uniform(1, 10)
+    ring = []
+    for index in range(points):
+        angle = 2 * math.pi * index / points
+        distance = radius * rnd.uniform(0.8, 1.0)
+        ring.append((lon + distance * math.cos(angle), lat + distance * math.sin(angle)))
+    ring.append(ring[0])
+    return Polygon(ring, srid=4326)
+
+
+def field_value(field, rnd):
+    '''random value for a (namespace) model field'''
+    if isinstance(field, models.BooleanField):
+        return rnd.random() < 0.5
+    if isinstance(field, models.IntegerField):
+        return rnd.randrange(1000)
+    if isinstance(field, models.FloatField):
+        return rnd.uniform(0, 1000)
+    if isinstance(field, models.DateTimeField):
+        return EPOCH + datetime.timedelta(seconds=rnd.randrange(365 * 86400))
+    if isinstance(field, (models.TextField, models.CharField)):
+        return 'value%d' % rnd.randrange(1000)
+    if isinstance(field, models.UUIDField):
+        return uuid.UUID(int=rnd.getrandbits(128))
+    return None
+
+
+def namespace_fields(model_class):
+    '''the fields of a namespace model that get a value'''
+    return [field for field in model_class._meta.concrete_fields
+            if not field.primary_key and not isinstance(field, GeometryField)]
+
+
+def core_values(rnd, index, product_types, footprint_points=None):
+    '''field values of the core of the `index`-th synthetic product'''
+    validity_start = EPOCH + datetime.timedelta(seconds=rnd.randrange(365 * 86400))
+    values = {
+        'uuid': uuid.UUID(int=rnd.getrandbits(128)),
+        'active': True,
+        'hash': '%040x' % rnd.getrandbits(160),
+        'size': rnd.randrange(10 ** 9),
+        'metadata_date': validity_start + datetime.timedelta(days=1),
+        'archive_date': validity_start + datetime.timedelta(days=1),
+        'archive_path': 'type%d/%d' % (index % product_types, validity_start.month),
+        'product_type': 'type%d' % (index % product_types),
+        'product_name': 'product%08d' % index,
+        'physical_name': 'product%08d.nc' % index,
+        'validity_start': validity_start,
+        'validity_stop': validity_start + datetime.timedelta(seconds=rnd.randrange(1, 6000)),
+        'creation_date': validity_start + datetime.timedelta(hours=2),
+    }
+    if footprint_points:
+        values['footprint'] = wrap_geometry(make_footprint(rnd, footprint_points))
+    return values
+
+
+def generate_archive(archive, rnd, products=10000, product_types=10, tags_per_product=2.0, tag_names=50,
+                     links_per_product=2.0, footprint_points=32, batch_size=1000):
+    '''
+    Fill the (empty) tables of an archive (as configured in settings.MUNINN) with synthetic products: values for all
+    namespaces, on average `tags_per_product` tags (out of `tag_names`) and `links_per_product` source products per
+    product, and footprints with `footprint_points` vertices (if the core model has a footprint)
+    '''
+    config = settings.MUNINN[archive]
+    core_class = import_string(config['models']['core'])
+    namespace_classes = [import_string(path) for name, path in config['models'].items() if name != 'core']
+    tag_class = core_class._meta.get_field('tags').related_model
+    link_class = core_class._meta.get_field('source_links').related_model
+    try:
+        core_class._meta.get_field('footprint')
+    except FieldDoesNotExist:
+        footprint_points = None
+
+    product_uuids = []
+    for start in range(0, products, batch_size):
+        stop = min(start + batch_size, products)
+        cores = [core_class(**core_values(rnd, index, product_types, footprint_points)) for index in range(start, stop)]
+        core_class.objects.bulk_create(cores)
+        product_uuids.extend(core.pk for core in cores)
+        for namespace_class in namespace_classes:
+            fields = namespace_fields(namespace_class)
+            namespace_class.objects.bulk_create([
+                namespace_class(_core=core, **dict((field.attname, field_value(field, rnd)) for field in fields))
+                for core in cores])
+
+        tags = []
+        for core in cores:
+            count = int(tags_per_product) + (rnd.random() < tags_per_product % 1)
+            for name in rnd.sample(range(tag_names), min(count, tag_names)):
+                tags.append(tag_class(product=core, tag='tag%d' % name))
+        tag_class.objects.bulk_create(tags)
+
+        # source products are earlier products
+        links = []
+        for index, core in enumerate(cores, start):
+            count = int(links_per_product) + (rnd.random() < links_per_product % 1)
+            for source_index in set(rnd.randrange(index) for _ in range(count if index else 0)):
+                links.append(link_class(product=core, source_id=product_uuids[source_index]))
+        link_class.objects.bulk_create(links)
@@ -0,0 +1,46 @@
+#
+# Copyright (C) 2018-2022 S[&]T, The Netherlands.
+#
+
+from __future__ import absolute_import, division, print_function
+
+from django.conf import settings
+from django.contrib.gis.db import models
+from muninn_django import models as muninn_models
+from muninn_django.naiveutcdatetime.modelfields import NaiveDateTimeField
+
+
+class Core(muninn_models.Core):
+    class Meta(muninn_models.Core.Meta):
+        db_table = 'benchmark_core'
+
+
+class Tag(muninn_models.Tag):
+    class Meta(muninn_models.Tag.Meta):
+        db_table = 'benchmark_tag'
+
+
+class Link(muninn_models.Link):
+    class Meta(muninn_models.Link.Meta):
+        db_table = 'benchmark_link'
+
+
+def _namespace_model(name):
+    body = {
+        '__module__': __name__,
+        '_core': models.OneToOneField(Core, models.CASCADE, db_column='uuid', related_name=name, primary_key=True),
+        'text_value': models.TextField(blank=True, null=True),
+        'long_value': models.BigIntegerField(blank=True, null=True),
+        'real_value': models.FloatField(blank=True, null=True),
+        'time_value': NaiveDateTimeField(blank=True, null=True),
+        'flag': models.BooleanField(blank=True, null=True),
+        'Meta': type('Meta', (object, ), {'db_table': 'benchmark_%s' % name, 'verbose_name_plural': name}),
+    }
+    return type(name.capitalize(), (models.Model, ), body)
+
+
+# the number of namespaces is configurable, so the namespace models (ns0, ns1, ...) are created dynamically
+NAMESPACES = ['ns%d' % index for index in range(getattr(settings, 'MUNINN_BENCHMARK', {}).get('namespaces', 2))]
+
+for _name in NAMESPACES:
+    globals()[_name.capitalize()] = _namespace_model(_name)
@@ -0,0 +1,207 @@
+#
+# Copyright (C) 2018-2022 S[&]T, The Netherlands.
+#
+
+from __future__ import absolute_import, division, print_function
+
+import datetime
+import json
+import statistics
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connections, models
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils.module_loading import import_string
+
+from muninn_django.geometry import wrap_geometries, wrap_geometry
+from muninn_django.serializers import ProductSerializerFactory
+
+from .generate import core_values, field_value, make_footprint, namespace_fields
+
+
+def _json_default(value):
+    return value.isoformat() if isinstance(value, datetime.datetime) else str(value)
+
+
+class Context(object):
+    '''state shared by the benchmarks of an archive'''
+    def __init__(self, archive, rnd, footprint_points=32):
+        self.archive = archive
+        self.rnd = rnd
+        self.footprint_points = footprint_points
+        self.client = Client()
+        config = settings.MUNINN[archive]
+        self.core_class = import_string(config['models']['core'])
+        self.namespaces = OrderedDict((name, import_string(path)) for name, path in config['models'].items()
+                                      if name != 'core')
+        self.products = list(self.core_class.objects.order_by('product_name').values_list(
+            'pk', 'product_type', 'product_name')[:1000])
+        self.count = self.core_class.objects.count()
+        self.pages = max(1, self.count // (settings.REST_FRAMEWORK.get('PAGE_SIZE') or 100))
+        self.product_fields = [field.name for field in self.core_class._meta.concrete_fields]
+        self.created = 0
+
+    def url(self, path=''):
+        return '/%s/%s' % (self.archive, path)
+
+    def get(self, path='', **params):
+        return self._check(self.client.get(self.url(path), params), 200)
+
+    def post(self, path, data):
+        return self._check(self.client.post(self.url(path), json.dumps(data, default=_json_default),
+                                            content_type='application/json'), (200, 201))
+
+    def _check(self, response, status):
+        if response.status_code not in (status if isinstance(status, tuple) else (status, )):
+            raise RuntimeError('%s %s: %d %s' % (response.request['REQUEST_METHOD'], response.request['PATH_INFO'],
+                                                 response.status_code, response.content[:500]))
+        return response
+
+    def product(self, index):
+        return self.products[index % len(self.products)]
+
+
+def bench_list(context, index):
+    context.get(format='json', page=index % context.pages + 1)
+
+
+def bench_list_extended(context, index):
+    context.get(format='json', mode='extended', page=index % context.pages + 1)
+
+
+def bench_detail(context, index):
+    _, product_type, product_name = context.product(index)
+    context.get('%s/%s/' % (product_type, product_name), format='json')
+
+
+def bench_detail_extended(context, index):
+    _, product_type, product_name = context.product(index)
+    context.get('%s/%s/' % (product_type, product_name), format='json', mode='extended')
+
+
+def bench_filter(context, index):
+    params = {'format': 'json', 'product_type': 'type%d' % (index % 10),
+              'validity_start__gte': '2020-0%d-01T00:00:00' % (index % 9 + 1), 'tag': 'tag%d' % (index % 50)}
+    for name, namespace_class in context.namespaces.items():
+        fields = [field for field in namespace_fields(namespace_class) if isinstance(field, models.IntegerField)]
+        if fields:
+            params['%s__%s__lt' % (name, fields[0].name)] = 500
+            break
+    context.get(**params)
+
+
+def bench_create(context, index):
+    values = core_values(context.rnd, 0, 10, context.footprint_points if 'footprint' in context.product_fields
+                         else None)
+    context.created += 1
+    values['product_name'] = values['physical_name'] = 'created%08d' % context.created
+    del values['uuid']
+    if 'footprint' in values:
+        values['footprint'] = json.loads(values['footprint'].geojson)
+    values['tags'] = ['tag%d' % context.rnd.randrange(50)]
+    for name, namespace_class in context.namespaces.items():
+        values[name] = dict((field.name, field_value(field, context.rnd)) for field in namespace_fields(namespace_class))
+    context.post('', values)
+
+
+def bench_tag(context, index):
+    pk = context.product(index)[0]
+    context.post('%s/tag/' % pk, ['benchmark%d' % index])
+
+
+# the benchmarks that change the database (create, tag) come last
+BENCHMARKS = OrderedDict([
+    ('list', bench_list),
+    ('list_extended', bench_list_extended),
+    ('detail', bench_detail),
+    ('detail_extended', bench_detail_extended),
+    ('filter', bench_filter),
+    ('create', bench_create),
+    ('tag', bench_tag),
+])
+
+
+def _summary(seconds, number, queries=None):
+    per_operation = [value / number for value in seconds]
+    result = OrderedDict([
+        ('number', number),
+        ('repeat', len(seconds)),
+        ('min', min(per_operation)),
+        ('median', statistics.median(per_operation)),
+        ('mean', statistics.mean(per_operation)),
+    ])
+    if queries is not None:
+        result['queries'] = queries
+    return result
+
+
+def run_benchmark(function, context, number=20, repeat=5):
+    '''
+    Time `number` calls of `function(context, index)`, `repeat` times (after a warm-up call); the number of queries
+    is counted in a separate call, since recording the queries slows them down
+    '''
+    function(context, 0)
+    seconds = []
+    for run in range(repeat):
+        start = time.perf_counter()
+        for index in range(number):
+            function(context, run * number + index + 1)
+        seconds.append(time.perf_counter() - start)
+    with CaptureQueriesContext(connections[context.core_class.objects.db]) as queries:
+        function(context, repeat * number + 1)
+    return _summary(seconds, number, len(queries))
+
+
+def run_wrap_geometry(rnd, count=1000, points=32, repeat=5):
+    '''time `wrap_geometry` (one geometry at a time) and `wrap_geometries` on `count` random footprints'''
+    geometries = [make_footprint(rnd, points) for _ in range(count)]
+    results = OrderedDict()
+    for name, function in [('wrap_geometry', lambda: [wrap_geometry(geometry) for geometry in geometries]),
+                           ('wrap_geometries', lambda: wrap_geometries(geometries))]:
+        seconds = []
+        for run in range(repeat):
+            start = time.perf_counter()
+            function()
+            seconds.append(time.perf_counter() - start)
+        results[name] = _summary(seconds, count)
+    return results
+
+
+def run_serialize(context, count=1000, repeat=5):
+    '''
+    time fetching and serializing `count` products (in `default` mode) from `values_list` rows (as done for list
+    requests, see `ValuesListSerializer`) and from model instances
+    '''
+    serializer_class = ProductSerializerFactory.get(context.archive, mode='default')
+    paths = serializer_class(many=True).get_values_paths()
+    queryset = context.core_class.objects.order_by('product_name')[:count]
+    results = OrderedDict()
+    for name, function in [
+            ('serialize_values', lambda: serializer_class(list(queryset.values_list(*paths, named=True)), many=True).data),
+            ('serialize_instances', lambda: serializer_class(list(queryset), many=True).data)]:
+        function()
+        seconds = []
+        for run in range(repeat):
+            start = time.perf_counter()
+            function()
+            seconds.append(time.perf_counter() - start)
+        results[name] = _summary(seconds, count)
+    return results
+
+
+def run_suite(archive, rnd, names=None, number=20, repeat=5, footprint_points=32):
+    '''run the benchmarks (all if `names` is None) against an archive; returns a dict of results per benchmark'''
+    names = list(BENCHMARKS) + ['serialize', 'wrap_geometry'] if names is None else names
+    context = Context(archive, rnd, footprint_points)
+    results = OrderedDict()
+    for name in names:
+        if name == 'wrap_geometry':
+            results.update(run_wrap_geometry(rnd, points=footprint_points, repeat=repeat))
+        elif name == 'serialize':
+            results.update(run_serialize(context, repeat=repeat))
+        else:
+            results[name] = run_benchmark(BENCHMARKS[name], context, number, repeat)
+    return results
@@ -0,0 +1,54 @@
+#
+# Copyright (C) 2018-2022 S[&]T, The Netherlands.
+#
+'''
+Micro-benchmark of muninn_django.naiveutcdatetime.parse.parse_datetime, compared with plain strptime parsing.
+
+Usage: python benchmarks/parse_datetime.py [number]
+'''
+
+from __future__ import absolute_import, division, print_function
+
+import datetime
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from muninn_django.naiveutcdatetime.parse import NAIVE_DATETIME_FORMATS, parse_datetime  # noqa: E402
+
+VALUES = [
+    '2018-02-12T16:41:07.123456',
+    '2018-02-12T16:41:07',
+    '20180212T164107.123',
+    '20180212T164107',
+    '2018-02-12',
+    '20180212',
+    '2018-2-12T16:41:07',
+    'invalid',
+]
+
+
+def parse_datetime_strptime(value):
+    '''reference implementation: try each format in turn'''
+    for fmt in NAIVE_DATETIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print('%-28s %14s %14s %8s' % ('value', 'strptime (us)', 'parse (us)', 'speedup'))
+    for value in VALUES:
+        assert parse_datetime(value) == parse_datetime_strptime(value)
+        reference = min(timeit.repeat(lambda: parse_datetime_strptime(value), number=number, repeat=3)) / number
+        result = min(timeit.repeat(lambda: parse_datetime(value), number=number, repeat=3)) / number
+        print('%-28s %14.2f %14.2f %7.1fx' % (value, reference * 1e6, result * 1e6, reference / result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+#
+# Copyright (C) 2018-2022 S[&]T, The Netherlands.
+#
+'''
+Benchmark suite: generates a synthetic muninn archive in a SpatiaLite or PostGIS database and times list, detail,
+filtered, `extended` mode, create and tag requests, as well as serialization (from rows and from model instances) and
+`wrap_geometry`.
+
+Usage: python benchmarks/run_benchmarks.py [--database spatialite:<path> | postgis://<user>:<password>@<host>:<port>/<name>]
+                                           [--products <n>] [--output <results.json>] ...
+
+The results (seconds per operation, and queries per operation) can be written as JSON to track regressions.
+GDAL_LIBRARY_PATH, GEOS_LIBRARY_PATH and SPATIALITE_LIBRARY_PATH are taken from the environment, if set.
+'''
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import sys
+import time
+from collections import OrderedDict
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+BENCHMARKS_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_PATH, os.pardir))
+sys.path.insert(0, BENCHMARKS_PATH)
+
+ARCHIVE = 'benchmark'
+BENCHMARK_NAMES = ['list', 'list_extended', 'detail', 'detail_extended', 'filter', 'create', 'tag', 'serialize',
+                   'wrap_geometry']
+
+
+def get_database(url):
+    '''Django database settings for `spatialite:<path>` or `postgis://<user>:<password>@<host>:<port>/<name>`'''
+    if url.startswith('spatialite:'):
+        return {'ENGINE': 'django.contrib.gis.db.backends.spatialite', 'NAME': url[len('spatialite:'):]}
+    parsed = urlparse(url)
+    if parsed.scheme not in ('postgis', 'postgres', 'postgresql'):
+        raise ValueError('unsupported database: %s' % url)
+    return {
+        'ENGINE': 'django.contrib.gis.db.backends.postgis',
+        'NAME': parsed.path.lstrip('/'),
+        'USER': parsed.username or '',
+        'PASSWORD': parsed.password or '',
+        'HOST': parsed.hostname or '',
+        'PORT': str(parsed.port or ''),
+    }
+
+
+def configure(args):
+    from django.conf import settings
+    import django
+
+    namespaces = ['ns%d' % index for index in range(args.namespaces)]
+    models = OrderedDict([('core', 'muninn_benchmark.models.Core')])
+    models.update((name, 'muninn_benchmark.models.%s' % name.capitalize()) for name in namespaces)
+    archive_settings = {'models': models}
+    archive_settings.update(args.archive_settings or {})
+    options = dict((name, os.environ[name]) for name in ('GDAL_LIBRARY_PATH', 'GEOS_LIBRARY_PATH',
+                                                         'SPATIALITE_LIBRARY_PATH') if name in os.environ)
+    settings.configure(
+        DEBUG=False,
+        SECRET_KEY='benchmark',
+        USE_TZ=False,
+        ALLOWED_HOSTS=['testserver'],
+        INSTALLED_APPS=['django.contrib.contenttypes', 'django.contrib.auth', 'rest_framework', 'rest_framework_gis',
+                        'django_filters', 'muninn_django', 'muninn_benchmark'],
+        DATABASES={'default': get_database(args.database)},
+        ROOT_URLCONF='muninn_django.urls',
+        MUNINN={ARCHIVE: archive_settings},
+        MUNINN_BENCHMARK={'namespaces': args.namespaces},
+        REST_FRAMEWORK={
+            'PAGE_SIZE': 100,
+            'DEFAULT_PAGINATION_CLASS': 'muninn_django.pagination.PageNumberPagination',
+            'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend',
+                                        'muninn_django.filters.RelatedOrderingFilter'],
+            'DEFAULT_AUTHENTICATION_CLASSES': [],
+            'DEFAULT_PERMISSION_CLASSES': ['rest_framework.permissions.AllowAny'],
+        },
+        **options
+    )
+    django.setup()
+
+
+def create_tables(reuse=False):
+    '''(re)create the tables of the synthetic archive; returns False if `reuse` and the archive already has products'''
+    from django.apps import apps
+    from django.db import connection
+
+    model_classes = list(apps.get_app_config('muninn_benchmark').get_models())
+    existing = connection.introspection.table_names()
+    if reuse and all(model_class._meta.db_table in existing for model_class in model_classes) and \
+            model_classes[0].objects.exists():
+        return False
+    with connection.schema_editor() as editor:
+        for model_class in reversed(model_classes):
+            if model_class._meta.db_table in existing:
+                editor.delete_model(model_class)
+        for model_class in model_classes:
+            editor.create_model(model_class)
+    return True
+
+
+def get_environment():
+    import django
+    import rest_framework
+    from django.db import connection
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+    return OrderedDict([
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+        ('django', django.get_version()),
+        ('djangorestframework', rest_framework.VERSION),
+        ('numpy', numpy_version),
+        ('database', connection.vendor),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--database', default='spatialite:benchmark.sqlite3',
+                        help='spatialite:<path> or postgis://<user>:<password>@<host>:<port>/<name> '
+                             '(default: %(default)s); the benchmark tables are dropped and recreated')
+    parser.add_argument('--reuse', action='store_true', help='reuse the products generated by a previous run')
+    parser.add_argument('--products', type=int, default=10000, help='number of products (default: %(default)s)')
+    parser.add_argument('--namespaces', type=int, default=2, help='number of namespaces (default: %(default)s)')
+    parser.add_argument('--product-types', type=int, default=10, help='number of product types (default: %(default)s)')
+    parser.add_argument('--tags-per-product', type=float, default=2.0,
+                        help='average number of tags per product (default: %(default)s)')
+    parser.add_argument('--links-per-product', type=float, default=2.0,
+                        help='average number of source products per product (default: %(default)s)')
+    parser.add_argument('--footprint-points', type=int, default=32,
+                        help='number of vertices of the footprints (default: %(default)s)')
+    parser.add_argument('--archive-settings', type=json.loads,
+                        help='JSON dictionary of MUNINN archive settings, e.g. {"database_rendering": true}')
+    parser.add_argument('--benchmarks', nargs='+', choices=BENCHMARK_NAMES, help='benchmarks to run (default: all)')
+    parser.add_argument('--number', type=int, default=20, help='operations per timing (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timings (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default: %(default)s)')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    configure(args)
+    from muninn_benchmark.generate import generate_archive
+    from muninn_benchmark.suite import run_suite
+
+    rnd = random.Random(args.seed)
+    generation = None
+    if create_tables(args.reuse):
+        start = time.perf_counter()
+        generate_archive(ARCHIVE, rnd, products=args.products, product_types=args.product_types,
+                         tags_per_product=args.tags_per_product, links_per_product=args.links_per_product,
+                         footprint_points=args.footprint_points)
+        generation = time.perf_counter() - start
+        print('generated %d products in %.1f s' % (args.products, generation))
+
+    results = run_suite(ARCHIVE, rnd, args.benchmarks, number=args.number, repeat=args.repeat,
+                        footprint_points=args.footprint_points)
+
+    print('%-20s %12s %12s %10s' % ('benchmark', 'min (ms)', 'median (ms)', 'queries'))
+    for name, result in results.items():
+        print('%-20s %12.3f %12.3f %10s' % (name, result['min'] * 1000, result['median'] * 1000,
+                                            '%g' % result['queries'] if 'queries' in result else '-'))
+
+    if args.output:
+        report = OrderedDict([
+            ('timestamp', datetime.datetime.now(datetime.timezone.utc).isoformat()),
+            ('config', vars(args)),
+            ('environment', get_environment()),
+            ('generation_seconds', generation),
+            ('results', results),
+        ])
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
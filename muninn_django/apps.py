@@ -13,3 +13,5 @@ class MuninnDjangoConfig(AppConfig):
     
     def ready(self):
         settings.patch_defaults()
+        from .caching import connect_invalidations
+        connect_invalidations()
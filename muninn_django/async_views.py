@@ -0,0 +1,189 @@
+#
+# Copyright (C) 2018-2022 S[&]T, The Netherlands.
+#
+
+from __future__ import absolute_import, division, print_function
+
+from contextlib import ExitStack
+from functools import partial
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.http import Http404
+from django.utils.decorators import classonlymethod
+from rest_framework.response import Response
+
+from .caching import ResponseCache
+from .renderers import StreamingRenderer
+from .views import ProductViewSet
+
+
+class AsyncProductViewSet(ProductViewSet):
+    '''
+    Read-only variant of `ProductViewSet` for ASGI deployments (see `AsyncMuninnRouter`): `list` and `retrieve`
+    use the async ORM (and async pagination), so that a worker does not wait for the database. Other (GET) actions
+    run in a thread (`sync_to_async`), as do authentication, permission and throttling checks.
+
+    Products are serialized in the event loop, so the serializers must not query the database (the related objects
+    they use are prefetched by `get_queryset`).
+    '''
+    http_method_names = ['get', 'head', 'options']
+
+    @classonlymethod
+    def as_view(cls, actions=None, **initkwargs):
+        view = super(AsyncProductViewSet, cls).as_view(actions, **initkwargs)
+        # `dispatch` returns a coroutine, which Django awaits if the view is marked as a coroutine function
+        return markcoroutinefunction(view)
+
+    @classmethod
+    def get_extra_actions(cls):
+        return [action for action in super(AsyncProductViewSet, cls).get_extra_actions() if 'get' in action.mapping]
+
+    async def dispatch(self, request, *args, **kwargs):
+        start = self._start_request()
+        if self.timer is None:
+            response = await self._dispatch(request, *args, **kwargs)
+        else:
+            # queries are executed by the (per request) thread of `sync_to_async`, so record them there
+            stack = ExitStack()
+            await sync_to_async(stack.enter_context)(self.timer.record_queries())
+            try:
+                response = await self._dispatch(request, *args, **kwargs)
+            finally:
+                await sync_to_async(stack.close)()
+        return self._finish_request(request, response, start)
+
+    async def _dispatch(self, request, *args, **kwargs):
+        '''`APIView.dispatch`, awaiting the async handlers'''
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            if iscoroutinefunction(handler):
+                response = await handler(request, *args, **kwargs)
+            else:
+                response = await sync_to_async(handler)(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def aget_object(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        if 'product_type' in self.kwargs and 'product_name' in self.kwargs:
+            filter_kwargs = {
+                'product_type': self.kwargs['product_type'],
+                'product_name': self.kwargs['product_name'],
+            }
+        else:
+            lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+            filter_kwargs = {self.lookup_field: self.kwargs[lookup_url_kwarg]}
+        # as `rest_framework.generics.get_object_or_404`
+        try:
+            obj = await queryset.aget(**filter_kwargs)
+        except queryset.model.DoesNotExist:
+            raise Http404('No %s matches the given query.' % queryset.model._meta.object_name)
+        except (TypeError, ValueError, ValidationError):
+            raise Http404
+        await sync_to_async(self.check_object_permissions)(self.request, obj)
+        return obj
+
+    async def apaginate_queryset(self, queryset):
+        '''`paginate_queryset` using the async pagination API (if implemented by the pagination class)'''
+        if self.paginator is None:
+            return None
+        if not hasattr(self.paginator, 'apaginate_queryset'):
+            return await sync_to_async(self.paginate_queryset)(queryset)
+        return await self.paginator.apaginate_queryset(queryset, self.request, view=self)
+
+    async def _aconditional_response(self, etag, last_modified, get_response):
+        '''`_conditional_response` with an async `get_response`'''
+        response = self._get_not_modified_response(etag, last_modified)
+        if response is None:
+            response = await get_response()
+        return self._set_validators(response, etag, last_modified)
+
+    async def retrieve(self, request, *args, **kwargs):
+        instance = await self.aget_object()
+        etag, last_modified = self._get_validators(instance.metadata_date, str(instance.pk), instance.metadata_date)
+
+        async def get_response():
+            return Response(self._serialize(instance))
+
+        return await self._aconditional_response(etag, last_modified, get_response)
+
+    async def list(self, request, *args, **kwargs):
+        if isinstance(request.accepted_renderer, StreamingRenderer):
+            return await self._alist(request, self.filter_queryset(self.get_queryset()))
+
+        response_cache = ResponseCache.get(self.muninn_archive)
+        if response_cache is None:
+            return await self._aconditional_list(request)
+        key = await response_cache.aget_key(request)
+        response = self._get_cached_response(await response_cache.aget_response(key))
+        if response is not None:
+            return response
+        response = await self._aconditional_list(request)
+        if response.status_code == 200 and not hasattr(response, 'add_post_render_callback'):
+            await response_cache.aset_response(key, response)
+            return response
+        # rendered (and stored) after the view returns, in a thread
+        return self._cache_response(response_cache, key, response)
+
+    async def _aconditional_list(self, request):
+        queryset = self.filter_queryset(self.get_queryset())
+        get_response = partial(self._alist, request, queryset)
+        if not self._has_list_validators():
+            return await get_response()
+        summary = await queryset.order_by().aaggregate(last_modified=Max('metadata_date'), count=Count('pk'))
+        etag, last_modified = self._get_list_validators(summary)
+        return await self._aconditional_response(etag, last_modified, get_response)
+
+    async def _alist(self, request, queryset):
+        if isinstance(request.accepted_renderer, StreamingRenderer):
+            return self._astream(request.accepted_renderer, queryset)
+
+        json_queryset = self._get_json_queryset(queryset)
+        if json_queryset is not None:
+            page = await self.apaginate_queryset(json_queryset)
+            rows = page if page is not None else [row async for row in json_queryset]
+            return self._get_json_response([row.json_representation for row in rows], page is not None)
+
+        queryset = self._get_values_queryset(queryset)
+        page = await self.apaginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self._serialize(page, many=True))
+        return Response(self._serialize([row async for row in queryset], many=True))
+
+    def _astream(self, renderer, queryset):
+        queryset = self._get_values_queryset(queryset)
+        header = renderer.get_header(self.get_serializer())
+        chunk_size = self.export_chunk_size
+        labels = self._get_metric_labels(self.request) if self.metrics is not None else None
+
+        async def chunks():
+            yield renderer.render_header(header)
+            products = []
+            rows = 0
+            async for product in queryset.aiterator(chunk_size=chunk_size):
+                products.append(product)
+                rows += 1
+                if len(products) == chunk_size:
+                    yield renderer.render_rows(self.get_serializer(products, many=True).data, header)
+                    products = []
+            if products:
+                yield renderer.render_rows(self.get_serializer(products, many=True).data, header)
+            if labels is not None:
+                self.metrics.count_rows(labels, rows)
+
+        return self._get_streaming_response(renderer, chunks())
@@ -0,0 +1,129 @@
+#
+# Copyright (C) 2018-2022 S[&]T, The Netherlands.
+#
+
+from __future__ import absolute_import, division, print_function
+
+import hashlib
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import caches, DEFAULT_CACHE_ALIAS
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db.models.signals import m2m_changed, post_save, post_delete
+from django.utils.module_loading import import_string
+
+
+class ResponseCache(object):
+    '''
+    Shared cache for rendered list responses of an archive, configured with the `cache` archive setting.
+
+    Entries are keyed on the (normalized) query parameters, the user (since permissions can differ per user; all
+    anonymous users share entries) and a generation number of the archive, which is incremented on every change to
+    the products of the archive; this invalidates all entries at once.
+    '''
+    def __init__(self, archive, backend=DEFAULT_CACHE_ALIAS, timeout=DEFAULT_TIMEOUT):
+        self.archive = archive
+        self.cache = caches[backend]
+        self.timeout = timeout
+        self.generation_key = 'muninn_django.response.%s.generation' % archive
+
+    @classmethod
+    def get(cls, archive):
+        '''Return the response cache of an archive, or None if caching is not enabled'''
+        config = settings.MUNINN[archive].get('cache')
+        if not config:
+            return None
+        return cls(archive, **(config if isinstance(config, dict) else {}))
+
+    def _new_generation(self):
+        # not 0, so that an evicted generation number does not make old entries valid again
+        return int(time.time() * 1000)
+
+    def get_generation(self):
+        return self.cache.get_or_set(self.generation_key, self._new_generation, None)
+
+    def invalidate(self):
+        try:
+            self.cache.incr(self.generation_key)
+        except ValueError:
+            self.cache.set(self.generation_key, self._new_generation(), None)
+
+    async def aget_generation(self):
+        return await self.cache.aget_or_set(self.generation_key, self._new_generation, None)
+
+    def get_key(self, request):
+        return self._make_key(request, self.get_generation())
+
+    async def aget_key(self, request):
+        return self._make_key(request, await self.aget_generation())
+
+    def _make_key(self, request, generation):
+        params = sorted((key, sorted(values)) for key, values in request.query_params.lists() if key != 'mode')
+        query = repr((request.path, params, request.query_params.get('mode', 'default'),
+                      request.accepted_media_type, request.user.pk))
+        return 'muninn_django.response.%s.%s.%s' % (self.archive, generation,
+                                                    hashlib.md5(query.encode('utf-8')).hexdigest())
+
+    def get_response(self, key):
+        '''Return the cached (content, content type, headers) for a key, or None'''
+        return self.cache.get(key)
+
+    async def aget_response(self, key):
+        return await self.cache.aget(key)
+
+    def set_response(self, key, response):
+        self.cache.set(key, self._get_entry(response), self.timeout)
+
+    async def aset_response(self, key, response):
+        await self.cache.aset(key, self._get_entry(response), self.timeout)
+
+    def _get_entry(self, response):
+        headers = dict((name, response[name]) for name in ('ETag', 'Last-Modified') if response.has_header(name))
+        return (response.content, response['Content-Type'], headers)
+
+
+def invalidate(archive):
+    '''
+    invalidate the response cache of an archive (if enabled); for changes that do not send model signals, such as
+    `QuerySet.update()`, `bulk_create()` and raw SQL
+    '''
+    response_cache = ResponseCache.get(archive)
+    if response_cache is not None:
+        response_cache.invalidate()
+
+
+def _invalidate(archive, sender, **kwargs):
+    # m2m_changed is sent before and after the change
+    if kwargs.get('action', 'post_').startswith('post_'):
+        invalidate(archive)
+
+
+def connect_invalidation(archive):
+    '''
+    invalidate the response cache of an archive whenever a product, tag, link or namespace is saved/deleted, or
+    source products are added/removed through the `source_products` many-to-many relation
+    '''
+    config = settings.MUNINN[archive]
+    model_classes = [import_string(path) for path in config['models'].values()]
+    core_class = import_string(config['models']['core'])
+    model_classes.append(core_class._meta.get_field('tags').related_model)
+    model_classes.append(core_class._meta.get_field('source_links').related_model)
+    receiver = partial(_invalidate, archive)
+    for model_class in model_classes:
+        dispatch_uid = 'muninn_django.caching.%s.%s' % (archive, model_class._meta.label)
+        post_save.connect(receiver, sender=model_class, weak=False, dispatch_uid=dispatch_uid)
+        post_delete.connect(receiver, sender=model_class, weak=False, dispatch_uid=dispatch_uid)
+    m2m_changed.connect(receiver, sender=core_class.source_products.through, weak=False,
+                        dispatch_uid='muninn_django.caching.%s.source_products' % archive)
+
+
+def connect_invalidations():
+    '''
+    connect the invalidation of all archives that have the `cache` setting (when the app is loaded, so also for changes
+    in processes that do not load the URLs, e.g. management commands)
+    '''
+    for archive, config in settings.MUNINN.items():
+        if config.get('cache'):
+            connect_invalidation(archive)
@@ -5,12 +5,15 @@
 from __future__ import absolute_import, division, print_function
 
 import logging
+import math
 from copy import copy
 
+from django import forms
 from django.conf import settings
 from django.utils.module_loading import import_string
 from django.db.models import fields as django_fields
-from django.db.models import Lookup
+from django.db import connections
+from django.db.models import Lookup, Q, Value
 from django.core.exceptions import FieldDoesNotExist
 from rest_framework.filters import OrderingFilter
 from django_filters import rest_framework as filters
@@ -18,7 +21,9 @@ from django.contrib.gis.db.models import GeometryField
 from rest_framework_gis.filters import GeometryFilter
 
 from muninn_django.naiveutcdatetime.modelfields import NaiveDateTimeField
+from muninn_django.geometry import bbox_condition
 from muninn_django.naiveutcdatetime.forms import NaiveUtcIsoDateTimeFilter
+from muninn_django.naiveutcdatetime.parse import parse_datetime
 
 
 logger = logging.getLogger(__name__)
@@ -40,6 +45,81 @@ class CharInFilter(filters.BaseInFilter, filters.CharFilter):
     pass
 
 
+class BBoxField(forms.CharField):
+    '''form field for a `minlon,minlat,maxlon,maxlat` bounding box'''
+    def clean(self, value):
+        value = super(BBoxField, self).clean(value)
+        if value in self.empty_values:
+            return None
+        try:
+            bbox = [float(item) for item in value.split(',')]
+        except ValueError:
+            bbox = None
+        if bbox is None or len(bbox) != 4 or not all(math.isfinite(item) for item in bbox) or \
+                not -90 <= bbox[1] <= bbox[3] <= 90:
+            raise forms.ValidationError('Enter a bounding box as minlon,minlat,maxlon,maxlat.', code='invalid')
+        return tuple(bbox)
+
+
+class BBoxFilter(filters.Filter):
+    '''
+    Filter on footprints that overlap a bounding box (crossing the dateline if minlon > maxlon).
+    By default only the bounding boxes are compared (`&&`), which can be answered from the spatial index;
+    with `exact=True` the footprint must intersect the box.
+    '''
+    field_class = BBoxField
+
+    def __init__(self, *args, **kwargs):
+        self.exact = kwargs.pop('exact', False)
+        super(BBoxFilter, self).__init__(*args, **kwargs)
+
+    def filter(self, qs, value):
+        if value is None:
+            return qs
+        return qs.filter(bbox_condition(self.field_name, value, 'intersects' if self.exact else 'bboverlaps'))
+
+
+class TimeRangeField(forms.CharField):
+    '''form field for a `start/stop` time range; an empty start or stop is unbounded'''
+    def clean(self, value):
+        value = super(TimeRangeField, self).clean(value)
+        if value in self.empty_values:
+            return None
+        start, separator, stop = value.partition('/')
+        bounds = tuple(parse_datetime(item) if item else None for item in (start, stop))
+        if not separator or (start and bounds[0] is None) or (stop and bounds[1] is None) or \
+                (None not in bounds and bounds[0] > bounds[1]):
+            raise forms.ValidationError('Enter a time range as start/stop.', code='invalid')
+        return bounds
+
+
+class ValidityOverlapsFilter(filters.Filter):
+    '''
+    Filter on products with a validity (from `validity_start` up to and including `validity_stop`, unbounded if NULL)
+    that overlaps a time range (including its bounds); if `validity_start` > `validity_stop`, the bounds are swapped.
+    On PostgreSQL this is a single `tsrange(...) && tsrange(...)` predicate, which can use a GiST index
+    (see the `muninn_validity_index` command).
+    '''
+    field_class = TimeRangeField
+
+    def filter(self, qs, value):
+        if value is None:
+            return qs
+        start, stop = value
+        if connections[qs.db].vendor == 'postgresql':
+            from muninn_django.postgres import Overlaps, TSRange, validity_range
+            bounds = [Value(bound, output_field=NaiveDateTimeField()) for bound in (start, stop)]
+            return qs.filter(Overlaps(validity_range(), TSRange(*bounds)))
+        # the lower bound of the validity is the least of validity_start and validity_stop (if start > stop),
+        # the upper bound the greatest
+        condition = Q()
+        if stop is not None:
+            condition &= Q(validity_start__lte=stop) | Q(validity_stop__lte=stop) | Q(validity_start__isnull=True)
+        if start is not None:
+            condition &= Q(validity_stop__gte=start) | Q(validity_start__gte=start) | Q(validity_stop__isnull=True)
+        return qs.filter(condition)
+
+
 class ProductFilter(filters.FilterSet):
 
     # `in` implicitly supports `exact` :)
@@ -49,6 +129,11 @@ class ProductFilter(filters.FilterSet):
     source_product = filters.CharFilter(field_name='source_products__uuid', lookup_expr='exact')
     derived_product = filters.CharFilter(field_name='derived_products__uuid', lookup_expr='exact')
 
+    bbox = BBoxFilter(field_name='footprint')
+    bbox_exact = BBoxFilter(field_name='footprint', exact=True)
+
+    validity_overlaps = ValidityOverlapsFilter()
+
     class Meta(object):
         model = None  # to be overriden
         filter_overrides = {
@@ -1,6 +1,109 @@
 import math
+import struct
 
-from django.contrib.gis.geos import Polygon, LineString, LinearRing, MultiPolygon, MultiLineString, GeometryCollection
+from django.contrib.gis.db.models import GeometryField
+from django.contrib.gis.db.models.functions import AsGeoJSON, GeomOutputGeoFunc, NUMERIC_TYPES
+from django.contrib.gis.geos import GEOSGeometry, Polygon, LineString, LinearRing, MultiPolygon, MultiLineString, \
+    GeometryCollection
+from django.db.models import Q
+from django.db.models.functions import Cast
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# number of decimal digits of the coordinates in the GeoJSON written by GDAL (which is used by the geometry serializer
+# fields); GeoJSON rendered by the database at full precision uses the same number, so that both are identical
+GEOJSON_PRECISION = 15
+
+
+class SimplifyPreserveTopology(GeomOutputGeoFunc):
+    '''database function to simplify a geometry (using a tolerance in the units of the geometry) '''
+    def __init__(self, expression, tolerance, **extra):
+        super(SimplifyPreserveTopology, self).__init__(
+            expression, self._handle_param(tolerance, 'tolerance', NUMERIC_TYPES), **extra)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        clone = self
+        if self.geo_field.geography:
+            # simplification is only defined for the geometry type
+            clone = self.copy()
+            expressions = clone.get_source_expressions()
+            expressions[0] = Cast(expressions[0], GeometryField(srid=self.geo_field.srid))
+            clone.set_source_expressions(expressions)
+        return super(SimplifyPreserveTopology, clone).as_sql(compiler, connection, **extra_context)
+
+
+def reduced_geojson(expression, tolerance=None, precision=None):
+    '''
+    Return a database expression that renders a geometry as GeoJSON text, after simplifying it with `tolerance`
+    (if not None) and with coordinates rounded to `precision` decimal digits (full precision if None).
+    '''
+    if tolerance is not None:
+        expression = SimplifyPreserveTopology(expression, tolerance)
+    return AsGeoJSON(expression, precision=GEOJSON_PRECISION if precision is None else precision)
+
+
+def bbox_polygons(min_lon, min_lat, max_lon, max_lat, max_width=90, step=1):
+    '''
+    Return a list of polygons (srid 4326, with -180 <= longitude <= 180) that together cover a longitude/latitude
+    bounding box.
+
+    A box with `min_lon` > `max_lon` crosses the dateline; like `wrap_geometry`, the box is split at the dateline.
+    Boxes are also split into parts of at most `max_width` degrees of longitude, and the edges along parallels get a
+    point every `step` degrees, so that the polygons also follow the parallels when their edges are interpreted
+    as great circles (geography).
+    '''
+    width = max_lon - min_lon if max_lon >= min_lon else max_lon + 360 - min_lon
+    if width >= 360:
+        ranges = [(-180, 180)]
+    else:
+        # map min_lon to [-180, 180)
+        min_lon = (min_lon + 180) % 360 - 180
+        max_lon = min_lon + width
+        if max_lon <= 180:
+            ranges = [(min_lon, max_lon)]
+        else:
+            ranges = [(min_lon, 180), (-180, max_lon - 360)]
+    polygons = []
+    for range_start, range_stop in ranges:
+        parts = int(math.ceil((range_stop - range_start) / max_width)) or 1
+        for index in range(parts):
+            start = range_start + index * (range_stop - range_start) / parts
+            stop = range_stop if index == parts - 1 else range_start + (index + 1) * (range_stop - range_start) / parts
+            count = int(math.ceil((stop - start) / step)) or 1
+            lons = [start + i * (stop - start) / count for i in range(count)] + [stop]
+            # anti-clockwise
+            ring = [(lon, min_lat) for lon in lons] + [(lon, max_lat) for lon in reversed(lons)] + [(start, min_lat)]
+            polygons.append(Polygon(ring, srid=4326))
+    return polygons
+
+
+def bbox_condition(path, bbox, lookup='bboverlaps'):
+    '''
+    Return a Q object that matches geometries (at `path`) that overlap a longitude/latitude bounding box (see
+    `bbox_polygons`); by default only their bounding boxes are compared, which can be answered from a spatial index.
+    '''
+    condition = Q()
+    for polygon in bbox_polygons(*bbox):
+        condition |= Q(**{'%s__%s' % (path, lookup): polygon})
+    return condition
+
+
+def tile_bbox(z, x, y, margin=0):
+    '''
+    Return the longitude/latitude bounding box of web mercator (XYZ) tile z/x/y, extended by `margin` (a fraction of
+    the tile size)
+    '''
+    count = 2 ** z
+
+    def latitude(row):
+        row = min(max(row, 0), count)
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / count))))
+
+    return ((x - margin) / count * 360 - 180, latitude(y + 1 + margin),
+            (x + 1 + margin) / count * 360 - 180, latitude(y - margin))
 
 
 def polygon_rotation(pts):
@@ -20,25 +123,8 @@ def polygon_rotation(pts):
     return math.copysign(1, sum)
 
 
-def wrap_geometry(geometry):
-    '''
-    Convert lines and polygons from a line/polygon on a sphere to one that fits on a 2D lat/lon canvas with
-    -90 <= latitude <= 90 and -180 <= longitude <= 180.
-
-    For lines and polygons this requires splitting the lines/polygons at the dateline.
-    For polygons this also requires using a special 'unfolding' to make a polygon that covers the North and/or South
-    pole to still cover the whole polar region on a flat 2D area.
-
-    Polygons are only converted if they meet the following conditions:
-    - use srid 4326 (WGS84)
-    - have no exclusion regions
-
-    The special situation where a polygon covers both poles _and_ runs along the dateline will result in a single
-    polygon with a wrong rotation. This type of polygon is turned into a geometry with a hole (i.e. outer polygon is
-    the full earth bounding box, and the original polygon becomes the exclusion area).
-    Input polygons should be properly oriented using the right-hand rule (= anti clockwise) or they may otherwise be
-    turned into exclusions by this algorithm.
-    '''
+def _wrap_geometry(geometry):
+    '''pure python implementation of `wrap_geometry`'''
     if geometry is None:
         return geometry
     if geometry.srid != 4326:
@@ -171,7 +257,7 @@ def wrap_geometry(geometry):
     if type(geometry) is MultiPolygon:
         polys = []
         for poly in geometry:
-            result = wrap_geometry(poly)
+            result = _wrap_geometry(poly)
             if type(result) is MultiPolygon:
                 polys.extend(result)
             else:
@@ -180,12 +266,250 @@ def wrap_geometry(geometry):
     if type(geometry) is MultiLineString:
         lines = []
         for line in geometry:
-            result = wrap_geometry(line)
+            result = _wrap_geometry(line)
             if type(result) is MultiLineString:
                 lines.extend(result)
             else:
                 lines.append(result)
         return MultiLineString(lines)
     if type(geometry) is GeometryCollection:
-        return GeometryCollection([wrap_geometry(entry) for entry in geometry])
+        return GeometryCollection([_wrap_geometry(entry) for entry in geometry])
     return geometry
+
+
+_WKB_LINESTRING = 2
+_WKB_POLYGON = 3
+_WKB_MULTILINESTRING = 5
+_WKB_MULTIPOLYGON = 6
+
+_WORLD_RING = ((-180, -90), (180, -90), (180, 90), (-180, 90), (-180, -90))
+
+
+def _read_wkb(wkb, offset, parts):
+    # parse a 2D (multi)linestring/(multi)polygon from WKB into a tree of nodes (kind, part index, raw wkb) or
+    # ('multi', wkb type, child nodes), where the rings of polygons without holes and the lines are collected in
+    # `parts` as (coordinates, is_ring) pairs;
+    # the tree is None if the geometry can not be handled by the vectorized implementation (e.g. empty rings)
+    start = offset
+    byteorder = '<' if wkb[offset] == 1 else '>'
+    wkb_type, = struct.unpack_from(byteorder + 'I', wkb, offset + 1)
+    offset += 5
+    if wkb_type in (_WKB_LINESTRING, _WKB_POLYGON):
+        count = 1
+        if wkb_type == _WKB_POLYGON:
+            count, = struct.unpack_from(byteorder + 'I', wkb, offset)
+            offset += 4
+        rings = []
+        for _ in range(count):
+            npoints, = struct.unpack_from(byteorder + 'I', wkb, offset)
+            rings.append(numpy.frombuffer(wkb, dtype=byteorder + 'f8', count=2 * npoints,
+                                          offset=offset + 4).reshape(-1, 2))
+            offset += 4 + 16 * npoints
+        raw = bytes(wkb[start:offset])
+        if wkb_type == _WKB_POLYGON and count > 1:
+            # polygons with holes are not converted
+            return ('raw', None, raw), offset
+        if count == 0 or len(rings[0]) == 0:
+            return None, offset
+        parts.append((rings[0], wkb_type == _WKB_POLYGON))
+        return ('polygon' if wkb_type == _WKB_POLYGON else 'line', len(parts) - 1, raw), offset
+    if wkb_type in (_WKB_MULTILINESTRING, _WKB_MULTIPOLYGON):
+        count, = struct.unpack_from(byteorder + 'I', wkb, offset)
+        offset += 4
+        children = []
+        for _ in range(count):
+            child, offset = _read_wkb(wkb, offset, parts)
+            if child is None:
+                return None, offset
+            children.append(child)
+        return ('multi', wkb_type, children), offset
+    return None, offset
+
+
+def _wrap_parts(parts):
+    # vectorized version of the per vertex loops of `_wrap_geometry`, for all parts at once; returns per part
+    # a list of lines (for lines), or a list of polygons (each a list of rings), or None for unsupported polygons
+    sizes = numpy.array([len(coords) for coords, _ in parts])
+    ends = numpy.cumsum(sizes)
+    starts = ends - sizes
+    coords = numpy.concatenate([coords for coords, _ in parts])
+    lon, lat = coords[:, 0], coords[:, 1]
+    # map lon to [-180, 180]
+    lon = numpy.where(lon < -180, lon + 360, numpy.where(lon > 180, lon - 360, lon))
+    # the first point of each part is its own predecessor, which makes it neither a crossing nor add to the area
+    prev_lon = numpy.empty_like(lon)
+    prev_lon[1:] = lon[:-1]
+    prev_lon[starts] = lon[starts]
+    prev_lat = numpy.empty_like(lat)
+    prev_lat[1:] = lat[:-1]
+    prev_lat[starts] = lat[starts]
+    # rel_lon = lon mapped to [prev_lon - 180, prev_lon + 180]
+    rel_lon = numpy.where(lon < prev_lon - 180, lon + 360, numpy.where(lon > prev_lon + 180, lon - 360, lon))
+    direction = (rel_lon > 180).astype(numpy.int8) - (rel_lon < -180).astype(numpy.int8)
+    crossings = numpy.flatnonzero(direction)
+    # terms of the signed area (see `polygon_rotation`)
+    terms = lat * prev_lon - lon * prev_lat
+    pts = numpy.column_stack((lon, lat))
+
+    results = []
+    first_crossings = numpy.searchsorted(crossings, starts).tolist()
+    last_crossings = numpy.searchsorted(crossings, ends).tolist()
+    for (_, is_ring), start, end, first, last in zip(parts, starts.tolist(), ends.tolist(), first_crossings,
+                                                     last_crossings):
+        if first == last:
+            if not is_ring:
+                results.append([pts[start:end]])
+            # cumsum adds the terms in the same order as `polygon_rotation`
+            elif numpy.cumsum(terms[start:end])[-1] < 0:
+                results.append([[numpy.array(_WORLD_RING, dtype=float), pts[start:end]]])
+            else:
+                results.append([[pts[start:end]]])
+            continue
+
+        indices = crossings[first:last]
+        steps = direction[indices]
+        if is_ring and numpy.abs(numpy.cumsum(steps)).max() > 1:
+            # unsupported polygon
+            results.append(None)
+            continue
+        cur_lon, cur_lat = rel_lon[indices], lat[indices]
+        before_lon, before_lat = prev_lon[indices], prev_lat[indices]
+        crossing_lat = numpy.where(steps < 0,
+                                   cur_lat + ((-180 - cur_lon) / (before_lon - cur_lon)) * (before_lat - cur_lat),
+                                   before_lat + ((180 - before_lon) / (cur_lon - before_lon)) * (cur_lat - before_lat))
+        crossing_lat = crossing_lat.tolist()
+        # split at the dateline meridian; each piece is a list of coordinate arrays
+        pts_set = []
+        head = []
+        for index, step, mid_lat in zip(indices.tolist(), steps.tolist(), crossing_lat):
+            edge = -180 if step < 0 else 180
+            pts_set.append(head + [pts[start:index], numpy.array([(edge, mid_lat)], dtype=float)])
+            head = [numpy.array([(-edge, mid_lat)], dtype=float)]
+            start = index
+        pts_set.append(head + [pts[start:end]])
+        if not is_ring:
+            results.append([numpy.concatenate(chunks) for chunks in pts_set])
+            continue
+
+        # prepend final pts to first ring
+        pts_set[0] = pts_set[-1] + pts_set[0]
+        del pts_set[-1]
+        # check if we need to connect via the north pole
+        max_lat = max(crossing_lat)
+        max_index = crossing_lat.index(max_lat)
+        next_index = max_index + 1 if max_index < len(crossing_lat) - 1 else 0
+        if pts_set[max_index][-1][-1][0] > pts_set[next_index][0][0][0]:
+            # connect pts via the north pole
+            pts_set[max_index].append(numpy.array([(180, 90), (-180, 90)], dtype=float))
+            if max_index != next_index:
+                pts_set[max_index].extend(pts_set[next_index])
+                pts_set[next_index] = pts_set[max_index]
+                del pts_set[max_index]
+                del crossing_lat[max_index]
+        # check if we need to connect via the south pole
+        min_lat = min(crossing_lat)
+        min_index = crossing_lat.index(min_lat)
+        next_index = min_index + 1 if min_index < len(crossing_lat) - 1 else 0
+        if pts_set[min_index][-1][-1][0] < pts_set[next_index][0][0][0]:
+            # connect pts via the south pole
+            pts_set[min_index].append(numpy.array([(-180, -90), (180, -90)], dtype=float))
+            if min_index != next_index:
+                pts_set[min_index].extend(pts_set[next_index])
+                pts_set[next_index] = pts_set[min_index]
+                del pts_set[min_index]
+                del crossing_lat[min_index]
+        # close rings
+        results.append([[numpy.concatenate(chunks + [chunks[0][:1]])] for chunks in pts_set])
+    return results
+
+
+def _points_wkb(pts):
+    return struct.pack('<I', len(pts)) + numpy.asarray(pts, dtype='<f8').tobytes()
+
+
+def _collection_wkb(wkb_type, members):
+    return struct.pack('<BII', 1, wkb_type, len(members)) + b''.join(members)
+
+
+def _member_wkbs(node, wrapped):
+    # WKB of the lines/polygons that make up the wrapped version of a node
+    kind, value, raw = node
+    if kind == 'multi':
+        return [wkb for child in node[2] for wkb in _member_wkbs(child, wrapped)]
+    if kind == 'raw' or wrapped[value] is None:
+        return [raw]
+    if kind == 'line':
+        return [struct.pack('<BI', 1, _WKB_LINESTRING) + _points_wkb(line) for line in wrapped[value]]
+    return [_collection_wkb(_WKB_POLYGON, [_points_wkb(ring) for ring in rings]) for rings in wrapped[value]]
+
+
+def wrap_geometries(geometries):
+    '''
+    Return the result of `wrap_geometry` for each of the given geometries (e.g. the footprints of a page of products).
+
+    If numpy is available, the vertices of all geometries are processed at once with vectorized operations,
+    which is much faster than converting the geometries one by one.
+    '''
+    geometries = list(geometries)
+    if numpy is None:
+        return [_wrap_geometry(geometry) for geometry in geometries]
+    results = list(geometries)
+    parts = []
+    trees = []
+    for index, geometry in enumerate(geometries):
+        if geometry is None or geometry.srid != 4326:
+            continue
+        if type(geometry) is GeometryCollection:
+            # entries inherit the srid of the collection
+            results[index] = GeometryCollection(wrap_geometries(geometry))
+            continue
+        if type(geometry) not in (Polygon, LineString, MultiPolygon, MultiLineString):
+            continue
+        tree = None
+        if not geometry.hasz and not geometry.empty:
+            tree, _ = _read_wkb(geometry.wkb, 0, parts)
+        if tree is None:
+            results[index] = _wrap_geometry(geometry)
+        else:
+            trees.append((index, tree))
+    wrapped = _wrap_parts(parts) if parts else []
+    for index, tree in trees:
+        kind, value, raw = tree
+        if kind == 'raw' or (kind == 'polygon' and wrapped[value] is None):
+            # geometry is not converted
+            continue
+        members = _member_wkbs(tree, wrapped)
+        if kind == 'multi':
+            wkb = _collection_wkb(value, members)
+        elif len(members) == 1:
+            wkb = members[0]
+        else:
+            wkb = _collection_wkb(_WKB_MULTIPOLYGON if kind == 'polygon' else _WKB_MULTILINESTRING, members)
+        results[index] = GEOSGeometry(memoryview(wkb))
+    return results
+
+
+def wrap_geometry(geometry):
+    '''
+    Convert lines and polygons from a line/polygon on a sphere to one that fits on a 2D lat/lon canvas with
+    -90 <= latitude <= 90 and -180 <= longitude <= 180.
+
+    For lines and polygons this requires splitting the lines/polygons at the dateline.
+    For polygons this also requires using a special 'unfolding' to make a polygon that covers the North and/or South
+    pole to still cover the whole polar region on a flat 2D area.
+
+    Polygons are only converted if they meet the following conditions:
+    - use srid 4326 (WGS84)
+    - have no exclusion regions
+
+    The special situation where a polygon covers both poles _and_ runs along the dateline will result in a single
+    polygon with a wrong rotation. This type of polygon is turned into a geometry with a hole (i.e. outer polygon is
+    the full earth bounding box, and the original polygon becomes the exclusion area).
+    Input polygons should be properly oriented using the right-hand rule (= anti clockwise) or they may otherwise be
+    turned into exclusions by this algorithm.
+
+    If numpy is available, the vertices are processed with vectorized operations (see `wrap_geometries`).
+    '''
+    if numpy is None:
+        return _wrap_geometry(geometry)
+    return wrap_geometries([geometry])[0]
@@ -0,0 +1,32 @@
+#
+# Copyright (C) 2018-2022 S[&]T, The Netherlands.
+#
+
+from __future__ import absolute_import, division, print_function
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from muninn_django.caching import ResponseCache
+
+
+class Command(BaseCommand):
+    help = '''Invalidates the response cache of muninn archives, e.g. after changes to the products that were not made
+through Django (such as by muninn itself)'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('archives', nargs='*', help='archives to invalidate (default: all archives in MUNINN)')
+
+    def handle(self, *args, **options):
+        archives = options['archives'] or list(settings.MUNINN.keys())
+        for archive in archives:
+            if archive not in settings.MUNINN:
+                raise CommandError('unknown archive "%s"' % archive)
+
+        for archive in archives:
+            response_cache = ResponseCache.get(archive)
+            if response_cache is None:
+                self.stdout.write('%s: response cache not enabled' % archive)
+                continue
+            response_cache.invalidate()
+            self.stdout.write('%s: invalidated response cache' % archive)
@@ -4,10 +4,16 @@
 
 from __future__ import absolute_import, division, print_function
 
+import json
+import os
+
 from django.core.management.base import BaseCommand, CommandError
+from django.db import models
 from django.template import Template, Context
 import muninn
 
+from muninn_django.models import Core
+
 
 TYPES_MAPPING = {
     'long': 'models.BigIntegerField',
@@ -20,20 +26,31 @@ TYPES_MAPPING = {
     'geometry': 'models.GeometryField',
 }
 
+# core fields that get a btree index with --indexes (`product_type` and `archive_path` already lead the unique indexes;
+# the footprint gets a GiST index through the `spatial_index` of geometry fields); other (core and namespace) fields
+# only get an index with --index, as e.g. unbounded text values may be too long for a btree index
+CORE_INDEX_FIELDS = ['product_name', 'physical_name', 'validity_start', 'validity_stop', 'metadata_date', 'archive_date',
+                     'hash']
+
+# field types that can get a btree index with --index
+INDEX_TYPES = ['long', 'integer', 'real', 'text', 'timestamp', 'uuid']
+
 TEMPLATE = '''
 from __future__ import unicode_literals
 
 from django.contrib.gis.db import models
 from muninn_django import models as muninn_models
 from muninn_django.naiveutcdatetime.modelfields import NaiveDateTimeField
-# from django.contrib.gis.db.models import GeometryField, PolygonField
+{% if indexes %}from django.contrib.postgres.indexes import GinIndex, GistIndex
+from muninn_django.postgres import validity_range
+{% endif %}# from django.contrib.gis.db.models import GeometryField, PolygonField
 # import django.contrib.gis.db.backends
 
 
 class Core(muninn_models.Core):
     class Meta(muninn_models.Core.Meta):
         db_table = '{{table_prefix}}core'
-{{meta_options}}
+{{core_indexes}}{{meta_options}}
 
 class Tag(muninn_models.Tag):
     class Meta(muninn_models.Tag.Meta):
@@ -58,11 +75,23 @@ class {{ns.name_camel_case}}(models.Model):
     class Meta:
         db_table = '{{table_prefix}}{{ns.name}}'
         verbose_name_plural = '{{ns.name}}'
-{{meta_options}}
+{{ns.indexes}}{{meta_options}}
 {% endfor %}
 '''
 
-import json
+
+def _indexes_option(definitions):
+    '''`indexes` Meta option with the given index definitions'''
+    if not definitions:
+        return ''
+    return '        indexes = [\n%s        ]\n' % ''.join(['            %s,\n' % definition for definition in definitions])
+
+
+def _trigram_index(table, name):
+    from muninn_django.postgres import index_name
+    return "GinIndex(fields=['%s'], name='%s', opclasses=['gin_trgm_ops'])" % (name, index_name(table, name))
+
+
 class Command(BaseCommand):
     help = 'Creates models.py for a muninn archive'
 
@@ -70,6 +99,18 @@ class Command(BaseCommand):
         parser.add_argument('archive', type=str)
         parser.add_argument('--meta-options', type=json.loads,
                             help='''JSON dictionary of options that will be added to all models' Meta. Example: {"managed": false}''')
+        parser.add_argument('--indexes', action='store_true',
+                            help='add Meta.indexes: btree indexes on the core fields %s, and a GiST index on the validity '
+                                 'range (PostgreSQL only)' % ', '.join(CORE_INDEX_FIELDS))
+        parser.add_argument('--index', action='append', default=[], metavar='NAMESPACE.FIELD',
+                            help='add a btree index on another (non-boolean) scalar field, e.g. core.size or '
+                                 '<namespace>.<field> (can be repeated)')
+        parser.add_argument('--trigram', action='append', default=[], metavar='NAMESPACE.FIELD',
+                            help='add a trigram (GIN) index on a text field, e.g. core.product_name, which speeds up '
+                                 'contains/icontains filters; requires the pg_trgm extension (can be repeated)')
+        parser.add_argument('--output', help='file to write the models to (default: <archive>/models.py)')
+        parser.add_argument('--print', action='store_true', help='print the models instead of writing them to a file')
+        parser.add_argument('--force', action='store_true', help='overwrite an existing models.py that contains models')
 
     def handle(self, *args, **options):
         # get table_prefix
@@ -85,10 +126,31 @@ class Command(BaseCommand):
             meta_options = '\n'.join(['        %s = %s' % (k, repr(v)) for k, v in options['meta_options'].items()]) + '\n'
         else:
             meta_options = ''
+        indexes = options['indexes'] or bool(options['trigram'])
+        trigram = set(options['trigram'])
+        btree = set(options['index'])
+
+        core_indexes = []
+        if options['indexes']:
+            # only needed (and only importable with the PostgreSQL dependencies installed) for --indexes
+            from muninn_django.postgres import index_name
+            core_indexes = ["models.Index(fields=['%s'])" % name for name in CORE_INDEX_FIELDS]
+            core_indexes.append("GistIndex(validity_range(), name='%s')" % index_name('%score' % table_prefix, 'vrange'))
+        for field in Core._meta.fields:
+            if 'core.%s' % field.name in btree and field.get_internal_type() not in ('BooleanField', 'GeometryField'):
+                if not (options['indexes'] and field.name in CORE_INDEX_FIELDS):
+                    core_indexes.append("models.Index(fields=['%s'])" % field.name)
+                btree.remove('core.%s' % field.name)
+        for name in [field.name for field in Core._meta.fields if isinstance(field, models.TextField)]:
+            if 'core.%s' % name in trigram:
+                core_indexes.append(_trigram_index('%score' % table_prefix, name))
+                trigram.remove('core.%s' % name)
         context = {
             'table_prefix': table_prefix,
             'namespaces': [],
             'meta_options': meta_options,
+            'indexes': indexes,
+            'core_indexes': _indexes_option(core_indexes),
         }
 
         with muninn.open(archive_name) as archive:
@@ -101,6 +163,7 @@ class Command(BaseCommand):
                         'name_camel_case': namespace.capitalize(),
                         'fields': [],
                     }
+                    ns_indexes = []
                     for name in sorted(namespace_schema):
                         field = namespace_schema[name]
                         field_name = field.name()
@@ -110,10 +173,38 @@ class Command(BaseCommand):
                         optional = namespace_schema.is_optional(name)
                         if field_type:
                             ns_context['fields'].append({'code': field_name, 'name': name, 'type': field_type, 'optional': optional})
+                            if field_name in INDEX_TYPES and '%s.%s' % (namespace, name) in btree:
+                                ns_indexes.append("models.Index(fields=['%s'])" % name)
+                                btree.remove('%s.%s' % (namespace, name))
+                            if field_name == 'text' and '%s.%s' % (namespace, name) in trigram:
+                                ns_indexes.append(_trigram_index('%s%s' % (table_prefix, namespace), name))
+                                trigram.remove('%s.%s' % (namespace, name))
+                    ns_context['indexes'] = _indexes_option(ns_indexes)
                     context['namespaces'].append(ns_context)
 
+        if btree:
+            raise CommandError('not a (non-boolean) scalar field: %s' % ', '.join(sorted(btree)))
+        if trigram:
+            raise CommandError('not a text field: %s' % ', '.join(sorted(trigram)))
+
         template = Template(TEMPLATE)
-        result = template.render(Context(context))
-        #TODO: create a file instead of printing to stdout
-        print(result)
+        # the models are python code, not html
+        result = template.render(Context(context, autoescape=False))
+        if options['print']:
+            self.stdout.write(result)
+            return
+
+        path = options['output'] or os.path.join(archive_name, 'models.py')
+        if os.path.exists(path) and not options['force']:
+            with open(path) as f:
+                if 'class ' in f.read():
+                    raise CommandError('%s already contains models; use --force to overwrite it' % path)
+        with open(path, 'w') as f:
+            f.write(result)
+        self.stdout.write('created %s' % path)
+        if indexes or options['index']:
+            self.stdout.write('run makemigrations to create the indexes')
+        if options['trigram']:
+            self.stdout.write('trigram indexes require the pg_trgm extension: add '
+                              'django.contrib.postgres.operations.TrigramExtension() to the migration')
         #TODO: print simple instructions, including default MUNINN setting to add to settings.py
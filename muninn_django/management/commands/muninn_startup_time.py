@@ -0,0 +1,70 @@
+#
+# Copyright (C) 2018-2022 S[&]T, The Netherlands.
+#
+
+from __future__ import absolute_import, division, print_function
+
+import json
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from muninn_django.routers import MuninnRouter
+from muninn_django.serializers import ProductSerializerFactory
+
+
+class Command(BaseCommand):
+    help = '''Measures the time and memory needed to register muninn archives (as done when the URLs are loaded),
+and to build the classes that are needed for the first request to each archive'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('archives', nargs='*', help='archives to register (default: all archives in MUNINN)')
+        parser.add_argument('--max-time', type=float,
+                            help='fail if registering the archives takes longer than this number of seconds')
+        parser.add_argument('--json', action='store_true', help='print the results as JSON')
+
+    def _measure(self, function):
+        tracemalloc.start()
+        start = time.perf_counter()
+        function()
+        seconds = time.perf_counter() - start
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return {'seconds': seconds, 'bytes': size}
+
+    def handle(self, *args, **options):
+        archives = options['archives'] or list(settings.MUNINN.keys())
+        for archive in archives:
+            if archive not in settings.MUNINN:
+                raise CommandError('unknown archive "%s"' % archive)
+
+        router = MuninnRouter()
+
+        def register():
+            for archive in archives:
+                router.register_muninn(archive, prefix=archive)
+            router.urls
+
+        results = {'registration': self._measure(register), 'first_request': {}}
+        for prefix, view_class, archive in router.registry:
+            def build():
+                getattr(view_class, 'filterset_class', None)
+                for mode in settings.MUNINN[archive]['serializers']:
+                    ProductSerializerFactory.get(archive, mode=mode)().fields
+            results['first_request'][archive] = self._measure(build)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            self.stdout.write('registration of %d archive(s): %.3f s, %d kB' % (
+                len(archives), results['registration']['seconds'], results['registration']['bytes'] // 1024))
+            for archive, result in results['first_request'].items():
+                self.stdout.write('first request to %s: %.3f s, %d kB' % (archive, result['seconds'],
+                                                                         result['bytes'] // 1024))
+
+        max_time = options['max_time']
+        if max_time is not None and results['registration']['seconds'] > max_time:
+            raise CommandError('registration took %.3f s (more than %.3f s)' % (results['registration']['seconds'],
+                                                                             max_time))
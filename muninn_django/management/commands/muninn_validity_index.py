@@ -0,0 +1,49 @@
+#
+# Copyright (C) 2018-2022 S[&]T, The Netherlands.
+#
+
+from __future__ import absolute_import, division, print_function
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router
+from django.utils.module_loading import import_string
+
+from muninn_django.postgres import validity_range_index
+
+
+class Command(BaseCommand):
+    help = '''Creates the GiST index on the validity range of the products of muninn archives (PostgreSQL only),
+which is used by the `validity_overlaps` filter'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('archives', nargs='*', help='archives to create the index for (default: all archives in MUNINN)')
+        parser.add_argument('--concurrently', action='store_true',
+                            help='create the index without locking out writes to the table (CREATE INDEX CONCURRENTLY)')
+        parser.add_argument('--sql', action='store_true', help='only print the SQL statements')
+
+    def handle(self, *args, **options):
+        archives = options['archives'] or list(settings.MUNINN.keys())
+        for archive in archives:
+            if archive not in settings.MUNINN:
+                raise CommandError('unknown archive "%s"' % archive)
+
+        for archive in archives:
+            model_class = import_string(settings.MUNINN[archive]['models']['core'])
+            connection = connections[router.db_for_write(model_class)]
+            if connection.vendor != 'postgresql':
+                raise CommandError('archive "%s" is not stored in a PostgreSQL database' % archive)
+            index = validity_range_index(model_class)
+            with connection.cursor() as cursor:
+                exists = index.name in connection.introspection.get_constraints(cursor, model_class._meta.db_table)
+            if exists and not options['sql']:
+                self.stdout.write('%s: index %s already exists' % (archive, index.name))
+                continue
+            # CREATE INDEX CONCURRENTLY cannot run in a transaction
+            with connection.schema_editor(collect_sql=options['sql'], atomic=not options['concurrently']) as editor:
+                editor.add_index(model_class, index, concurrently=options['concurrently'])
+            if options['sql']:
+                for statement in editor.collected_sql:
+                    self.stdout.write(statement)
+            else:
+                self.stdout.write('%s: created index %s' % (archive, index.name))
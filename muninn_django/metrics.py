@@ -0,0 +1,189 @@
+#
+# Copyright (C) 2018-2022 S[&]T, The Netherlands.
+#
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from rest_framework.renderers import BaseRenderer
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+# request duration histogram buckets (in seconds)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REQUEST_LABELS = ('archive', 'action', 'mode', 'filters')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+HELP = {
+    'muninn_requests_total': ('counter', 'Number of requests'),
+    'muninn_request_duration_seconds': ('histogram', 'Request duration (including rendering) in seconds'),
+    'muninn_rows_total': ('counter', 'Number of products returned'),
+    'muninn_cache_requests_total': ('counter', 'Number of response cache lookups'),
+}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values):
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value)) for name, value in zip(names, values))
+
+
+class Metrics(object):
+    '''
+    In-process metrics of the product requests (enabled with the `metrics` archive setting), rendered in the
+    Prometheus text format. Each process has its own values; see `PrometheusClientMetrics` for multiple processes.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = defaultdict(int)
+        # labels -> bucket counts + [sum, count]
+        self.durations = {}
+        self.rows = defaultdict(int)
+        self.cache = defaultdict(int)
+
+    def observe_request(self, labels, status, seconds):
+        '''`labels`: values of REQUEST_LABELS'''
+        with self.lock:
+            self.requests[labels + (status, )] += 1
+            histogram = self.durations.get(labels)
+            if histogram is None:
+                histogram = self.durations[labels] = [0] * len(DURATION_BUCKETS) + [0.0, 0]
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    histogram[index] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+
+    def count_rows(self, labels, rows):
+        with self.lock:
+            self.rows[labels] += rows
+
+    def count_cache(self, archive, result):
+        '''`result`: hit or miss'''
+        with self.lock:
+            self.cache[(archive, result)] += 1
+
+    def _header(self, name):
+        metric_type, description = HELP[name]
+        return ['# HELP %s %s' % (name, description), '# TYPE %s %s' % (name, metric_type)]
+
+    def render(self):
+        with self.lock:
+            lines = self._header('muninn_requests_total')
+            for labels, value in sorted(self.requests.items()):
+                lines.append('muninn_requests_total%s %d' % (_format_labels(REQUEST_LABELS + ('status', ), labels),
+                                                             value))
+            lines += self._header('muninn_request_duration_seconds')
+            for labels, histogram in sorted(self.durations.items()):
+                for bound, value in zip(DURATION_BUCKETS + ('+Inf', ), histogram[:-2] + [histogram[-1]]):
+                    lines.append('muninn_request_duration_seconds_bucket%s %d' % (
+                        _format_labels(REQUEST_LABELS + ('le', ), labels + (bound, )), value))
+                lines.append('muninn_request_duration_seconds_sum%s %r' % (_format_labels(REQUEST_LABELS, labels),
+                                                                           histogram[-2]))
+                lines.append('muninn_request_duration_seconds_count%s %d' % (_format_labels(REQUEST_LABELS, labels),
+                                                                             histogram[-1]))
+            lines += self._header('muninn_rows_total')
+            for labels, value in sorted(self.rows.items()):
+                lines.append('muninn_rows_total%s %d' % (_format_labels(REQUEST_LABELS, labels), value))
+            lines += self._header('muninn_cache_requests_total')
+            for labels, value in sorted(self.cache.items()):
+                lines.append('muninn_cache_requests_total%s %d' % (_format_labels(('archive', 'result'), labels),
+                                                                   value))
+        return '\n'.join(lines) + '\n'
+
+
+class PrometheusClientMetrics(object):
+    '''
+    Metrics stored with `prometheus_client` in multiprocess mode (e.g. for gunicorn workers), so that the values
+    of all processes are combined; used when the PROMETHEUS_MULTIPROC_DIR environment variable is set
+    '''
+    def __init__(self):
+        self.requests = prometheus_client.Counter('muninn_requests', HELP['muninn_requests_total'][1],
+                                                  REQUEST_LABELS + ('status', ))
+        self.durations = prometheus_client.Histogram('muninn_request_duration_seconds',
+                                                     HELP['muninn_request_duration_seconds'][1], REQUEST_LABELS,
+                                                     buckets=DURATION_BUCKETS)
+        self.rows = prometheus_client.Counter('muninn_rows', HELP['muninn_rows_total'][1], REQUEST_LABELS)
+        self.cache = prometheus_client.Counter('muninn_cache_requests', HELP['muninn_cache_requests_total'][1],
+                                               ('archive', 'result'))
+
+    def observe_request(self, labels, status, seconds):
+        self.requests.labels(*(labels + (status, ))).inc()
+        self.durations.labels(*labels).observe(seconds)
+
+    def count_rows(self, labels, rows):
+        self.rows.labels(*labels).inc(rows)
+
+    def count_cache(self, archive, result):
+        self.cache.labels(archive, result).inc()
+
+    def render(self):
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return prometheus_client.generate_latest(registry)
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    '''Return the metrics registry of this process'''
+    global _metrics
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                if prometheus_client is not None and os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+                    _metrics = PrometheusClientMetrics()
+                else:
+                    _metrics = Metrics()
+    return _metrics
+
+
+class MetricsRenderer(BaseRenderer):
+    '''Prometheus text format (the response has the full content type, see `CONTENT_TYPE`)'''
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            # error
+            data = '%s\n' % data.get('detail', data)
+        # `prometheus_client` renders bytes
+        return data if isinstance(data, bytes) else data.encode(self.charset)
+
+
+class MetricsView(APIView):
+    '''
+    The metrics in the Prometheus text format (see `MuninnRouter`).
+    Access is controlled by the METRICS_PERMISSION_CLASSES setting (default: admin users only), with the default
+    authentication classes.
+    '''
+    renderer_classes = [MetricsRenderer]
+
+    def get_permissions(self):
+        paths = settings.REST_FRAMEWORK.get('METRICS_PERMISSION_CLASSES', ['rest_framework.permissions.IsAdminUser'])
+        return [import_string(path)() for path in paths]
+
+    def get(self, request, *args, **kwargs):
+        return Response(get_metrics().render(), content_type=CONTENT_TYPE)
+
+
+metrics_view = MetricsView.as_view()
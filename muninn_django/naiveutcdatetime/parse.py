@@ -5,6 +5,7 @@
 from __future__ import absolute_import, division, print_function
 
 import datetime
+import re
 
 NAIVE_DATE_FORMATS = [
     '%Y-%m-%d',
@@ -16,26 +17,60 @@ NAIVE_DATETIME_FORMATS = [
     '%Y%m%dT%H%M%S.%f', '%Y%m%dT%H%M%S',
 ] + NAIVE_DATE_FORMATS
 
+# the common (zero padded) forms of the formats above, e.g. 2018-02-12T16:41:07.123, 2018-02-12, 20180212T164107
+_EXTENDED_RE = re.compile(r'[0-9]{4}-[0-9]{2}-[0-9]{2}(?:T[0-9]{2}:[0-9]{2}:[0-9]{2}(?:\.([0-9]{1,6}))?)?\Z')
+_BASIC_RE = re.compile(r'([0-9]{4})([0-9]{2})([0-9]{2})(?:T([0-9]{2})([0-9]{2})([0-9]{2})(?:\.([0-9]{1,6}))?)?\Z')
 
-def parse_date(value):
-    result = None
-    for fmt in NAIVE_DATE_FORMATS:
+_fromisoformat = getattr(datetime.datetime, 'fromisoformat', None)
+
+
+def _strptime(value, formats):
+    for fmt in formats:
         try:
-            result = datetime.datetime.strptime(value, fmt).date()
-        except:
+            return datetime.datetime.strptime(value, fmt)
+        except (TypeError, ValueError):
             continue
-        if result:
-            break
-    return result
+    return None
 
 
-def parse_datetime(value):
+def _parse_fast(value):
+    # parse the common forms without strptime; returns None if `value` is not in one of these forms (or invalid)
+    if not isinstance(value, str):
+        return None
+    try:
+        match = _EXTENDED_RE.match(value)
+        if match is not None and _fromisoformat is not None:
+            fraction = match.group(1)
+            if fraction is not None and len(fraction) != 6:
+                # fromisoformat only accepts 3 or 6 digits before python 3.11
+                value += '0' * (6 - len(fraction))
+            return _fromisoformat(value)
+        match = _BASIC_RE.match(value)
+        if match is None:
+            return None
+        year, month, day, hour, minute, second, fraction = match.groups()
+        if hour is None:
+            return datetime.datetime(int(year), int(month), int(day))
+        return datetime.datetime(int(year), int(month), int(day), int(hour), int(minute), int(second),
+                                 int(fraction.ljust(6, '0')) if fraction else 0)
+    except ValueError:
+        # e.g. an invalid day of the month
+        return None
+
+
+def parse_date(value):
     result = None
-    for fmt in NAIVE_DATETIME_FORMATS:
-        try:
-            result = datetime.datetime.strptime(value, fmt)
-        except:
-            continue
-        if result:
-            break
+    if isinstance(value, str) and len(value) in (8, 10):
+        # only the date forms have this length
+        result = _parse_fast(value)
+    if result is None:
+        result = _strptime(value, NAIVE_DATE_FORMATS)
+    return result.date() if result is not None else None
+
+
+def parse_datetime(value):
+    result = _parse_fast(value)
+    if result is None:
+        # less common forms, e.g. without zero padding
+        result = _strptime(value, NAIVE_DATETIME_FORMATS)
     return result
@@ -4,10 +4,134 @@
 
 from __future__ import absolute_import, division, print_function
 
+import datetime
+import hashlib
+import json
+import logging
+import uuid
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.paginator import Paginator, EmptyPage, InvalidPage, PageNotAnInteger
+from django.db import connections, transaction, DatabaseError
+from django.db.models import F, Field, Func, Model, Q, Value
+from django.db.models.lookups import GreaterThan, LessThan
+from django.utils.functional import cached_property
 from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+
+
+logger = logging.getLogger(__name__)
+
+
+class CountingPaginator(Paginator):
+    '''
+    Paginator that avoids exact counts on large result sets:
+        - COUNT_ESTIMATE_THRESHOLD: if the planner estimates at least this number of rows, the estimate is used
+          (`reltuples` for unfiltered queries); only supported for PostgreSQL. With this setting, paginated responses
+          include `count_is_exact`
+        - COUNT_CACHE_TIMEOUT: exact counts are cached (per query) for this number of seconds
+    '''
+    count_is_exact = True
+
+    def __init__(self, object_list, per_page, count=None, **kwargs):
+        '''`count`: the exact number of items, if already known'''
+        super(CountingPaginator, self).__init__(object_list, per_page, **kwargs)
+        if count is not None:
+            self.__dict__['count'] = count
+
+    @cached_property
+    def count(self):
+        threshold = settings.REST_FRAMEWORK.get('COUNT_ESTIMATE_THRESHOLD')
+        if threshold is not None:
+            estimate = self._estimate_count()
+            if estimate is not None and estimate >= threshold:
+                self.count_is_exact = False
+                return estimate
+
+        timeout = settings.REST_FRAMEWORK.get('COUNT_CACHE_TIMEOUT')
+        if not timeout:
+            return super(CountingPaginator, self).count
+        key = self._get_cache_key()
+        result = cache.get(key)
+        if result is None:
+            result = super(CountingPaginator, self).count
+            cache.set(key, result, timeout)
+        return result
+
+    async def acount(self):
+        '''`count` for async views (using the async ORM and cache API); the result is stored as `count`'''
+        if 'count' in self.__dict__:
+            return self.count
+        result = None
+        threshold = settings.REST_FRAMEWORK.get('COUNT_ESTIMATE_THRESHOLD')
+        if threshold is not None:
+            estimate = await sync_to_async(self._estimate_count)()
+            if estimate is not None and estimate >= threshold:
+                self.count_is_exact = False
+                result = estimate
+
+        timeout = settings.REST_FRAMEWORK.get('COUNT_CACHE_TIMEOUT')
+        if result is None and timeout:
+            key = self._get_cache_key()
+            result = await cache.aget(key)
+            if result is None:
+                result = await self.object_list.acount()
+                await cache.aset(key, result, timeout)
+        elif result is None:
+            result = await self.object_list.acount()
+        self.__dict__['count'] = result
+        return result
+
+    def _get_cache_key(self):
+        sql, params = self.object_list.order_by().query.sql_with_params()
+        return 'muninn_django.count.%s' % hashlib.md5(repr((self.object_list.db, sql, params)).encode('utf-8')).hexdigest()
+
+    def _estimate_count(self):
+        queryset = self.object_list
+        if connections[queryset.db].vendor != 'postgresql':
+            return None
+        try:
+            # in a savepoint, so that a failing query does not abort the transaction of the request
+            # (e.g. with ATOMIC_REQUESTS)
+            with transaction.atomic(using=queryset.db):
+                if not queryset.query.where:
+                    with connections[queryset.db].cursor() as cursor:
+                        cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                                       [queryset.model._meta.db_table])
+                        row = cursor.fetchone()
+                    # reltuples is -1 (or 0) if the table has never been analyzed
+                    if row and row[0] > 0:
+                        return int(row[0])
+                    return None
+                plan = json.loads(queryset.order_by().explain(format='json'))
+            return int(plan[0]['Plan']['Plan Rows'])
+        except DatabaseError as e:
+            logger.warning('unable to estimate count: %s', e)
+            return None
+
+    def validate_number(self, number):
+        if self.count_is_exact:
+            return super(CountingPaginator, self).validate_number(number)
+        # an estimated count should not make existing pages unreachable
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        return number
+
 
 class PageNumberPagination(pagination.PageNumberPagination):
+    # the exact number of items, if already known to the view (e.g. from the validators of a conditional list)
+    known_count = None
+
+    def django_paginator_class(self, object_list, per_page, **kwargs):
+        return CountingPaginator(object_list, per_page, count=self.known_count, **kwargs)
 
     def __new__(cls, *args, **kwargs):
         max_page_size = settings.REST_FRAMEWORK.get('MAX_PAGE_SIZE')
@@ -15,3 +139,231 @@ class PageNumberPagination(pagination.PageNumberPagination):
             cls.max_page_size = max_page_size
             cls.page_size_query_param = settings.REST_FRAMEWORK.get('PAGE_SIZE_QUERY_PARAM', 'page_size')
         return super(PageNumberPagination, cls).__new__(cls, *args, **kwargs)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        '''`paginate_queryset` for async views'''
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        paginator = self.django_paginator_class(queryset, page_size)
+        await paginator.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            msg = self.invalid_page_message.format(page_number=page_number, message=str(exc))
+            raise NotFound(msg)
+        self.page.object_list = [item async for item in self.page.object_list]
+
+        if paginator.num_pages > 1 and self.template is not None:
+            # The browsable API should display pagination controls.
+            self.display_page_controls = True
+        return list(self.page)
+
+    def get_paginated_response(self, data):
+        if settings.REST_FRAMEWORK.get('COUNT_ESTIMATE_THRESHOLD') is None:
+            return super(PageNumberPagination, self).get_paginated_response(data)
+        return Response({
+            'count': self.page.paginator.count,
+            'count_is_exact': self.page.paginator.count_is_exact,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+
+def _get_field(model, path):
+    '''resolve a (possibly related) field given in django __ notation'''
+    field = None
+    for name in path.split('__'):
+        field = model._meta.get_field(name)
+        if field.is_relation:
+            model = field.related_model
+    if field.is_relation and field.concrete:
+        # foreign keys are compared on their primary key
+        field = field.target_field
+    return field
+
+
+def _get_value(instance, path):
+    '''get the value of a (possibly related) field given in django __ notation'''
+    if isinstance(instance, tuple):
+        # named tuple from `values_list`
+        return getattr(instance, path)
+    value = instance
+    for name in path.split('__'):
+        if value is None:
+            return None
+        try:
+            value = getattr(value, name)
+        except ObjectDoesNotExist:
+            # missing (optional) namespace
+            return None
+    if isinstance(value, Model):
+        value = value.pk
+    return value
+
+
+class _Row(Func):
+    '''row value `(a, b, ...)`, for row comparisons'''
+    function = ''
+    template = '(%(expressions)s)'
+    output_field = Field()
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+
+class CursorPagination(pagination.CursorPagination):
+    '''
+    Keyset pagination: each page is selected with a `WHERE (key) > (position)` row comparison instead of an
+    `OFFSET`, and no `COUNT(*)` is performed, so with an index on the key (e.g. `(validity_start, uuid)`) the cost of
+    a page does not depend on how deep it is.
+
+    The key is the ordering picked through the ordering filter (e.g. `RelatedOrderingFilter`), or the model's
+    default ordering, extended with the primary key to make it unique.
+    NULL values are sorted last in ascending order (and first in descending order); these are selected by a separate
+    `IS NULL` condition, since a row comparison is not true for them.
+    '''
+    ordering = None
+
+    def __new__(cls, *args, **kwargs):
+        max_page_size = settings.REST_FRAMEWORK.get('MAX_PAGE_SIZE')
+        if max_page_size:
+            cls.max_page_size = max_page_size
+            cls.page_size_query_param = settings.REST_FRAMEWORK.get('PAGE_SIZE_QUERY_PARAM', 'page_size')
+        return super(CursorPagination, cls).__new__(cls, *args, **kwargs)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self._get_page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self._set_page(list(queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        '''`paginate_queryset` for async views'''
+        queryset = self._get_page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self._set_page([item async for item in queryset])
+
+    def _get_page_queryset(self, queryset, request, view):
+        '''the (unevaluated) queryset of the requested page, or None if pagination is disabled'''
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.keys = [(term.lstrip('-'), term.startswith('-')) for term in self.ordering]
+        self.fields = [_get_field(queryset.model, name) for name, _ in self.keys]
+
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        keys = [(name, desc != reverse) for name, desc in self.keys]
+
+        if self.cursor is not None:
+            queryset = queryset.filter(self._get_keyset_filter(keys, self._decode_position(self.cursor.position)))
+        queryset = queryset.order_by(*[F(name).desc(nulls_first=True) if desc else F(name).asc(nulls_last=True)
+                                       for name, desc in keys])
+
+        # fetch one extra item to know whether there are more items
+        return queryset[:self.page_size + 1]
+
+    def _set_page(self, results):
+        reverse = self.cursor is not None and self.cursor.reverse
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.cursor is not None
+        return self.page
+
+    def get_ordering(self, request, queryset, view):
+        ordering = None
+        ordering_filters = [filter_cls for filter_cls in getattr(view, 'filter_backends', [])
+                            if hasattr(filter_cls, 'get_ordering')]
+        if ordering_filters:
+            ordering = ordering_filters[0]().get_ordering(request, queryset, view)
+        if not ordering:
+            ordering = self.ordering or queryset.model._meta.ordering
+        ordering = list(ordering)
+        # the primary key makes the key unique
+        pk_name = queryset.model._meta.pk.name
+        if pk_name not in [term.lstrip('-') for term in ordering] and 'pk' not in ordering:
+            ordering.append(pk_name)
+        return tuple(ordering)
+
+    def _get_keyset_filter(self, keys, position):
+        # (k1, k2, ...) > (v1, v2, ...)  <=>  k1 > v1 OR (k1 = v1 AND k2 > v2) OR ...
+        # consecutive keys with the same direction (and a non-NULL position) are compared as a single row value,
+        # which the database can use as the start of a range scan of an index on those keys
+        result = Q(pk__in=[])
+        equal = Q()
+        index = 0
+        while index < len(keys):
+            name, desc = keys[index]
+            if position[index] is None:
+                # NULL is the last value in ascending order
+                if desc:
+                    result |= equal & Q(**{'%s__isnull' % name: False})
+                equal &= Q(**{'%s__isnull' % name: True})
+                index += 1
+                continue
+
+            end = index + 1
+            while end < len(keys) and keys[end][1] == desc and position[end] is not None:
+                end += 1
+            names = [name for name, _ in keys[index:end]]
+            if len(names) == 1:
+                result |= equal & Q(**{'%s__%s' % (name, 'lt' if desc else 'gt'): position[index]})
+            else:
+                values = [Value(value, output_field=field)
+                          for field, value in zip(self.fields[index:end], position[index:end])]
+                lookup = LessThan if desc else GreaterThan
+                result |= equal & Q(lookup(_Row(*[F(name) for name in names]), _Row(*values)))
+            # the row comparison is not true for NULL keys, which follow the other values in ascending order
+            for name, field, value in zip(names, self.fields[index:end], position[index:end]):
+                if not desc and (field.null or '__' in name):
+                    result |= equal & Q(**{'%s__isnull' % name: True})
+                equal &= Q(**{name: value})
+            index = end
+        return result
+
+    def _decode_position(self, position):
+        try:
+            values = json.loads(position)
+            if len(values) != len(self.fields):
+                raise ValueError
+            return [None if value is None else field.to_python(value) for field, value in zip(self.fields, values)]
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def _get_position_from_instance(self, instance, ordering):
+        return json.dumps([_encode_value(_get_value(instance, name)) for name, _ in self.keys])
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        position = self._get_position_from_instance(self.page[-1], self.ordering) if self.page else \
+            self.cursor.position
+        return self.encode_cursor(pagination.Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        position = self._get_position_from_instance(self.page[0], self.ordering) if self.page else \
+            self.cursor.position
+        return self.encode_cursor(pagination.Cursor(offset=0, reverse=True, position=position))
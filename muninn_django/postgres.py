@@ -0,0 +1,196 @@
+#
+# Copyright (C) 2018-2022 S[&]T, The Netherlands.
+#
+
+from __future__ import absolute_import, division, print_function
+
+import hashlib
+
+from django.contrib.gis.db.models.functions import AsGeoJSON
+from django.db import connections
+from django.contrib.postgres.indexes import GistIndex
+from django.db.models import BooleanField, Case, F, Field, Func, OuterRef, Subquery, TextField, Value, When, JSONField
+from django.db.models.functions import Cast
+from django.db.models.lookups import GreaterThan
+from rest_framework import serializers
+from rest_framework_gis.fields import GeometryField
+
+from .geometry import GEOJSON_PRECISION
+from .serializers import TagField, GeoJSONField, is_plain_field, is_naive_iso_datetime_field
+
+
+class JSONBuildObject(Func):
+    '''json_build_object(key1, value1, ...); unlike jsonb, the json type keeps the order of the keys'''
+    function = 'json_build_object'
+    output_field = JSONField()
+    # postgresql functions accept at most 100 arguments
+    max_keys = 50
+
+    def __init__(self, pairs):
+        expressions = []
+        for key, value in pairs:
+            expressions.extend([Cast(Value(key), TextField()), value])
+        super(JSONBuildObject, self).__init__(*expressions)
+
+
+class JSONArray(Subquery):
+    '''JSON array of the (single column) results of a queryset; an empty array if there are no results'''
+    template = "(SELECT coalesce(json_agg(_items.item), '[]'::json) FROM (%(subquery)s) _items(item))"
+    output_field = JSONField()
+
+
+class ToJSON(Func):
+    '''cast text (e.g. GeoJSON) to json'''
+    template = '(%(expressions)s)::json'
+    output_field = JSONField()
+
+
+class ISODateTime(Func):
+    '''naive timestamp formatted like `datetime.isoformat()`'''
+    template = ('CASE WHEN date_trunc(\'second\', %(expressions)s) = %(expressions)s '
+                'THEN to_char(%(expressions)s, \'YYYY-MM-DD"T"HH24:MI:SS\') '
+                'ELSE to_char(%(expressions)s, \'YYYY-MM-DD"T"HH24:MI:SS.US\') END')
+    output_field = TextField()
+
+
+class IfExists(Func):
+    '''NULL if `condition` (an expression that is NULL if the namespace does not exist) is NULL'''
+    template = 'CASE WHEN %(condition)s IS NULL THEN NULL ELSE %(expressions)s END'
+    output_field = JSONField()
+
+    def __init__(self, condition, expression):
+        super(IfExists, self).__init__(condition, expression)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        condition, expression = self.get_source_expressions()
+        condition_sql, condition_params = compiler.compile(condition)
+        expression_sql, expression_params = compiler.compile(expression)
+        template = self.template % {'condition': condition_sql, 'expressions': expression_sql}
+        return template, tuple(condition_params) + tuple(expression_params)
+
+
+class TSRange(Func):
+    '''
+    tsrange(lower, upper, '[]'): range of naive timestamps, including both bounds (so that it is not empty if
+    lower = upper); a NULL bound is unbounded
+    '''
+    function = 'tsrange'
+    template = "%(function)s(%(expressions)s, '[]')"
+    output_field = Field()
+
+
+class Overlaps(Func):
+    '''`range && range`'''
+    template = '(%(expressions)s)'
+    arg_joiner = ' && '
+    output_field = BooleanField()
+
+
+def validity_range(start='validity_start', stop='validity_stop'):
+    '''
+    the validity of a product as a tsrange (as used by the `validity_overlaps` filter and its index); the bounds are
+    swapped if start > stop, for which tsrange() would raise an error. This is LEAST/GREATEST, except that a NULL
+    bound stays NULL (unbounded) instead of being ignored.
+    '''
+    reversed = GreaterThan(F(start), F(stop))
+    return TSRange(Case(When(reversed, then=F(stop)), default=F(start)),
+                   Case(When(reversed, then=F(start)), default=F(stop)))
+
+
+def index_name(table, suffix):
+    '''name for an index on `table`; index names are limited to 30 characters'''
+    digest = hashlib.md5(('%s_%s' % (table, suffix)).encode('utf-8')).hexdigest()
+    return '%s_%s_%s' % (table[:10], suffix[:12], digest[:6])
+
+
+def validity_range_index(model_class):
+    '''GiST expression index on the validity range of the products (see `validity_range`)'''
+    return GistIndex(validity_range(), name=index_name(model_class._meta.db_table, 'vrange'))
+
+
+class AsMVTGeom(Func):
+    '''
+    lon/lat geometry (or geography) transformed to the coordinate space of web mercator tile z/x/y (PostGIS 3.1+);
+    the geometry is clipped to the tile (plus `buffer`) first, since latitudes near the poles cannot be transformed
+    '''
+    template = ('ST_AsMVTGeom(ST_Transform(ST_ClipByBox2D((%(expressions)s)::geometry, ST_Transform(%(clip_envelope)s, '
+                '4326)), 3857), %(envelope)s, %(extent)d, %(buffer)d)')
+    # the geometry itself (not the WKB selected for a GeometryField) is needed by ST_AsMVT
+    output_field = Field()
+
+    def __init__(self, expression, z, x, y, extent=4096, buffer=256):
+        envelope = 'ST_TileEnvelope(%d, %d, %d)' % (z, x, y)
+        clip_envelope = 'ST_TileEnvelope(%d, %d, %d, margin => %r)' % (z, x, y, buffer / extent)
+        super(AsMVTGeom, self).__init__(expression, envelope=envelope, clip_envelope=clip_envelope, extent=extent,
+                                        buffer=buffer)
+
+
+def mvt_tile(queryset, z, x, y, layer, attributes, extent=4096, buffer=256):
+    '''
+    Return a Mapbox Vector Tile (bytes) with a layer with the footprints (and `attributes`) of the products in
+    `queryset`, rendered by PostGIS (ST_AsMVT)
+    '''
+    geometry = AsMVTGeom(F('footprint'), z, x, y, extent, buffer)
+    queryset = queryset.prefetch_related(None).order_by().annotate(mvt_geometry=geometry)
+    sql, params = queryset.values(*(list(attributes) + ['mvt_geometry'])).query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute('SELECT ST_AsMVT(_tile, %%s, %d, %%s) FROM (%s) _tile' % (extent, sql),
+                       (layer, 'mvt_geometry') + tuple(params))
+        tile = cursor.fetchone()[0]
+    return bytes(tile) if tile is not None else b''
+
+
+def _field_expression(field, path):
+    '''return an expression that renders the value of a serializer field in the database, or None'''
+    field_class = type(field)
+    if is_plain_field(field) or field_class.to_representation is serializers.FloatField.to_representation:
+        return F(path)
+    if field_class.to_representation is serializers.UUIDField.to_representation and field.uuid_format == 'hex_verbose':
+        return F(path)
+    if is_naive_iso_datetime_field(field):
+        return ISODateTime(F(path))
+    if isinstance(field, GeoJSONField):
+        return ToJSON(F(path))
+    if field_class is GeometryField and field.precision is None and field.transform is None and \
+            not field.auto_bbox and not field.remove_dupes:
+        return ToJSON(AsGeoJSON(F(path), precision=GEOJSON_PRECISION))
+    return None
+
+
+def json_expression(serializer, prefix=''):
+    '''
+    Return an expression that builds the representation of a product (as returned by `serializer`) in the database,
+    or None if that is not possible for this serializer (i.e. it has custom fields).
+    '''
+    if type(serializer).to_representation is not serializers.Serializer.to_representation:
+        return None
+    model_class = serializer.Meta.model
+    pairs = []
+    for field in serializer._readable_fields:
+        if field.source == '*' or '.' in field.source:
+            return None
+        path = prefix + field.source
+        if isinstance(field, serializers.BaseSerializer):
+            if getattr(field, 'many', False):
+                return None
+            expression = json_expression(field, prefix=path + '__')
+            if expression is None:
+                return None
+            expression = IfExists(F(path + '__pk'), expression)
+        elif isinstance(field, TagField) and not prefix:
+            tag_class = model_class._meta.get_field(field.source).related_model
+            expression = JSONArray(tag_class.objects.filter(product=OuterRef('pk')).order_by().values('tag'))
+        elif isinstance(field, serializers.ManyRelatedField) and field.source == 'source_products' and not prefix:
+            if not isinstance(field.child_relation, serializers.PrimaryKeyRelatedField) or \
+                    field.child_relation.pk_field is not None:
+                return None
+            link_class = model_class._meta.get_field('source_links').related_model
+            expression = JSONArray(link_class.objects.filter(product=OuterRef('pk')).order_by().values('source'))
+        else:
+            expression = _field_expression(field, path)
+            if expression is None:
+                return None
+        pairs.append((field.field_name, expression))
+    if len(pairs) > JSONBuildObject.max_keys:
+        return None
+    return JSONBuildObject(pairs)
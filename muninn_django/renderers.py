@@ -0,0 +1,90 @@
+#
+# Copyright (C) 2018-2022 S[&]T, The Netherlands.
+#
+
+from __future__ import absolute_import, division, print_function
+
+import csv
+import io
+import json
+
+from rest_framework import renderers, serializers
+from rest_framework.utils import encoders
+
+
+class StreamingRenderer(renderers.BaseRenderer):
+    '''
+    Base class for renderers that can render a list of products one chunk at a time,
+    so that a full query result can be streamed (see `ProductViewSet.list`).
+    '''
+    charset = 'utf-8'
+
+    def get_header(self, serializer):
+        return None
+
+    def render_header(self, header):
+        return b''
+
+    def render_rows(self, rows, header=None):
+        raise NotImplementedError
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        header = list(rows[0].keys()) if rows and isinstance(rows[0], dict) else None
+        return self.render_header(header) + self.render_rows(rows, header)
+
+
+class NDJSONRenderer(StreamingRenderer):
+    '''newline delimited JSON: one product per line'''
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def render_rows(self, rows, header=None):
+        return b''.join([json.dumps(row, cls=encoders.JSONEncoder, ensure_ascii=False).encode(self.charset) + b'\n'
+                         for row in rows])
+
+
+class CSVRenderer(StreamingRenderer):
+    '''CSV with one product per line; namespace fields are flattened to `<namespace>.<field>` columns'''
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def get_header(self, serializer):
+        header = []
+        for name, field in serializer.fields.items():
+            if isinstance(field, serializers.BaseSerializer) and not getattr(field, 'many', False):
+                header.extend(['%s.%s' % (name, child_name) for child_name in field.fields.keys()])
+            else:
+                header.append(name)
+        return header
+
+    def render_header(self, header):
+        if not header:
+            return b''
+        return self._write([header])
+
+    def render_rows(self, rows, header=None):
+        return self._write([[self._format(self._get_value(row, name)) for name in header] for row in rows])
+
+    def _get_value(self, row, name):
+        if name in row:
+            return row[name]
+        # flattened namespace field
+        ns, _, field_name = name.partition('.')
+        return (row.get(ns) or {}).get(field_name)
+
+    def _format(self, value):
+        if value is None:
+            return ''
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+        if isinstance(value, (dict, list)):
+            return json.dumps(value, cls=encoders.JSONEncoder, ensure_ascii=False)
+        return value
+
+    def _write(self, lines):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(lines)
+        return buffer.getvalue().encode(self.charset)
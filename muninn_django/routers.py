@@ -5,13 +5,19 @@
 from __future__ import absolute_import, division, print_function
 
 from django.conf import settings
+from django.urls import re_path
 from django.utils.module_loading import import_string
 from rest_framework.routers import DefaultRouter, Route
 
 from . import views
+from .async_views import AsyncProductViewSet
+from .metrics import metrics_view
 
 
 class MuninnRouter(DefaultRouter):
+    # viewset class that the viewsets of the archives are derived from (unless the `view` setting is used)
+    product_view_class = views.ProductViewSet
+
     def __init__(self, muninn_archive=None, *args, **kwargs):
         '''
         `muninn_archive` specifies an archive (defined in the settings) that will be registered automatically.
@@ -37,6 +43,22 @@ class MuninnRouter(DefaultRouter):
             del route_kwargs['detail']
             product_name_route = Route(**route_kwargs)
         self.routes.append(product_name_route)
+        # Add route for Mapbox Vector Tiles of the product footprints
+        route_kwargs = {
+            'url': u'^{prefix}/tiles/(?P<z>[0-9]+)/(?P<x>[0-9]+)/(?P<y>[0-9]+)\\.mvt$',
+            'mapping': {u'get': u'tiles'},
+            'name': u'{basename}-tiles',
+            'detail': False,
+            'initkwargs': {u'suffix': u'Tiles'}
+        }
+        try:
+            tiles_route = Route(**route_kwargs)
+        except TypeError:
+            del route_kwargs['detail']
+            tiles_route = Route(**route_kwargs)
+        self.routes.append(tiles_route)
+        # set if an archive has the `metrics` setting enabled
+        self.metrics = False
 
         if muninn_archive:
             self.register_muninn(muninn_archive, prefix='')
@@ -50,5 +72,23 @@ class MuninnRouter(DefaultRouter):
         if not view_class:
             model_class = import_string(config['models']['core'])
             queryset = model_class.objects.all()
-            view_class = views.ProductViewSetFactory.get(archive, queryset, )
+            view_class = views.ProductViewSetFactory.get(archive, queryset, self.product_view_class)
+        if config.get('metrics'):
+            self.metrics = True
         self.register(prefix, view_class, archive)
+
+    def get_urls(self):
+        '''
+        Add a `metrics` route (in the Prometheus text format) if enabled for any of the archives
+        '''
+        urls = super(MuninnRouter, self).get_urls()
+        if self.metrics:
+            urls.insert(0, re_path(r'^metrics$', metrics_view, name='muninn-metrics'))
+        return urls
+
+
+class AsyncMuninnRouter(MuninnRouter):
+    '''
+    Router for ASGI deployments: the archives are served (read-only) by `AsyncProductViewSet`
+    '''
+    product_view_class = AsyncProductViewSet
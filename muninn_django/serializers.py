@@ -4,14 +4,22 @@
 
 from __future__ import absolute_import, division, print_function
 
+import json
 from datetime import datetime
 
 from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Manager, Q
 from django.utils.module_loading import import_string
-from rest_framework import serializers
+from rest_framework import serializers, ISO_8601
+from rest_framework.settings import api_settings
+from rest_framework.validators import UniqueTogetherValidator
 
 from muninn_django.naiveutcdatetime.serializers import NaiveDateTimeSerializerMixin
 from .errors import BadRequest
+from .geometry import wrap_geometries
 
 
 class NamespaceSerializerFactory(object):
@@ -54,18 +62,19 @@ class ProductSerializerFactory(object):
 
         if not base_class_path:
             base_class_path = settings.MUNINN[archive]['serializers'][mode]
-        base_class = import_string(base_class_path)
-        model_class = import_string(settings.MUNINN[archive]['models']['core'])
         name = base_class_path[base_class_path.rfind('.')+1:]
-        disabled_fields = tuple(settings.MUNINN[archive].get('disabled_fields', {}).get('core', ()))
-        wants_tags = 'tags' in base_class._declared_fields.keys()
-        wants_source_products = not (hasattr(base_class.Meta, 'exclude') and 'source_products' in base_class.Meta.exclude)
 
         # check factory cache
         cache_key = '%s.%s.%s' % (__name__, archive, name)
         if cache_key in cls._dynamic_product_serializers:
             return cls._dynamic_product_serializers[cache_key]
 
+        base_class = import_string(base_class_path)
+        model_class = import_string(settings.MUNINN[archive]['models']['core'])
+        disabled_fields = tuple(settings.MUNINN[archive].get('disabled_fields', {}).get('core', ()))
+        wants_tags = 'tags' in base_class._declared_fields.keys()
+        wants_source_products = not (hasattr(base_class.Meta, 'exclude') and 'source_products' in base_class.Meta.exclude)
+
         # build list of custom namespaces
         muninn_namespaces = getattr(base_class.Meta, 'muninn_namespaces', None)
         if not muninn_namespaces:
@@ -98,10 +107,9 @@ class ProductSerializerFactory(object):
         body['Meta'] = meta_class
         if wants_source_products:
             # This allows our many-to-many relationship to become writable, see https://stackoverflow.com/questions/48624793/
-            body['source_products'] = serializers.PrimaryKeyRelatedField(
-                many=True,
+            body['source_products'] = SourceProductsField(
+                child_relation=serializers.PrimaryKeyRelatedField(queryset=model_class.objects.all()),
                 required=False,
-                queryset=model_class.objects.all(),
                 # style={'base_template': 'input.html'}, # avoids loading all products in the Browsable API
                 style={'base_template': 'list_field.html'}, # disable field in the Browsable API
             )
@@ -116,6 +124,97 @@ class ProductSerializerFactory(object):
         return newclass
 
 
+class SourceProductsField(serializers.ManyRelatedField):
+    '''Serializer field for list of source products; looks up all products in a single query'''
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+
+        queryset = self.child_relation.get_queryset()
+        pk_field = queryset.model._meta.pk
+        pks = []
+        for item in data:
+            try:
+                if isinstance(item, bool):
+                    raise TypeError
+                pks.append(pk_field.to_python(item))
+            except (TypeError, ValueError, DjangoValidationError):
+                self.child_relation.fail('incorrect_type', data_type=type(item).__name__)
+        # for bulk creation, the source products of all products are looked up at once by the list serializer
+        products = getattr(self.parent.parent, '_source_products', None)
+        if products is None:
+            products = queryset.in_bulk(pks)
+        for pk in pks:
+            if pk not in products:
+                self.child_relation.fail('does_not_exist', pk_value=pk)
+        return [products[pk] for pk in pks]
+
+
+class GeoJSONField(serializers.Field):
+    '''Read-only serializer field for geometries that are rendered as GeoJSON text by the database'''
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super(GeoJSONField, self).__init__(**kwargs)
+
+    def to_representation(self, value):
+        return json.loads(value)
+
+
+class WrappedFootprintField(serializers.Field):
+    '''
+    Read-only serializer field with the footprint as returned by `muninn_django.geometry.wrap_geometry`.
+    The wrapped footprints are stored in the Django cache per (uuid, metadata_date), so each footprint is only
+    wrapped again when the product metadata changes.
+    '''
+    # model fields that are needed to compute the representation
+    model_fields = ('metadata_date', 'footprint')
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        kwargs['source'] = '*'
+        super(WrappedFootprintField, self).__init__(**kwargs)
+        self._prepared = {}
+
+    def _get_cache_key(self, instance):
+        metadata_date = instance.metadata_date.isoformat() if instance.metadata_date is not None else None
+        return 'muninn_django.wrapped_footprint.%s.%s.%s' % (instance._meta.label, instance.pk, metadata_date)
+
+    def _wrap(self, footprints):
+        return [None if geometry is None else json.loads(geometry.json) for geometry in wrap_geometries(footprints)]
+
+    def prepare(self, instances):
+        '''look up (or wrap) the footprints of a list of products at once'''
+        keys = {self._get_cache_key(instance): instance for instance in instances
+                if instance.footprint is not None}
+        self._prepared = cache.get_many(list(keys.keys()))
+        missing = [key for key in keys if key not in self._prepared]
+        if missing:
+            wrapped = dict(zip(missing, self._wrap([keys[key].footprint for key in missing])))
+            cache.set_many(wrapped)
+            self._prepared.update(wrapped)
+
+    def to_representation(self, instance):
+        if instance.footprint is None:
+            return None
+        key = self._get_cache_key(instance)
+        if key not in self._prepared:
+            self.prepare([instance])
+        return self._prepared[key]
+
+
+def _prepare_fields(serializer, data):
+    '''let fields that support it (see `WrappedFootprintField.prepare`) process all items of a list at once'''
+    fields = [field for field in serializer._readable_fields if hasattr(field, 'prepare')]
+    if not fields:
+        return data
+    data = list(data.all() if isinstance(data, Manager) else data)
+    for field in fields:
+        field.prepare(data)
+    return data
+
+
 class TagField(serializers.ListField):
     '''Serializer field for list of product tags'''
     child = serializers.CharField()
@@ -123,6 +222,142 @@ class TagField(serializers.ListField):
         return [tag.tag for tag in obj.all()]
 
 
+def _set_prefetched(instance, name, objects):
+    '''fill the prefetch cache of a related manager, so that serializing the instance does not query the database'''
+    queryset = getattr(instance, name).all()
+    queryset._result_cache = list(objects)
+    queryset._prefetch_done = True
+    if not hasattr(instance, '_prefetched_objects_cache'):
+        instance._prefetched_objects_cache = {}
+    instance._prefetched_objects_cache[name] = queryset
+
+
+class ProductListSerializer(serializers.ListSerializer):
+    '''
+    List serializer that creates all products (with tags, links and namespaces) in a single transaction,
+    using one bulk insert per table.
+
+    Validation also takes a fixed number of queries: the source products of all products are looked up at once,
+    and uniqueness (`unique_together`) is checked against the existing products with a single query, and against
+    the preceding products in the list.
+    '''
+    # set by `to_internal_value`
+    _source_products = None
+    _unique_together = ()
+
+    def to_representation(self, data):
+        return super(ProductListSerializer, self).to_representation(_prepare_fields(self.child, data))
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            self._prepare_validation([item for item in data if isinstance(item, dict)])
+        return super(ProductListSerializer, self).to_internal_value(data)
+
+    def _prepare_validation(self, data):
+        model_class = self.child.Meta.model
+
+        # source products
+        pk_field = model_class._meta.pk
+        pks = set()
+        for item in data:
+            source_products = item.get('source_products')
+            if isinstance(source_products, list):
+                for pk in source_products:
+                    try:
+                        pks.add(pk_field.to_python(pk))
+                    except (TypeError, ValueError, DjangoValidationError):
+                        pass
+        self._source_products = model_class.objects.in_bulk(pks) if pks else {}
+
+        # existing products that have the same value for the last field of a unique set as any of the products
+        self._unique_together = [tuple(names) for names in model_class._meta.unique_together
+                                 if all(name in self.child.fields for name in names)]
+        self._existing_keys = [set() for names in self._unique_together]
+        # keys of the products validated so far
+        self._keys = [set() for names in self._unique_together]
+        condition = Q()
+        for names in self._unique_together:
+            values = set(self._get_field_value(item, names[-1]) for item in data) - set([None])
+            if values:
+                condition |= Q(**{'%s__in' % names[-1]: values})
+        if condition:
+            field_names = sorted(set(name for names in self._unique_together for name in names))
+            for row in model_class.objects.filter(condition).values(*field_names):
+                for names, keys in zip(self._unique_together, self._existing_keys):
+                    keys.add(tuple(row[name] for name in names))
+
+    def _get_field_value(self, item, name):
+        '''the validated value of a field of an (unvalidated) item, or None if missing or invalid'''
+        value = item.get(name)
+        if value is None:
+            return None
+        try:
+            return self.child.fields[name].to_internal_value(value)
+        except (serializers.ValidationError, DjangoValidationError, TypeError, ValueError):
+            return None
+
+    def run_child_validation(self, data):
+        validated_data = super(ProductListSerializer, self).run_child_validation(data)
+        # as `UniqueTogetherValidator`, which is not used for the items of the list
+        for names, existing_keys, keys in zip(self._unique_together, self._existing_keys, self._keys):
+            key = tuple(validated_data.get(name) for name in names)
+            if None in key:
+                continue
+            if key in existing_keys or key in keys:
+                message = UniqueTogetherValidator.message.format(field_names=', '.join(names))
+                raise serializers.ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [message]}, code='unique')
+            keys.add(key)
+        return validated_data
+
+    def create(self, validated_data):
+        model_class = self.child.Meta.model
+        tag_class = model_class._meta.get_field('tags').related_model
+        link_class = model_class._meta.get_field('source_links').related_model
+        unvalidated_data = self.initial_data
+
+        # extract nested data
+        instances = []
+        tags = []
+        links = []
+        namespaces = dict((ns, []) for ns in self.child.Meta.muninn_namespaces)
+        metadata_date = datetime.utcnow()
+        for data, raw_data in zip(validated_data, unvalidated_data):
+            ns_data = self.child._extract_namespace_data(data, raw_data)
+            tags_data = data.pop('tags', [])
+            source_products = data.pop('source_products', [])
+            if not 'active' in data:
+                data['active'] = True
+            data['metadata_date'] = metadata_date
+
+            instance = model_class(**data)
+            instances.append(instance)
+            instance_tags = [tag_class(product=instance, tag=tag) for tag in tags_data]
+            tags.extend(instance_tags)
+            links.extend([link_class(product=instance, source=source) for source in source_products])
+            _set_prefetched(instance, 'tags', instance_tags)
+            _set_prefetched(instance, 'source_products', source_products)
+            for ns, values in ns_data.items():
+                ns_instance = None
+                if values is not None:
+                    ns_instance = self.child.fields[ns].Meta.model(_core=instance, **values)
+                    namespaces[ns].append(ns_instance)
+                model_class._meta.get_field(ns).set_cached_value(instance, ns_instance)
+
+        try:
+            with transaction.atomic(using=model_class.objects.db):
+                model_class.objects.bulk_create(instances)
+                tag_class.objects.bulk_create(tags)
+                link_class.objects.bulk_create(links)
+                for ns, ns_instances in namespaces.items():
+                    if ns_instances:
+                        self.child.fields[ns].Meta.model.objects.bulk_create(ns_instances)
+        except IntegrityError as e:
+            # e.g. duplicate products within the request itself
+            raise BadRequest('unable to create products: %s' % e)
+
+        return instances
+
+
 class ProductCompleteSerializer(serializers.ModelSerializer):
     '''
     Serializer that returns the complete set of metadata (core, links, tags, and custom namespaces).
@@ -134,9 +369,18 @@ class ProductCompleteSerializer(serializers.ModelSerializer):
         model = None  # will be set by ProductSerializerFactory
         exclude = ()
         muninn_namespaces = ()  # will be set to all namespaces by ProductSerializerFactory
-
-    def _extract_namespace_data(self, validated_data):
-        unvalidated_data = self.context['request'].data
+        list_serializer_class = ProductListSerializer
+
+    def get_validators(self):
+        validators = super(ProductCompleteSerializer, self).get_validators()
+        if isinstance(self.parent, ProductListSerializer):
+            # uniqueness is checked for all products at once by the list serializer
+            validators = [validator for validator in validators if not isinstance(validator, UniqueTogetherValidator)]
+        return validators
+
+    def _extract_namespace_data(self, validated_data, unvalidated_data=None):
+        if unvalidated_data is None:
+            unvalidated_data = self.context['request'].data
         result = {}
         for ns in self.Meta.muninn_namespaces:
             result[ns] = validated_data.pop(ns, None)
@@ -159,12 +403,12 @@ class ProductCompleteSerializer(serializers.ModelSerializer):
         instance = super(ProductCompleteSerializer, self).create(validated_data)
 
         # add tags
-        for tag in tags_data:
-            instance.tags.create(tag=tag)
+        tag_class = instance.tags.model
+        tag_class.objects.bulk_create([tag_class(product=instance, tag=tag) for tag in tags_data])
 
         # add sources
-        for source in source_products:
-            instance.source_links.create(source=source)
+        link_class = instance.source_links.model
+        link_class.objects.bulk_create([link_class(product=instance, source=source) for source in source_products])
 
         # create custom namespaces
         for ns, data in ns_data.items():
@@ -189,23 +433,19 @@ class ProductCompleteSerializer(serializers.ModelSerializer):
 
         # update tags
         if tags_data is not None:
-            existing = [tag.tag for tag in instance.tags.all()]
-            for tag in instance.tags.all():
-                if tag.tag not in tags_data:
-                    tag.delete()
-            for tag in tags_data:
-                if tag not in existing:
-                    instance.tags.create(tag=tag)
+            instance.tags.exclude(tag__in=tags_data).delete()
+            tag_class = instance.tags.model
+            tag_class.objects.bulk_create([tag_class(product=instance, tag=tag) for tag in tags_data],
+                                          ignore_conflicts=True)
+            getattr(instance, '_prefetched_objects_cache', {}).pop('tags', None)
 
         # update sources
         if source_products is not None:
-            existing = list(instance.source_products.all())
-            for link in instance.source_links.all():
-                if link.source not in source_products:
-                    link.delete()
-            for source in source_products:
-                if source not in existing:
-                    instance.source_links.create(source=source)
+            instance.source_links.exclude(source__in=source_products).delete()
+            link_class = instance.source_links.model
+            link_class.objects.bulk_create([link_class(product=instance, source=source) for source in source_products],
+                                           ignore_conflicts=True)
+            getattr(instance, '_prefetched_objects_cache', {}).pop('source_products', None)
 
         # update custom namespaces
         for ns, data in ns_data.items():
@@ -221,8 +461,138 @@ class ProductCompleteSerializer(serializers.ModelSerializer):
         return instance
 
 
+# serializer field types for which the database value can be used as-is
+_PLAIN_FIELDS = (serializers.CharField, serializers.IntegerField, serializers.BooleanField)
+
+
+def is_plain_field(field):
+    '''True if `field.to_representation` returns (not None) database values unchanged'''
+    to_representation = type(field).to_representation
+    if to_representation in [plain_class.to_representation for plain_class in _PLAIN_FIELDS]:
+        return True
+    bigint_class = getattr(serializers, 'BigIntegerField', None)  # since DRF 3.16
+    if bigint_class is not None and to_representation is bigint_class.to_representation:
+        return not getattr(field, 'coerce_to_string', getattr(api_settings, 'COERCE_BIGINT_TO_STRING', False))
+    return False
+
+
+def is_naive_iso_datetime_field(field):
+    '''True if `field` represents (naive) datetimes as `datetime.isoformat()`'''
+    if type(field).to_representation is not serializers.DateTimeField.to_representation:
+        return False
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+    return output_format is not None and output_format.lower() == ISO_8601 and field_timezone is None
+
+
+def _get_converter(field):
+    '''return a function that converts a (not None) database value like `field.to_representation`'''
+    if is_plain_field(field):
+        return None
+    if type(field).to_representation is serializers.UUIDField.to_representation and field.uuid_format == 'hex_verbose':
+        return str
+    if is_naive_iso_datetime_field(field):
+        to_representation = field.to_representation
+        return lambda value: value.isoformat() if value.tzinfo is None else to_representation(value)
+    return field.to_representation
+
+
+def _get_values_plan(serializer, prefix=''):
+    '''
+    Return a list of `(field_name, path, converter)` for all fields of a serializer, or None if the serializer
+    can not be used with `values_list` (i.e. it has custom fields).
+    For nested (namespace) serializers, `converter` is the plan of the nested serializer and `path` points to its
+    primary key (which is None if the namespace does not exist for the product).
+    '''
+    if type(serializer).to_representation is not serializers.Serializer.to_representation:
+        return None
+    plan = []
+    for field in serializer._readable_fields:
+        if field.source == '*' or '.' in field.source:
+            return None
+        path = prefix + field.source
+        if isinstance(field, serializers.BaseSerializer):
+            if getattr(field, 'many', False):
+                return None
+            nested_plan = _get_values_plan(field, prefix=path + '__')
+            if nested_plan is None:
+                return None
+            plan.append((field.field_name, path + '__pk', nested_plan))
+        elif isinstance(field, serializers.Field) and not isinstance(field, (serializers.RelatedField, serializers.ManyRelatedField, serializers.ListField, serializers.SerializerMethodField, serializers.DictField)):
+            plan.append((field.field_name, path, _get_converter(field)))
+        else:
+            return None
+    return plan
+
+
+class ValuesListSerializer(serializers.ListSerializer):
+    '''
+    List serializer that can also represent rows fetched with `values_list(*get_values_paths())`, which avoids
+    building model instances and calling `get_attribute` for every field.
+    The result is identical to serializing model instances.
+    '''
+    def get_values_paths(self):
+        plan = self._get_plan()
+        if plan is None:
+            return None
+        paths = []
+
+        def add_paths(plan):
+            for name, path, converter in plan:
+                paths.append(path)
+                if isinstance(converter, list):
+                    add_paths(converter)
+        add_paths(plan)
+        return paths
+
+    def _get_plan(self):
+        if not hasattr(self, '_values_plan'):
+            self._values_plan = _get_values_plan(self.child)
+        return self._values_plan
+
+    def to_representation(self, data):
+        if not isinstance(data, (list, tuple)) or not data or not isinstance(data[0], tuple):
+            return super(ValuesListSerializer, self).to_representation(_prepare_fields(self.child, data))
+
+        # compile the plan into (key, index, converter) steps
+        def compile_plan(plan, index):
+            steps = []
+            for name, path, converter in plan:
+                if isinstance(converter, list):
+                    nested_steps, next_index = compile_plan(converter, index + 1)
+                    steps.append((name, index, nested_steps))
+                    index = next_index
+                else:
+                    steps.append((name, index, converter))
+                    index += 1
+            return steps, index
+        steps, _ = compile_plan(self._get_plan(), 0)
+
+        def convert(row, steps):
+            result = {}
+            for name, index, converter in steps:
+                value = row[index]
+                if value is None:
+                    result[name] = None
+                elif converter is None:
+                    result[name] = value
+                elif isinstance(converter, list):
+                    result[name] = convert(row, converter)
+                else:
+                    result[name] = converter(value)
+            return result
+
+        return [convert(row, steps) for row in data]
+
+
 class ProductCoreSerializer(serializers.ModelSerializer):
     '''Serializer that returns just the core metadata'''
     class Meta(object):
         exclude = ('source_products', )
         muninn_namespaces = ('core', )
+        list_serializer_class = ValuesListSerializer
+
+
+class ProductWrappedFootprintSerializer(ProductCoreSerializer):
+    '''Serializer that returns the core metadata and the footprint wrapped for 2D maps'''
+    wrapped_footprint = WrappedFootprintField()
@@ -12,6 +12,7 @@ from django.conf import settings
 DEFAULT_SERIALIZERS = {
     'default': 'muninn_django.serializers.ProductCoreSerializer',
     'extended': 'muninn_django.serializers.ProductCompleteSerializer',
+    'wrapped': 'muninn_django.serializers.ProductWrappedFootprintSerializer',
 }
 
 def patch_defaults():
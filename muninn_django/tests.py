@@ -1,9 +1,1122 @@
 #
 # Copyright (C) 2018-2022 S[&]T, The Netherlands.
 #
+'''
+Tests against the test archive of `tests/testarchive`; run with `python tests/runtests.py`.
+'''
 
 from __future__ import absolute_import, division, print_function
 
-from django.test import TestCase
+import csv
+import datetime
+import json
+import math
+import sys
+from io import StringIO
+from random import Random
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.contrib.gis.geos import LineString, Polygon
+from django.db.models import F, TextField
+from django.db.models.functions import Cast
+from django.http import StreamingHttpResponse
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_gis.fields import GeometryField
+
+from muninn_django.caching import invalidate
+from muninn_django.filters import BBoxField, ProductFilterFactory
+from muninn_django.geometry import GEOJSON_PRECISION, bbox_polygons, reduced_geojson, wrap_geometries, wrap_geometry
+from muninn_django.naiveutcdatetime.parse import NAIVE_DATE_FORMATS, NAIVE_DATETIME_FORMATS, parse_date, parse_datetime
+from muninn_django.pagination import CountingPaginator
+from muninn_django.postgres import index_name, validity_range
+from muninn_django.serializers import ProductSerializerFactory, WrappedFootprintField
+from muninn_django.views import ProductViewSet, ProductViewSetFactory
+
+from testarchive.models import SPATIAL, Core, Link, Stuff, Tag
+
+PRODUCTS = 25
+
+
+def create_products(count=PRODUCTS):
+    '''
+    Products p000, p001, ... of types T0, T1, T2, with a tag t0 or t1; every fourth product has no `stuff`
+    namespace, and products p003 and p010 have no validity start.
+    '''
+    for index in range(count):
+        validity_start = datetime.datetime(2020, 1, 1 + index % 20, index % 24)
+        product = Core.objects.create(active=True, metadata_date=datetime.datetime(2020, 1, 1),
+                                      product_type='T%d' % (index % 3), product_name='p%03d' % index,
+                                      physical_name='p%03d.dat' % index, size=index,
+                                      validity_start=None if index in (3, 10) else validity_start,
+                                      validity_stop=validity_start + datetime.timedelta(hours=1))
+        if index % 4:
+            Stuff.objects.create(_core=product, text_value='s%d' % index, long_value=index % 5)
+        Tag.objects.create(product=product, tag='t%d' % (index % 2))
+
+
+def archive_settings(archive='archive', **config):
+    '''`override_settings` with additional (`MUNINN`) settings for an archive'''
+    return override_settings(MUNINN=dict(settings.MUNINN, **{archive: dict(settings.MUNINN[archive], **config)}))
+
+
+def consume(response):
+    '''the content of a (possibly streaming, possibly async) response'''
+    if not response.streaming:
+        return response.content
+    if response.is_async:
+        async def join(chunks):
+            return b''.join([chunk async for chunk in chunks])
+        return async_to_sync(join)(response.streaming_content)
+    return b''.join(response.streaming_content)
+
+
+class ProductTestCase(TestCase):
+    def setUp(self):
+        create_products()
+        cache.clear()
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_json(self, url, **kwargs):
+        response = self.client.get(url, kwargs, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def post(self, url, data):
+        return self.client.post(url, json.dumps(data), content_type='application/json')
+
+
+def strptime_parse(value, formats):
+    '''the original parser: the first of `formats` that matches'''
+    for fmt in formats:
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except Exception:
+            continue
+    return None
+
+
+class ParseTest(SimpleTestCase):
+    VALUES = [
+        '2018-02-12T16:41:07.123456', '2018-02-12T16:41:07.1', '2018-02-12T16:41:07.12345', '2018-02-12T16:41:07',
+        '2018-02-12T16:41:07.', '2018-02-12T16:41:07.1234567', '2018-02-12T16:41', '2018-02-12T16', '2018-02-12T',
+        '2018-02-12', '20180212T164107.123', '20180212T164107', '20180212T1641', '20180212', '2018021',
+        '2018-02-12t16:41:07', '2018-02-12 16:41:07', '2018-02-12T16:41:07Z', '2018-02-12T16:41:07+00:00',
+        '2018-2-12T16:41:07', '2018-02-12T6:41:07', '2018-02-1', '201802120', '2018-0212', '201802-12',
+        '2018-02-12T164107', '20180212T16:41:07', '2020-02-29', '2019-02-29', '2018-13-01', '2018-00-10',
+        '2018-02-12T24:00:00', '2018-02-12T23:60:00', '2018-02-12T23:59:60', '2018-02-12T23:59:61',
+        '0001-01-01T00:00:00', '9999-12-31T23:59:59.999999', '0000-01-01', ' 2018-02-12', '2018-02-12 ',
+        '2018-02-12\n', '\uff12\uff10\uff11\uff18-02-12', '2018-02-12T16:41:07.\u0661', '+2018-02-12',
+        '-2018-02-12', '2018-02-12T16:41:07,123', '', 'invalid', None, 20180212, b'2018-02-12',
+    ]
+
+    def check(self, value):
+        self.assertEqual(parse_datetime(value), strptime_parse(value, NAIVE_DATETIME_FORMATS), repr(value))
+        expected = strptime_parse(value, NAIVE_DATE_FORMATS)
+        self.assertEqual(parse_date(value), expected.date() if expected is not None else None, repr(value))
+
+    def test_edge_cases(self):
+        for value in self.VALUES:
+            self.check(value)
+
+    def test_random(self):
+        # random variations of the supported forms
+        random = Random(0)
+        forms = ['%04d-%02d-%02dT%02d:%02d:%02d', '%04d%02d%02dT%02d%02d%02d', '%d-%d-%dT%d:%d:%d', '%04d-%02d-%02d',
+                 '%04d%02d%02d']
+        for _ in range(5000):
+            form = random.choice(forms)
+            fields = (random.randint(0, 10000), random.randint(0, 13), random.randint(0, 32), random.randint(0, 25),
+                      random.randint(0, 61), random.randint(0, 61))
+            value = form % fields[:form.count('%')]
+            if 'T' in form and random.random() < 0.5:
+                value += '.' + ''.join(random.choice('0123456789') for _ in range(random.randint(0, 7)))
+            self.check(value)
+
+
+class ValuesSerializationTest(ProductTestCase):
+    def test_same_as_instances(self):
+        for mode in ('default', 'stuff'):
+            serializer_class = ProductSerializerFactory.get('archive', mode=mode)
+            paths = serializer_class(many=True).get_values_paths()
+            self.assertIsNotNone(paths)
+            rows = list(Core.objects.order_by('product_name').values_list(*paths, named=True))
+            instances = list(Core.objects.order_by('product_name').select_related(
+                *serializer_class.Meta.select_related))
+            data = serializer_class(rows, many=True).data
+            self.assertEqual(data, serializer_class(instances, many=True).data)
+            self.assertEqual(data, [serializer_class(instance).data for instance in instances])
+        # a missing namespace is null (not omitted) in both cases
+        self.assertEqual((data[0]['product_name'], data[0]['stuff']), ('p000', None))
+        self.assertEqual(data[1]['stuff'], {'text_value': 's1', 'long_value': 1})
+
+    def test_list(self):
+        results = self.get_json('/archive/', format='json', mode='stuff', page_size=100,
+                                ordering='product_name')['results']
+        for product in results[:5]:
+            self.assertEqual(product, self.get_json('/archive/%s/' % product['uuid'], format='json', mode='stuff'))
+
+
+class SparseFieldsetsTest(ProductTestCase):
+    def test_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            results = self.get_json('/archive/', format='json', mode='stuff', fields='uuid,product_name')['results']
+        # namespaces are selected separately
+        self.assertEqual([sorted(product) for product in results], [['product_name', 'stuff', 'uuid']] * len(results))
+        # only the requested (and ordering and validator) columns are read
+        sql = queries.captured_queries[-1]['sql']
+        self.assertIn('product_name', sql)
+        self.assertNotIn('physical_name', sql)
+        product = self.get_json('/archive/%s/' % Core.objects.get(product_name='p001').pk, format='json',
+                                mode='extended', fields='product_name,tags', namespaces='')
+        self.assertEqual(product, {'product_name': 'p001', 'tags': ['t1']})
+
+    def test_namespaces(self):
+        full = self.get_json('/archive/', format='json', mode='stuff', ordering='product_name')['results']
+        for namespaces, expected in [('stuff', full), ('', [dict((name, value) for name, value in product.items()
+                                                                 if name != 'stuff') for product in full])]:
+            results = self.get_json('/archive/', format='json', mode='stuff', ordering='product_name',
+                                    namespaces=namespaces)['results']
+            self.assertEqual(results, expected)
+        results = self.get_json('/archive/', format='json', mode='stuff', ordering='product_name',
+                                fields='product_name', namespaces='')['results']
+        self.assertEqual(results, [{'product_name': product['product_name']} for product in full])
+
+    def test_invalid(self):
+        for params in ['fields=unknown', 'fields=product_name,stuff', 'namespaces=unknown',
+                       'namespaces=stuff&mode=default', 'fields=tags&mode=default']:
+            response = self.client.get('/archive/?format=json&' + params + ('' if 'mode=' in params else '&mode=stuff'))
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn('Invalid value for query param', response.json()['detail'])
+
+
+class FootprintReductionTest(ProductTestCase):
+    def test_expression(self):
+        expression = reduced_geojson('footprint', 0.5, 3)
+        simplified, precision = expression.source_expressions[:2]
+        self.assertEqual((type(simplified).__name__, simplified.source_expressions[1].value, precision.value),
+                         ('SimplifyPreserveTopology', 0.5, 3))
+        expression = reduced_geojson('footprint')
+        self.assertEqual((type(expression.source_expressions[0]).__name__, expression.source_expressions[1].value),
+                         ('F', GEOJSON_PRECISION))
+
+    def test_invalid(self):
+        for params in ['simplify=x', 'simplify=-1', 'simplify=nan', 'precision=x', 'precision=-1', 'precision=16',
+                       'precision=1.5']:
+            response = self.client.get('/archive/?format=json&' + params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn('Invalid value for query param', response.json()['detail'])
+
+    @skipUnless(SPATIAL, 'footprints require a spatial database')
+    def test_reduction(self):
+        ring = [(10 + 5 * math.cos(2 * math.pi * index / 100), 20 + 5 * math.sin(2 * math.pi * index / 100))
+                for index in range(100)]
+        product = Core.objects.get(product_name='p001')
+        Core.objects.filter(pk=product.pk).update(footprint=Polygon(ring + ring[:1], srid=4326))
+
+        def coordinates(url, **params):
+            return self.get_json(url, format='json', **params)['footprint']['coordinates'][0]
+
+        url = '/archive/%s/' % product.pk
+        full = coordinates(url)
+        self.assertEqual(len(full), 101)
+        rounded = coordinates(url, precision='2')
+        self.assertEqual(len(rounded), 101)
+        for (x, y), (rounded_x, rounded_y) in zip(full, rounded):
+            self.assertEqual((round(rounded_x, 2), round(rounded_y, 2)), (rounded_x, rounded_y))
+            self.assertAlmostEqual(x, rounded_x, delta=0.0051)
+            self.assertAlmostEqual(y, rounded_y, delta=0.0051)
+        simplified = coordinates(url, simplify='1')
+        self.assertLess(len(simplified), 20)
+        self.assertEqual(simplified[0], simplified[-1])
+        # the same for lists
+        results = self.get_json('/archive/', format='json', product_type='T1', simplify='1', precision='2')['results']
+        footprint = [product['footprint'] for product in results if product['product_name'] == 'p001'][0]
+        self.assertLess(len(footprint['coordinates'][0]), 20)
+
+
+class WrappedFootprintTest(ProductTestCase):
+    def products(self):
+        '''products with a footprint (one crossing the dateline), and one without'''
+        products = list(Core.objects.order_by('product_name')[:4])
+        for index, product in enumerate(products[:3]):
+            product.footprint = Polygon(((170 + index, 0), (-170, 0), (-170, 10), (170 + index, 10), (170 + index, 0)),
+                                        srid=4326)
+        products[3].footprint = None
+        return products
+
+    def wrap(self, products):
+        '''the wrapped footprints, and the number of footprints that were actually wrapped'''
+        field = WrappedFootprintField()
+        with mock.patch('muninn_django.serializers.wrap_geometries', side_effect=wrap_geometries) as wrap:
+            field.prepare(products)
+            results = [field.to_representation(product) for product in products]
+        return results, sum(len(call.args[0]) for call in wrap.call_args_list)
+
+    def test_cache(self):
+        products = self.products()
+        results, count = self.wrap(products)
+        self.assertEqual(count, 3)
+        self.assertEqual(results, [json.loads(wrap_geometry(product.footprint).json) for product in products[:3]] +
+                         [None])
+        self.assertEqual(results[0]['type'], 'MultiPolygon')
+        # hit (also for another field instance)
+        self.assertEqual(self.wrap(products), (results, 0))
+        # a product is wrapped again when its metadata_date changes
+        products[1].metadata_date = datetime.datetime(2021, 1, 1)
+        self.assertEqual(self.wrap(products), (results, 1))
+        self.assertEqual(self.wrap(products), (results, 0))
+
+    def test_single(self):
+        products = self.products()
+        field = WrappedFootprintField()
+        self.assertIsNone(field.to_representation(products[3]))
+        self.assertEqual(field.to_representation(products[0]), json.loads(wrap_geometry(products[0].footprint).json))
+        self.assertEqual(self.wrap(products[:1])[1], 0)
+
+    @skipUnless(SPATIAL, 'footprints require a spatial database')
+    def test_list(self):
+        for product, footprint in zip(Core.objects.filter(product_type='T1'), self.products()):
+            Core.objects.filter(pk=product.pk).update(footprint=footprint.footprint)
+        with mock.patch('muninn_django.serializers.wrap_geometries', side_effect=wrap_geometries) as wrap:
+            results = self.get_json('/archive/', format='json', mode='wrapped', product_type='T1')['results']
+            self.assertEqual(wrap.call_count, 1)
+            self.assertEqual(self.get_json('/archive/', format='json', mode='wrapped', product_type='T1')['results'],
+                             results)
+            self.assertEqual(wrap.call_count, 1)
+        self.assertEqual(len([product for product in results if product['wrapped_footprint'] is not None]), 3)
+
+
+class GeoJSONTest(ProductTestCase):
+    def test_precision(self):
+        # GDAL (used by the geometry serializer fields) writes coordinates with GEOJSON_PRECISION decimal digits
+        values = [1.0000000000000002, 0.1234567890123456789, 12345.678901234567, -179.123456789012345]
+        data = GeometryField().to_representation(LineString([(value, -value / 2) for value in values], srid=4326))
+        self.assertEqual(data['coordinates'], [[round(value, GEOJSON_PRECISION), round(-value / 2, GEOJSON_PRECISION)]
+                                               for value in values])
+
+    @skipUnless(connection.vendor == 'postgresql', 'database rendering requires PostgreSQL')
+    def test_database_rendering(self):
+        from muninn_django.postgres import json_expression
+
+        if SPATIAL:
+            footprint = Polygon(((0.1234567890123456789, 1.0000000000000002), (12345.678901234567 % 180, 1.5),
+                                 (10.25, 10.333333333333333), (0.1234567890123456789, 1.0000000000000002)), srid=4326)
+            Core.objects.filter(product_name='p001').update(footprint=footprint)
+        queryset = Core.objects.order_by('product_name')
+        for mode in ('default', 'stuff', 'extended'):
+            serializer_class = ProductSerializerFactory.get('archive', mode=mode)
+            expression = json_expression(serializer_class(many=True).child)
+            self.assertIsNotNone(expression)
+            rendered = queryset.annotate(json_representation=Cast(expression, TextField()))
+            rendered = [json.loads(row) for row in rendered.values_list('json_representation', flat=True)]
+            instances = queryset.select_related(*serializer_class.Meta.select_related).prefetch_related(
+                *serializer_class.Meta.prefetch_related)
+            expected = json.loads(JSONRenderer().render(serializer_class(instances, many=True).data))
+            self.assertEqual(rendered, expected)
+        # a missing namespace is null in both cases
+        self.assertEqual((rendered[0]['product_name'], rendered[0]['stuff']), ('p000', None))
+
+
+class CursorPaginationTest(ProductTestCase):
+    def walk(self, **params):
+        '''the product names of all pages, following the next links, and then back following the previous links'''
+        forward = []
+        url = '/cursor/?format=json&page_size=4'
+        for name, value in params.items():
+            url += '&%s=%s' % (name, value)
+        while url:
+            page = self.get_json(url)
+            forward += [product['product_name'] for product in page['results']]
+            last_page, url = page, page['next']
+        backward = []
+        url = last_page['previous']
+        while url:
+            page = self.get_json(url)
+            backward = [product['product_name'] for product in page['results']] + backward
+            url = page['previous']
+        return forward, backward
+
+    def expected(self, *ordering):
+        ordering = list(ordering) + ['uuid']
+        return list(Core.objects.order_by(*[F(term[1:]).desc(nulls_first=True) if term.startswith('-') else
+                                            F(term).asc(nulls_last=True) for term in ordering])
+                    .values_list('product_name', flat=True))
+
+    def test_walk(self):
+        for ordering in [('validity_start', ), ('-validity_start', ), ('product_type', '-stuff__long_value'),
+                         ('stuff__text_value', ), ('product_type', 'product_name'), ('-product_type', 'size')]:
+            forward, backward = self.walk(ordering=','.join(ordering))
+            self.assertEqual(forward, self.expected(*ordering))
+            # going back from the last page visits all other pages
+            self.assertEqual(backward, forward[:PRODUCTS - (PRODUCTS % 4 or 4)])
+
+    def test_filtered(self):
+        forward, backward = self.walk(product_type='T1', ordering='-validity_start')
+        self.assertEqual(forward, [name for name in self.expected('-validity_start')
+                                   if int(name[1:]) % 3 == 1])
+
+    def test_row_comparison(self):
+        url = self.get_json('/cursor/?format=json&page_size=4&ordering=product_type,validity_start')['next']
+        with CaptureQueriesContext(connection) as queries:
+            self.get_json(url)
+        sql = queries.captured_queries[-1]['sql']
+        self.assertRegex(sql, r'\([^()]*product_type[^()]*, [^()]*validity_start[^()]*, [^()]*uuid[^()]*\) > ')
+        self.assertIn('validity_start" IS NULL', sql)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/cursor/?format=json&cursor=garbage').status_code, 404)
+
+    def test_no_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.get_json('/cursor/?format=json')
+        self.assertFalse([query for query in queries.captured_queries if 'COUNT(' in query['sql'].upper()])
+        # not even for conditional requests
+        with archive_settings('cursor', conditional_list=True):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/cursor/?format=json')
+        self.assertFalse([query for query in queries.captured_queries if 'COUNT(' in query['sql'].upper()])
+        self.assertFalse(response.has_header('ETag'))
+
+
+class CountTest(ProductTestCase):
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            page = self.get_json(url)
+        return page, len([query for query in queries.captured_queries if '__count' in query['sql']])
+
+    def test_exact(self):
+        page = self.get_json('/archive/?format=json&product_type=T1')
+        self.assertEqual(page['count'], 8)
+        self.assertNotIn('count_is_exact', page)
+
+    def test_estimate(self):
+        rest_framework = dict(settings.REST_FRAMEWORK, COUNT_ESTIMATE_THRESHOLD=1000)
+        with override_settings(REST_FRAMEWORK=rest_framework):
+            with mock.patch.object(CountingPaginator, '_estimate_count', return_value=5000):
+                page, count_queries = self.count_queries('/archive/?format=json&product_type=T1')
+                self.assertEqual((page['count'], page['count_is_exact'], count_queries), (5000, False, 0))
+                # pages beyond the actual number of products remain reachable
+                self.assertEqual(self.get_json('/archive/?format=json&page=10')['results'], [])
+            with mock.patch.object(CountingPaginator, '_estimate_count', return_value=999):
+                page, count_queries = self.count_queries('/archive/?format=json&product_type=T1')
+                self.assertEqual((page['count'], page['count_is_exact'], count_queries), (8, True, 1))
+
+    @skipUnless(connection.vendor == 'postgresql', 'count estimates require PostgreSQL')
+    def test_estimate_failure(self):
+        # the test runs in a transaction, as with ATOMIC_REQUESTS; a failing estimate must not abort it
+        rest_framework = dict(settings.REST_FRAMEWORK, COUNT_ESTIMATE_THRESHOLD=1)
+        with override_settings(REST_FRAMEWORK=rest_framework):
+            with mock.patch.object(connection.ops, 'explain_query_prefix', return_value='EXPLAIN (INVALID)'):
+                page = self.get_json('/archive/?format=json&product_type=T1')
+        self.assertEqual((page['count'], page['count_is_exact']), (8, True))
+
+    def test_cached(self):
+        rest_framework = dict(settings.REST_FRAMEWORK, COUNT_CACHE_TIMEOUT=60)
+        with override_settings(REST_FRAMEWORK=rest_framework):
+            self.assertEqual(self.count_queries('/archive/?format=json&product_type=T1&page_size=4')[1], 1)
+            page, count_queries = self.count_queries('/archive/?format=json&product_type=T1&page_size=4&page=2')
+            self.assertEqual((page['count'], count_queries), (8, 0))
+            self.assertEqual(self.count_queries('/archive/?format=json&product_type=T2')[1], 1)
+
+
+class BulkCreateTest(ProductTestCase):
+    def items(self, count):
+        source = str(Core.objects.get(product_name='p000').uuid)
+        return [dict({'product_type': 'X', 'product_name': 'n%d' % index, 'physical_name': 'n%d' % index,
+                      'active': True, 'tags': ['a', 'b'], 'source_products': [source]},
+                     **({'stuff': {'text_value': 'q'}} if index % 2 else {}))
+                for index in range(count)]
+
+    def test_create(self):
+        response = self.post('/archive/?format=json', self.items(5))
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual([product['product_name'] for product in response.json()], ['n%d' % i for i in range(5)])
+        products = Core.objects.filter(product_type='X')
+        self.assertEqual(products.count(), 5)
+        self.assertEqual(Tag.objects.filter(product__in=products).count(), 10)
+        self.assertEqual(Link.objects.filter(product__in=products).count(), 5)
+        self.assertEqual(Stuff.objects.filter(_core__in=products).count(), 2)
+        self.assertTrue(all(product.metadata_date is not None for product in products))
+
+    def test_invalid(self):
+        response = self.post('/archive/?format=json', self.items(1) + [{'product_type': 'Y'}])
+        self.assertEqual(response.status_code, 400)
+        # errors are reported per (invalid) item
+        self.assertEqual(list(response.json()), ['1'])
+        self.assertIn('product_name', response.json()['1'])
+        self.assertFalse(Core.objects.filter(product_type='X').exists())
+
+    def test_duplicate(self):
+        # duplicates within the request
+        items = self.items(3)
+        items[2]['product_name'] = 'n0'
+        response = self.post('/archive/?format=json', items)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.json()), ['2'])
+        self.assertEqual(response.json()['2']['non_field_errors'],
+                         ['The fields product_type, product_name must make a unique set.'])
+        # duplicates of existing products
+        items = self.items(3)
+        items[1].update(product_type='T0', product_name='p000')
+        items[2].update(archive_path='a', physical_name='p001.dat')
+        Core.objects.filter(product_name='p001').update(archive_path='a')
+        response = self.post('/archive/?format=json', items)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.json()), ['1', '2'])
+        self.assertEqual(response.json()['2']['non_field_errors'],
+                         ['The fields archive_path, physical_name must make a unique set.'])
+        self.assertFalse(Core.objects.filter(product_type='X').exists())
+        # NULL values are not compared
+        response = self.post('/archive/?format=json', [dict(item, physical_name='same') for item in self.items(3)])
+        self.assertEqual(response.status_code, 201, response.content)
+
+    def test_queries(self):
+        # the number of queries does not depend on the number of products (apart from the batches of inserts)
+        counts = []
+        for count in (10, 200):
+            Core.objects.filter(product_type='X').delete()
+            items = self.items(count)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.post('/archive/?format=json', items)
+            self.assertEqual(response.status_code, 201, response.content)
+            counts.append(len([query for query in queries.captured_queries if not query['sql'].startswith('INSERT')]))
+        self.assertEqual(counts[0], counts[1])
+        self.assertLessEqual(counts[1], 5)
+
+    def test_unknown_source(self):
+        items = self.items(2)
+        items[1]['source_products'].append('00000000-0000-0000-0000-000000000000')
+        response = self.post('/archive/?format=json', items)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.json()), ['1'])
+        self.assertIn('source_products', response.json()['1'])
+
+    def test_single(self):
+        response = self.post('/archive/?format=json', self.items(1)[0])
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json()['tags'], ['a', 'b'])
+
+
+class StartupTest(ProductTestCase):
+    def test_lazy_filterset(self):
+        with mock.patch.object(ProductFilterFactory, 'get', wraps=ProductFilterFactory.get) as get:
+            view_class = ProductViewSetFactory.get('archive', Core.objects.all())
+            self.assertEqual(get.call_count, 0)
+            filterset_class = view_class.filterset_class
+            self.assertEqual(get.call_count, 1)
+            self.assertIs(view_class.filterset_class, filterset_class)
+            self.assertEqual(get.call_count, 1)
+        self.assertIn('product_type', filterset_class.base_filters)
+        self.assertIn('stuff__long_value__gt', filterset_class.base_filters)
+
+    def test_filters(self):
+        # the filters of the lazily built filterset are available (and validated) on the first request
+        self.assertEqual(self.get_json('/archive/', format='json', stuff__long_value__gt=3)['count'],
+                         len([index for index in range(PRODUCTS) if index % 4 and index % 5 > 3]))
+        self.assertEqual(self.client.get('/archive/', {'stuff__unknown': 1}).status_code, 400)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('muninn_startup_time', '--json', stdout=out)
+        results = json.loads(out.getvalue())
+        self.assertEqual(sorted(results['first_request']), sorted(settings.MUNINN))
+        for result in [results['registration']] + list(results['first_request'].values()):
+            self.assertEqual(sorted(result), ['bytes', 'seconds'])
+            self.assertGreaterEqual(result['seconds'], 0)
+        out = StringIO()
+        call_command('muninn_startup_time', 'archive', stdout=out)
+        self.assertIn('registration of 1 archive(s)', out.getvalue())
+        self.assertIn('first request to archive', out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('muninn_startup_time', 'unknown', stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command('muninn_startup_time', '--max-time', '0', stdout=StringIO())
+
+
+class StatsTest(ProductTestCase):
+    def expected(self, *keys):
+        '''the statistics per group, computed in Python; `keys`: (name, function of the product) pairs'''
+        groups = {}
+        for product in Core.objects.select_related('stuff'):
+            group = tuple(function(product) for _, function in keys)
+            groups.setdefault(group, []).append(product.size)
+        results = []
+        for group, sizes in groups.items():
+            result = dict((name, value.isoformat() if isinstance(value, datetime.datetime) else value)
+                          for (name, _), value in zip(keys, group))
+            result.update(count=len(sizes), size_sum=sum(sizes), size_min=min(sizes), size_max=max(sizes))
+            results.append(result)
+        return sorted(results, key=repr)
+
+    def stats(self, **params):
+        return sorted(self.get_json('/archive/stats/', format='json', **params), key=repr)
+
+    def test_total(self):
+        self.assertEqual(self.stats(), self.expected())
+        self.assertEqual(self.stats(product_type='T1'),
+                         [{'count': 8, 'size_sum': sum(range(1, PRODUCTS, 3)), 'size_min': 1, 'size_max': 22}])
+
+    def test_group_by(self):
+        self.assertEqual(self.stats(group_by='product_type'),
+                         self.expected(('product_type', lambda product: product.product_type)))
+        self.assertEqual(self.stats(group_by='product_type,stuff__long_value'),
+                         self.expected(('product_type', lambda product: product.product_type),
+                                       ('stuff__long_value', lambda product: getattr(
+                                           getattr(product, 'stuff', None), 'long_value', None))))
+
+    def test_buckets(self):
+        truncate = {
+            'year': lambda value: value.replace(month=1, day=1, hour=0),
+            'month': lambda value: value.replace(day=1, hour=0),
+            'day': lambda value: value.replace(hour=0),
+            'hour': lambda value: value,
+        }
+        for bucket, function in truncate.items():
+            # (the groups are named after the field)
+            expected = self.expected(('validity_start', lambda product: None if product.validity_start is None else
+                                      function(product.validity_start.replace(minute=0, second=0, microsecond=0))))
+            self.assertEqual(self.stats(group_by='validity_start:%s' % bucket), expected, bucket)
+        self.assertEqual(len(self.stats(group_by='validity_start:month')), 2)
+        self.assertEqual(len(self.stats(group_by='validity_start:day,product_type', product_type='T0')), 9)
+
+    def test_invalid(self):
+        for value in ['unknown', 'product_type:year', 'validity_start:week', 'tags', 'stuff', 'stuff__unknown']:
+            response = self.client.get('/archive/stats/', {'format': 'json', 'group_by': value})
+            self.assertEqual(response.status_code, 400, value)
+
+
+class StreamingTest(ProductTestCase):
+    def get_stream(self, url):
+        '''the (streamed) chunks of a response, and the queries executed to produce them'''
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIsInstance(response, StreamingHttpResponse)
+            chunks = list(response.streaming_content)
+        return response, chunks, queries.captured_queries
+
+    def expected(self, **params):
+        results = self.get_json('/archive/', format='json', page_size=100, **params)['results']
+        return sorted(results, key=lambda product: product['product_name'])
+
+    def test_ndjson(self):
+        response, chunks, queries = self.get_stream('/archive/?format=ndjson&product_type=T0&mode=stuff')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        lines = b''.join(chunks).decode('utf-8').splitlines()
+        self.assertEqual(sorted((json.loads(line) for line in lines), key=lambda product: product['product_name']),
+                         self.expected(product_type='T0', mode='stuff'))
+
+    def test_csv(self):
+        response, chunks, queries = self.get_stream('/archive/?format=csv&product_type=T0&mode=stuff')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="archive.csv"')
+        rows = list(csv.reader(StringIO(b''.join(chunks).decode('utf-8'))))
+        expected = self.expected(product_type='T0', mode='stuff')
+        header = [name for name in expected[0] if name != 'stuff'] + ['stuff.text_value', 'stuff.long_value']
+        self.assertEqual(sorted(rows[0]), sorted(header))
+        products = sorted((dict(zip(rows[0], row)) for row in rows[1:]), key=lambda product: product['product_name'])
+        self.assertEqual(len(products), len(expected))
+        for product, expected_product in zip(products, expected):
+            self.assertEqual(product['uuid'], expected_product['uuid'])
+            self.assertEqual(product['size'], str(expected_product['size']))
+            self.assertEqual(product['active'], 'true')
+            stuff = expected_product['stuff'] or {}
+            # missing namespaces are empty fields
+            self.assertEqual((product['stuff.text_value'], product['stuff.long_value']),
+                             (stuff.get('text_value', ''), str(stuff.get('long_value', ''))))
+
+    def test_chunks(self):
+        with mock.patch.object(ProductViewSet, 'export_chunk_size', 4):
+            response, chunks, queries = self.get_stream('/archive/?format=ndjson')
+        # the header (empty for ndjson), and the products in chunks of 4
+        self.assertEqual([len(chunk.splitlines()) for chunk in chunks], [0] + [4] * (PRODUCTS // 4) + [PRODUCTS % 4])
+
+    def test_no_count(self):
+        for config in ({}, {'conditional_list': True}):
+            with archive_settings(**config):
+                for url in ('/archive/?format=ndjson', '/archive/?format=csv&mode=extended'):
+                    response, chunks, queries = self.get_stream(url)
+                    self.assertFalse([query for query in queries if 'COUNT(' in query['sql'].upper()], url)
+                    self.assertFalse(response.has_header('ETag'))
+
+
+class TagTest(ProductTestCase):
+    def setUp(self):
+        super(TagTest, self).setUp()
+        self.product = Core.objects.get(product_name='p000')
+        self.others = [str(uuid) for uuid in Core.objects.exclude(pk=self.product.pk).values_list('uuid', flat=True)]
+
+    def post_action(self, name, data):
+        response = self.post('/archive/%s/%s/?format=json' % (self.product.uuid, name), data)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_tag(self):
+        self.assertEqual(self.post_action('tag', ['a', 'b', 't0'])['tags'], ['a', 'b', 't0'])
+        self.assertEqual(self.post_action('untag', ['a', 'unknown'])['tags'], ['b', 't0'])
+        self.assertEqual(sorted(self.product.tags.values_list('tag', flat=True)), ['b', 't0'])
+
+    def test_link(self):
+        self.assertEqual(len(self.post_action('link', self.others[:2])['source_products']), 2)
+        self.assertEqual(len(self.post_action('link', self.others)['source_products']), PRODUCTS - 1)
+        result = self.post_action('unlink', self.others[1:3])
+        self.assertEqual(sorted(result['source_products']), sorted(self.others[:1] + self.others[3:]))
+
+    def test_unchanged(self):
+        # adding existing tags or source products changes nothing, not even metadata_date
+        self.post_action('link', self.others[:2])
+        metadata_date = Core.objects.get(pk=self.product.pk).metadata_date
+        for name, data in [('tag', ['t0']), ('link', self.others[:2]), ('untag', ['unknown']),
+                           ('unlink', self.others[2:3])]:
+            with CaptureQueriesContext(connection) as queries:
+                self.post_action(name, data)
+            self.assertFalse([query for query in queries.captured_queries
+                              if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))], name)
+            self.assertEqual(Core.objects.get(pk=self.product.pk).metadata_date, metadata_date, name)
+        self.assertEqual(self.post_action('tag', ['t0', 'new'])['tags'], ['new', 't0'])
+        self.assertGreater(Core.objects.get(pk=self.product.pk).metadata_date, metadata_date)
+
+    def test_bulk(self):
+        response = self.post('/archive/tag/?product_type=T1', ['new', 't1'])
+        self.assertEqual(response.status_code, 200, response.content)
+        tagged = Core.objects.filter(tags__tag='new')
+        self.assertEqual(sorted(tagged.values_list('product_name', flat=True)),
+                         ['p%03d' % index for index in range(PRODUCTS) if index % 3 == 1])
+        # existing tags are not duplicated (or counted)
+        self.assertEqual(Tag.objects.filter(tag='t1').count(),
+                         len([index for index in range(PRODUCTS) if index % 2 == 1 or index % 3 == 1]))
+        self.assertEqual(response.json()['count'],
+                         len(tagged) + len([index for index in range(PRODUCTS) if index % 6 == 4]))
+        response = self.post('/archive/untag/?product_type__in=T1,T2', ['new'])
+        self.assertEqual((response.status_code, response.json()), (200, {'count': len(tagged)}))
+        self.assertFalse(Tag.objects.filter(tag='new').exists())
+
+    def test_bulk_unfiltered(self):
+        # all products of the archive have to be requested explicitly
+        for path in ('tag', 'untag'):
+            for query in ('', '?product_type=', '?format=json', '?all=1'):
+                self.assertEqual(self.post('/archive/%s/%s' % (path, query), ['t0']).status_code, 400, query)
+        self.assertEqual(Tag.objects.filter(tag='t0').count(), (PRODUCTS + 1) // 2)
+        self.assertEqual(self.post('/archive/tag/?all=true', ['t0']).json(), {'count': PRODUCTS // 2})
+        self.assertEqual(Tag.objects.filter(tag='t0').count(), PRODUCTS)
+        self.assertEqual(self.post('/archive/untag/?all=true', ['t0']).json(), {'count': PRODUCTS})
+        # `all` is only accepted by the bulk actions
+        self.assertEqual(self.client.get('/archive/?format=json&all=true').status_code, 400)
+
+    def test_bulk_invalid(self):
+        self.assertEqual(self.post('/archive/tag/?product_type=T1', 'new').status_code, 400)
+        self.assertFalse(Tag.objects.filter(tag='new').exists())
+
+    def test_bulk_metadata_date(self):
+        # only the products (of types T0 and T1) that got a new tag, or lost one, are updated
+        even = [index for index in range(PRODUCTS) if index % 6 in (0, 4)]
+        for path, tags, changed in [('tag', ['t1'], even), ('tag', ['t1'], []), ('untag', ['t0'], even),
+                                    ('untag', ['t0'], [])]:
+            before = dict(Core.objects.values_list('product_name', 'metadata_date'))
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.post('/archive/%s/?product_type__in=T0,T1' % path, tags).status_code, 200)
+            after = dict(Core.objects.values_list('product_name', 'metadata_date'))
+            self.assertEqual(sorted(name for name in after if after[name] != before[name]),
+                             ['p%03d' % index for index in changed])
+            self.assertEqual(len([query for query in queries.captured_queries
+                                  if query['sql'].startswith('UPDATE')]), 1 if changed else 0)
+
+
+@archive_settings(conditional_list=True)
+class ConditionalTest(ProductTestCase):
+    def test_list(self):
+        response = self.client.get('/archive/?format=json&product_type=T0')
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/archive/?format=json&product_type=T0', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response.content), (304, b''))
+        self.assertEqual(len(queries.captured_queries), 1)
+        # validators depend on the representation
+        self.assertEqual(self.client.get('/archive/?format=json&product_type=T0&mode=extended',
+                                         HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        Core.objects.filter(product_name='p001').update(product_type='T0')
+        self.assertEqual(self.client.get('/archive/?format=json&product_type=T0',
+                                         HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_list_count(self):
+        # the paginator uses the number of products of the validators
+        with CaptureQueriesContext(connection) as queries:
+            page = self.get_json('/archive/?format=json&product_type=T0')
+        self.assertEqual(page['count'], 9)
+        self.assertEqual(len([query for query in queries.captured_queries if 'COUNT(' in query['sql'].upper()]), 1)
+
+    def test_list_disabled(self):
+        for url in ('/archive/?format=ndjson', '/archive/?format=csv'):
+            response = self.client.get(url)
+            self.assertFalse(response.has_header('ETag'), url)
+        with archive_settings(conditional_list=False):
+            response = self.client.get('/archive/?format=json')
+        self.assertFalse(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Last-Modified'))
+
+    def test_detail(self):
+        product = Core.objects.get(product_name='p001')
+        url = '/archive/%s/?format=json' % product.pk
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Core.objects.filter(pk=product.pk).update(metadata_date=datetime.datetime(2021, 1, 1))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_tags_and_links(self):
+        product = Core.objects.get(product_name='p001')
+        source = str(Core.objects.get(product_name='p002').pk)
+        url = '/archive/%s/?format=json&mode=extended' % product.pk
+        list_url = '/archive/?format=json&product_type=T1'
+        for path, data, tags, source_products in [('tag', ['new'], ['new', 't1'], []),
+                                                  ('untag', ['new'], ['t1'], []),
+                                                  ('link', [source], ['t1'], [source]),
+                                                  ('unlink', [source], ['t1'], [])]:
+            etag, list_etag = self.client.get(url)['ETag'], self.client.get(list_url)['ETag']
+            self.assertEqual(self.post('/archive/%s/%s/' % (product.pk, path), data).status_code, 200)
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200, path)
+            self.assertEqual((response.json()['tags'], response.json()['source_products']), (tags, source_products))
+            self.assertEqual(self.client.get(list_url, HTTP_IF_NONE_MATCH=list_etag).status_code, 200, path)
+        # nothing removed, nothing changed
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.post('/archive/%s/untag/' % product.pk, ['unknown']).status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_bulk_tags(self):
+        url = '/archive/%s/?format=json' % Core.objects.get(product_name='p001').pk
+        other_url = '/archive/%s/?format=json' % Core.objects.get(product_name='p002').pk
+        for path in ('tag', 'untag'):
+            etag, other_etag = self.client.get(url)['ETag'], self.client.get(other_url)['ETag']
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.post('/archive/%s/?product_type=T1' % path, ['new']).status_code, 200)
+            self.assertEqual(len([query for query in queries.captured_queries
+                                  if query['sql'].startswith('UPDATE')]), 1)
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200, path)
+            self.assertEqual(self.client.get(other_url, HTTP_IF_NONE_MATCH=other_etag).status_code, 304, path)
+
+
+class CacheTest(ProductTestCase):
+    def get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response, len(queries.captured_queries)
+
+    def test_hit(self):
+        response, count = self.get('/cached/?format=json&product_type=T0&mode=default')
+        self.assertGreater(count, 0)
+        cached, count = self.get('/cached/?mode=default&product_type=T0&format=json')
+        self.assertEqual((cached.content, count), (response.content, 0))
+        self.assertFalse(cached.has_header('ETag'))
+        self.assertGreater(self.get('/cached/?format=json&product_type=T0&mode=extended')[1], 0)
+
+    @archive_settings('cached', conditional_list=True)
+    def test_hit_conditional(self):
+        response, count = self.get('/cached/?format=json&product_type=T0&mode=default')
+        cached, count = self.get('/cached/?mode=default&product_type=T0&format=json')
+        self.assertEqual((cached.content, cached['ETag'], count), (response.content, response['ETag'], 0))
+        self.assertEqual(self.client.get('/cached/?format=json&product_type=T0&mode=default',
+                                         HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_invalidation(self):
+        url = '/cached/?format=json&product_type=T0'
+        self.get(url)
+        product = Core.objects.get(product_name='p000')
+        product.size = 99
+        product.save()
+        response, count = self.get(url)
+        self.assertGreater(count, 0)
+        self.assertIn(b'"size":99', response.content)
+        self.assertEqual(self.get(url)[1], 0)
+        self.assertEqual(self.post('/cached/%s/tag/' % product.pk, ['x']).status_code, 200)
+        self.assertGreater(self.get(url)[1], 0)
+        Tag.objects.filter(tag='x').delete()
+        self.assertGreater(self.get(url)[1], 0)
+        # many-to-many changes
+        self.get(url)
+        product.source_products.add(Core.objects.get(product_name='p001'))
+        self.assertGreater(self.get(url)[1], 0)
+        # changes that do not send signals
+        self.get(url)
+        Core.objects.filter(pk=product.pk).update(size=100)
+        self.assertEqual(self.get(url)[1], 0)
+        invalidate('cached')
+        self.assertGreater(self.get(url)[1], 0)
+        call_command('muninn_invalidate_cache', 'cached', stdout=StringIO())
+        self.assertGreater(self.get(url)[1], 0)
+
+    def test_users(self):
+        url = '/cached/?format=json&product_type=T0'
+        self.get(url)
+        self.assertEqual(self.get(url)[1], 0)
+        # other users (with possibly other permissions) do not share the entry
+        self.client.force_authenticate(User.objects.create_user('user'))
+        self.assertGreater(self.get(url)[1], 0)
+        self.assertEqual(self.get(url)[1], 0)
+        # anonymous users share entries
+        self.client = APIClient()
+        self.assertGreater(self.get(url)[1], 0)
+        self.client = APIClient()
+        self.assertEqual(self.get(url)[1], 0)
+
+
+class BBoxTest(SimpleTestCase):
+    def test_field(self):
+        field = BBoxField(required=False)
+        self.assertEqual(field.clean('0,0,10,10'), (0, 0, 10, 10))
+        self.assertEqual(field.clean('170,-10,-170,10'), (170, -10, -170, 10))
+        self.assertIsNone(field.clean(''))
+        for value in ['x', '1,2,3', '0,20,10,10', '10,0,0,nan', '0,-91,10,10']:
+            with self.assertRaises(Exception):
+                field.clean(value)
+
+    def test_polygons(self):
+        def extents(*bbox):
+            return [polygon.extent for polygon in bbox_polygons(*bbox)]
+
+        self.assertEqual(extents(0, 0, 10, 10), [(0, 0, 10, 10)])
+        # crossing the dateline
+        self.assertEqual(extents(170, -10, -170, 10), [(170, -10, 180, 10), (-180, -10, -170, 10)])
+        self.assertEqual(extents(170, -10, 190, 10), [(170, -10, 180, 10), (-180, -10, -170, 10)])
+        self.assertEqual(extents(-190, 0, -170, 1), [(170, 0, 180, 1), (-180, 0, -170, 1)])
+        # the whole world, in parts of at most 90 degrees
+        self.assertEqual(extents(-180, -90, 180, 90), [(-180 + 90 * i, -90, -90 + 90 * i, 90) for i in range(4)])
+        for polygon in bbox_polygons(100, 0, 300, 5):
+            self.assertTrue(-180 <= polygon.extent[0] <= polygon.extent[2] <= 180)
+
+
+class BBoxFilterTest(ProductTestCase):
+    def test_invalid(self):
+        for param in ['bbox', 'bbox_exact']:
+            self.assertEqual(self.client.get('/archive/', {param: '0,20,10,10'}).status_code, 400)
+
+    @skipUnless(SPATIAL, 'footprints require a spatial database')
+    def test_dateline(self):
+        # products west and east of the dateline, and one far from it
+        for name, bbox in [('p000', (176, 0, 179, 5)), ('p001', (-178, 20, -176, 22)), ('p002', (10, 0, 20, 5))]:
+            footprint = Polygon.from_bbox(bbox)
+            footprint.srid = 4326
+            Core.objects.filter(product_name=name).update(footprint=footprint)
+
+        def names(param, value):
+            return sorted(product['product_name'] for product in
+                          self.get_json('/archive/', format='json', page_size=100, **{param: value})['results'])
+
+        for param in ['bbox', 'bbox_exact']:
+            self.assertEqual(names(param, '170,-10,-170,30'), ['p000', 'p001'])
+            self.assertEqual(names(param, '170,10,190,30'), ['p001'])
+            self.assertEqual(names(param, '179.5,-10,-179.5,30'), [])
+            self.assertEqual(names(param, '0,0,30,10'), ['p002'])
+            self.assertEqual(names(param, '-180,-90,180,90'), ['p000', 'p001', 'p002'])
+
+
+class ValidityOverlapsTest(ProductTestCase):
+    def names(self, value):
+        return sorted(product['product_name'] for product in
+                      self.get_json('/archive/', format='json', page_size=100, validity_overlaps=value)['results'])
+
+    def expected(self, start, stop):
+        def bounds(product):
+            if None in (product.validity_start, product.validity_stop):
+                return product.validity_start, product.validity_stop
+            return sorted((product.validity_start, product.validity_stop))
+
+        return sorted(product.product_name for product in Core.objects.all() for lower, upper in [bounds(product)]
+                      if (stop is None or lower is None or lower <= stop) and
+                      (start is None or upper is None or upper >= start))
+
+    def test_validity_overlaps(self):
+        self.assertEqual(self.names('2020-01-03/2020-01-05'),
+                         self.expected(datetime.datetime(2020, 1, 3), datetime.datetime(2020, 1, 5)))
+        self.assertEqual(self.names('/2020-01-03'), self.expected(None, datetime.datetime(2020, 1, 3)))
+        self.assertEqual(self.names('2020-01-20/'), self.expected(datetime.datetime(2020, 1, 20), None))
+        self.assertEqual(len(self.names('/')), PRODUCTS)
+        for value in ['bad', '2020-02-01/2020-01-01', '2020-01-01']:
+            self.assertEqual(self.client.get('/archive/', {'validity_overlaps': value}).status_code, 400)
+
+    def test_reversed(self):
+        # a validity from 2020-01-10 back to 2020-01-02 overlaps 2020-01-05, like 2020-01-02/2020-01-10 would
+        Core.objects.filter(product_name='p000').update(validity_start=datetime.datetime(2020, 1, 10),
+                                                        validity_stop=datetime.datetime(2020, 1, 2))
+        for start, stop in [(5, 5), (1, 2), (10, 11), (11, 12), (1, 1)]:
+            value = '2020-01-%02d/2020-01-%02d' % (start, stop)
+            expected = self.expected(datetime.datetime(2020, 1, start), datetime.datetime(2020, 1, stop))
+            self.assertEqual(self.names(value), expected, value)
+            self.assertEqual('p000' in expected, 2 <= stop and start <= 10, value)
+
+    def test_range_expression(self):
+        sql = str(Core.objects.annotate(validity=validity_range()).values('validity').query)
+        self.assertEqual(sql.count('CASE WHEN'), 2)
+        self.assertNotIn('LEAST', sql)
+
+
+@override_settings(TEMPLATES=[{'BACKEND': 'django.template.backends.django.DjangoTemplates'}])
+class StartappTest(SimpleTestCase):
+    class Schema(dict):
+        def is_optional(self, name):
+            return name != 'count'
+
+    def models(self, *args):
+        def field(type_name):
+            return type(type_name, (), {'name': staticmethod(lambda: type_name), '__module__': 'muninn.schema'})
+
+        schema = self.Schema(count=field('long'), comment=field('text'), flag=field('boolean'))
+        archive = mock.MagicMock()
+        archive.__enter__.return_value.namespaces.return_value = ['core', 'stuff']
+        archive.__enter__.return_value.namespace_schema.return_value = schema
+        muninn = SimpleNamespace(_locate_archive_config_file=lambda name: name, open=lambda name: archive,
+                                 _read_archive_config_file=lambda path: {'archive': {'database': 'postgresql'},
+                                                                         'postgresql': {'table_prefix': 'test_'}})
+        out = StringIO()
+        with mock.patch.dict(sys.modules, muninn=muninn):
+            call_command('muninn_startapp', 'test', '--print', *args, stdout=out)
+        models = out.getvalue()
+        compile(models, 'models.py', 'exec')
+        return models
+
+    def indexes(self, models):
+        return [line.strip().rstrip(',') for line in models.splitlines() if 'Index(' in line]
+
+    def test_no_indexes(self):
+        models = self.models()
+        self.assertEqual(self.indexes(models), [])
+        self.assertNotIn('GistIndex', models)
+
+    def test_indexes(self):
+        self.assertEqual(self.indexes(self.models('--indexes')),
+                         ["models.Index(fields=['%s'])" % name for name in ['product_name', 'physical_name',
+                                                                             'validity_start', 'validity_stop',
+                                                                             'metadata_date', 'archive_date', 'hash']] +
+                         ["GistIndex(validity_range(), name='%s')" % index_name('test_core', 'vrange')])
+
+    def test_opt_in(self):
+        indexes = self.indexes(self.models('--indexes', '--index', 'core.size', '--index', 'core.product_name',
+                                           '--index', 'stuff.count', '--trigram', 'stuff.comment'))
+        self.assertEqual(indexes.count("models.Index(fields=['product_name'])"), 1)
+        self.assertIn("models.Index(fields=['size'])", indexes)
+        self.assertIn("models.Index(fields=['count'])", indexes)
+        self.assertNotIn("models.Index(fields=['comment'])", indexes)
+        self.assertEqual(len([index for index in indexes if 'gin_trgm_ops' in index]), 1)
+        self.assertEqual(self.indexes(self.models('--index', 'stuff.comment')), ["models.Index(fields=['comment'])"])
+
+    def test_invalid(self):
+        for args in [('--index', 'core.active'), ('--index', 'stuff.flag'), ('--index', 'stuff.unknown'),
+                     ('--trigram', 'stuff.count')]:
+            with self.assertRaises(CommandError):
+                self.models(*args)
+
+
+class TimingTest(ProductTestCase):
+    def test_disabled(self):
+        for url in ('/archive/?format=json', '/archive/%s/?format=json' % Core.objects.get(product_name='p001').pk):
+            self.assertFalse(self.client.get(url).has_header('Server-Timing'), url)
+
+    @archive_settings(timing=True)
+    def test_enabled(self):
+        product = Core.objects.get(product_name='p001')
+        for url in ('/archive/?format=json&mode=extended', '/archive/%s/?format=json' % product.pk,
+                    '/archive/stats/?format=json&group_by=product_type'):
+            with CaptureQueriesContext(connection) as queries:
+                with self.assertLogs('muninn_django.timing', 'INFO') as logs:
+                    response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            metrics = dict((metric.split(';')[0], metric) for metric in response['Server-Timing'].split(', '))
+            self.assertEqual(sorted(metrics), ['db', 'render', 'serialize', 'total'], url)
+            self.assertRegex(metrics['db'], r'^db;dur=[0-9.]+;desc="%d queries"$' % len(queries.captured_queries))
+            self.assertRegex(metrics['total'], r'^total;dur=[0-9.]+$')
+            record = logs.records[-1]
+            self.assertEqual((record.archive, record.status, record.queries),
+                             ('archive', 200, len(queries.captured_queries)))
+
+    @archive_settings(timing=True)
+    def test_errors(self):
+        response = self.client.get('/archive/?format=json&unknown=1')
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(response.has_header('Server-Timing'))
+
+
+class MetricsTest(ProductTestCase):
+    def test_metrics(self):
+        self.get_json('/archive/', format='json', product_type='T0')
+        response = self.client.get('/metrics')
+        self.assertEqual((response.status_code, response['Content-Type']),
+                         (200, 'text/plain; version=0.0.4; charset=utf-8'))
+        self.assertIn(b'muninn_requests_total{archive="archive",action="list",mode="default",filters="product_type",'
+                      b'status="200"}', response.content)
+
+    def test_permissions(self):
+        anonymous = APIClient()
+        self.assertEqual(anonymous.get('/metrics').status_code, 403)
+        user = APIClient()
+        user.force_authenticate(User.objects.create_user('user'))
+        self.assertEqual(user.get('/metrics').status_code, 403)
+        rest_framework = dict(settings.REST_FRAMEWORK,
+                              METRICS_PERMISSION_CLASSES=['rest_framework.permissions.AllowAny'])
+        with override_settings(REST_FRAMEWORK=rest_framework):
+            self.assertEqual(anonymous.get('/metrics').status_code, 200)
+
+
+@override_settings(ROOT_URLCONF='testarchive.urls')
+class AsyncViewTest(ProductTestCase):
+    URLS = [
+        '/archive/?format=json',
+        '/archive/?format=json&page=2',
+        '/archive/?format=json&page=9',
+        '/archive/?format=json&product_type=T1&tag=t1',
+        '/archive/?format=json&mode=extended',
+        '/archive/?format=ndjson&product_type=T0',
+        '/archive/?format=csv&mode=extended&product_type=T2',
+        '/archive/?format=json&bad=1',
+        '/archive/stats/?format=json&group_by=product_type',
+        '/archive/T0/p000/?format=json',
+        '/archive/T0/unknown/?format=json',
+        '/archive/unknown/?format=json',
+    ]
+
+    def get_responses(self):
+        responses = []
+        for url in self.URLS:
+            response = self.client.get(url)
+            responses.append((url, response.status_code, consume(response)))
+        product = Core.objects.get(product_name='p001')
+        response = self.client.get('/archive/%s/?format=json&mode=extended' % product.pk)
+        responses.append(('detail', response.status_code, response.content))
+        return responses
+
+    def test_same_as_sync(self):
+        responses = self.get_responses()
+        with override_settings(ROOT_URLCONF='muninn_django.urls'):
+            self.assertEqual(responses, self.get_responses())
+
+    @archive_settings(conditional_list=True)
+    def test_conditional(self):
+        etag = self.client.get('/archive/?format=json')['ETag']
+        self.assertEqual(self.client.get('/archive/?format=json', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        product = Core.objects.get(product_name='p001')
+        url = '/archive/%s/?format=json&mode=extended' % product.pk
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with override_settings(ROOT_URLCONF='muninn_django.urls'):
+            self.assertEqual(self.post('/archive/%s/tag/' % product.pk, ['new']).status_code, 200)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response.json()['tags']), (200, ['new', 't1']))
+
+    def test_read_only(self):
+        product = Core.objects.get(product_name='p001')
+        self.assertEqual(self.post('/archive/', {'product_type': 'X'}).status_code, 405)
+        # (matches the product_type/product_name route)
+        self.assertEqual(self.post('/archive/%s/tag/' % product.pk, ['x']).status_code, 405)
+        self.assertFalse(Tag.objects.filter(tag='x').exists())
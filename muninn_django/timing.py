@@ -0,0 +1,84 @@
+#
+# Copyright (C) 2018-2022 S[&]T, The Netherlands.
+#
+
+from __future__ import absolute_import, division, print_function
+
+import logging
+import time
+from contextlib import contextmanager, ExitStack
+from functools import partial
+
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class RequestTimer(object):
+    '''
+    Records the number of SQL queries and the time spent in the database, serializers and renderers while handling a
+    request (enabled with the `timing` archive setting, see `ProductViewSet.dispatch`).
+
+    Serializer time excludes the queries that run while serializing (e.g. lazily evaluated querysets).
+    '''
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.view_stop = None
+        self.queries = 0
+        self.durations = {'db': 0.0, 'serialize': 0.0, 'render': 0.0}
+
+    def __call__(self, execute, sql, params, many, context):
+        # database execute wrapper
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.durations['db'] += time.perf_counter() - start
+
+    @contextmanager
+    def record_queries(self):
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+            yield
+
+    @contextmanager
+    def measure(self, name):
+        start, db = time.perf_counter(), self.durations['db']
+        try:
+            yield
+        finally:
+            self.durations[name] += (time.perf_counter() - start) - (self.durations['db'] - db)
+
+    def get_header(self, total):
+        metrics = ['db;dur=%.1f;desc="%d queries"' % (self.durations['db'] * 1000, self.queries)]
+        metrics += ['%s;dur=%.1f' % (name, self.durations[name] * 1000) for name in ('serialize', 'render')]
+        metrics.append('total;dur=%.1f' % (total * 1000))
+        return ', '.join(metrics)
+
+    def finish(self, response, archive, action, mode):
+        '''
+        Add the Server-Timing header to `response` and log the timings (with the archive, action, mode, number of
+        queries and durations as extra attributes of the log record); for responses that still need to be rendered,
+        this is done after rendering.
+        '''
+        self.view_stop = time.perf_counter()
+        if getattr(response, 'is_rendered', True):
+            self._done(archive, action, mode, response)
+        else:
+            response.add_post_render_callback(partial(self._done, archive, action, mode, rendered=True))
+        return response
+
+    def _done(self, archive, action, mode, response, rendered=False):
+        stop = time.perf_counter()
+        if rendered:
+            self.durations['render'] = stop - self.view_stop
+        total = stop - self.start
+        response['Server-Timing'] = self.get_header(total)
+        extra = {'archive': archive, 'action': action, 'mode': mode, 'status': response.status_code,
+                 'queries': self.queries, 'total': total}
+        extra.update(self.durations)
+        logger.info('%s %s (mode %s): status %d, %d queries, db %.1f ms, serialize %.1f ms, render %.1f ms, '
+                    'total %.1f ms', archive, action, mode, response.status_code, self.queries,
+                    extra['db'] * 1000, extra['serialize'] * 1000, extra['render'] * 1000, total * 1000, extra=extra)
@@ -4,16 +4,40 @@
 
 from __future__ import absolute_import, division, print_function
 
+import calendar
+import datetime
+import hashlib
 import logging
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
 from copy import copy
+from functools import partial
 
-from rest_framework import viewsets
+from rest_framework import status, viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.generics import get_object_or_404
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connections, transaction
+from django.db.models import Count, DateField, F, Max, Min, Sum, TextField
+from django.db.models.functions import Cast, Trunc
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+from django.utils.http import http_date, parse_http_date
+from django.utils.module_loading import import_string
 
-from .serializers import ProductSerializerFactory
+from .caching import ResponseCache
+from .serializers import ProductSerializerFactory, ValuesListSerializer, GeoJSONField
+from .geometry import bbox_condition, reduced_geojson, tile_bbox
+from .pagination import CursorPagination, PageNumberPagination
+from .renderers import StreamingRenderer, NDJSONRenderer, CSVRenderer
 from .errors import BadRequest
+from .metrics import get_metrics
+from .timing import RequestTimer
 try:
     from .filters import ProductFilterFactory
 except:
@@ -23,17 +47,51 @@ except:
 logger = logging.getLogger(__name__)
 
 
+def _clear_prefetched(instance, name):
+    '''drop prefetched related objects that are outdated after a bulk insert/delete'''
+    getattr(instance, '_prefetched_objects_cache', {}).pop(name, None)
+
+
+def _set_metadata_date(model_class, products):
+    '''
+    set the metadata_date of products (primary keys, or a queryset of them) to now, with a single UPDATE;
+    used when tags or source products change, since metadata_date is the basis of the ETag/Last-Modified validators
+    '''
+    metadata_date = datetime.datetime.utcnow()
+    model_class.objects.filter(pk__in=products).update(metadata_date=metadata_date)
+    return metadata_date
+
+
+class _LazyFilterSetClass(object):
+    '''
+    Class attribute that builds the filterset class of an archive on first use, since introspecting the lookups
+    of all fields of all namespaces is costly (and not needed until the archive is actually queried)
+    '''
+    def __init__(self, archive):
+        self.archive = archive
+        self.filterset_class = None
+
+    def __get__(self, instance, owner):
+        if self.filterset_class is None:
+            self.filterset_class = ProductFilterFactory.get(self.archive, owner.queryset.model)
+        return self.filterset_class
+
+
 class ProductViewSetFactory(object):
     @classmethod
-    def get(cls, archive, queryset):
+    def get(cls, archive, queryset, base_class=None):
+        '''`base_class`: the viewset class to derive from (default: `ProductViewSet`)'''
         body = {}
         body['__module__'] = '%s.%s' % (__name__, archive)
         body['muninn_archive'] = archive
         body['queryset'] = queryset
         if ProductFilterFactory:
-            body['filterset_class'] = ProductFilterFactory.get(archive, queryset.model)
+            body['filterset_class'] = _LazyFilterSetClass(archive)
+        pagination_class_path = settings.MUNINN[archive].get('pagination')
+        if pagination_class_path:
+            body['pagination_class'] = import_string(pagination_class_path)
 
-        newclass = type('ProductViewSet', (ProductViewSet, ), body)
+        newclass = type('ProductViewSet', (base_class or ProductViewSet, ), body)
         return newclass
 
 
@@ -41,16 +99,92 @@ class ProductViewSet(viewsets.ModelViewSet):
     '''
     added query parameters:
         - mode: for GET requests, use serializer defined in settings
+        - format: `ndjson` and `csv` stream the full (unpaginated) query result
+        - fields: for GET requests, comma separated list of (non-namespace) fields to return
+        - namespaces: for GET requests, comma separated list of namespaces to return
+        - simplify: for GET requests, simplify the footprint in the database using this tolerance (in degrees)
+        - precision: for GET requests, number of decimal digits for the footprint coordinates
+        - group_by: for `stats`, comma separated list of fields (in django __ notation) to group the products by;
+          date/time fields can be truncated with a `:year`, `:month`, `:day` or `:hour` suffix
     '''
+    # time buckets supported by `group_by`
+    group_by_buckets = ('year', 'month', 'day', 'hour')
+
     muninn_archive = None
     filterset_class = None
+    renderer_classes = list(api_settings.DEFAULT_RENDERER_CLASSES) + [NDJSONRenderer, CSVRenderer]
+    # number of products fetched (and serialized) at once when streaming
+    export_chunk_size = 1000
+    # vector tiles: fields of the products included as feature attributes, maximum zoom level, and the size of the
+    # area around the tile that is included (in tile coordinates, the tile itself is 4096 x 4096)
+    tile_attributes = ('uuid', 'product_type', 'product_name')
+    tile_max_zoom = 22
+    tile_buffer = 256
+    # `RequestTimer` of the current request, if enabled with the `timing` archive setting
+    timer = None
+    # metrics registry, if enabled with the `metrics` archive setting, and the number of products returned
+    metrics = None
+    rows = None
+
+    def dispatch(self, request, *args, **kwargs):
+        start = self._start_request()
+        if self.timer is None:
+            response = super(ProductViewSet, self).dispatch(request, *args, **kwargs)
+        else:
+            with self.timer.record_queries():
+                response = super(ProductViewSet, self).dispatch(request, *args, **kwargs)
+        return self._finish_request(request, response, start)
+
+    def _start_request(self):
+        '''enable timing and metrics (if configured for the archive); returns the start time of the request'''
+        config = settings.MUNINN[self.muninn_archive]
+        if config.get('metrics'):
+            self.metrics = get_metrics()
+        if config.get('timing'):
+            self.timer = RequestTimer()
+        return time.perf_counter()
+
+    def _finish_request(self, request, response, start):
+        if self.timer is not None:
+            response = self.timer.finish(response, self.muninn_archive, getattr(self, 'action', None),
+                                         request.GET.get('mode', 'default'))
+        if self.metrics is not None:
+            self._observe(request, response, start)
+        return response
+
+    def _get_metric_labels(self, request):
+        '''archive, action, mode and the (names of the) filters used'''
+        filters = []
+        if self.filterset_class is not None:
+            filters = sorted(name for name in request.GET.keys() if name in self.filterset_class.base_filters)
+        return (self.muninn_archive, getattr(self, 'action', None) or '', request.GET.get('mode', 'default'),
+                ','.join(filters))
+
+    def _observe(self, request, response, start):
+        labels = self._get_metric_labels(request)
+
+        def observe(response):
+            self.metrics.observe_request(labels, response.status_code, time.perf_counter() - start)
+            if self.rows is not None:
+                self.metrics.count_rows(labels, self.rows)
+
+        if getattr(response, 'is_rendered', True):
+            observe(response)
+        else:
+            response.add_post_render_callback(observe)
+
+    def _measure(self, name):
+        '''context manager that adds the time spent in its block to the `name` timing (if enabled)'''
+        return self.timer.measure(name) if self.timer is not None else nullcontext()
 
     def get_queryset(self):
         queryset = self.queryset
 
         # validate query params, raise if unsupported param used
         # muninn-django
-        valid_params = ['mode', 'format', 'ordering', ]
+        valid_params = ['mode', 'format', 'ordering', 'fields', 'namespaces', 'simplify', 'precision', 'group_by', ]
+        if getattr(self, 'action', None) in ('bulk_tag', 'bulk_untag'):
+            valid_params.append('all')
         # pagination
         if self.pagination_class:
             for name in dir(self.pagination_class):
@@ -58,19 +192,106 @@ class ProductViewSet(viewsets.ModelViewSet):
                     valid_params.append(getattr(self.paginator, name))
         # filters
         if self.filterset_class:
-            valid_params += list(self.filterset_class.get_filters().keys())
+            # `base_filters` is computed once, `get_filters()` introspects all fields again
+            valid_params += list(self.filterset_class.base_filters.keys())
         for name in self.request.GET.keys():
             if name not in valid_params:
                 raise BadRequest('Invalid query param: "%s"' % name)
 
         # django query optimization
-        meta = self.get_serializer_class().Meta
-        queryset = queryset.select_related(*meta.select_related)
-        if meta.prefetch_related:
-            queryset = queryset.prefetch_related(*meta.prefetch_related)
+        serializer_class = self.get_serializer_class()
+        meta = serializer_class.Meta
+        select_related = list(meta.select_related)
+        prefetch_related = list(meta.prefetch_related)
+        fields, namespaces = self._get_sparse_fieldsets()
+        if namespaces is not None:
+            for name in namespaces:
+                if name not in meta.muninn_namespaces:
+                    raise BadRequest('Invalid value for query param "%s": "%s"' % ('namespaces', name))
+            select_related = [name for name in select_related if name in namespaces]
+        if fields is not None:
+            serializer_fields = serializer_class().fields
+            available_fields = [name for name in serializer_fields.keys() if name not in meta.muninn_namespaces]
+            for name in fields:
+                if name not in available_fields:
+                    raise BadRequest('Invalid value for query param "%s": "%s"' % ('fields', name))
+            prefetch_related = [name for name in prefetch_related if name in fields]
+            # only read the requested columns (and the ones needed for ordering)
+            model_fields = [field.name for field in queryset.model._meta.concrete_fields]
+            ordering = list(queryset.model._meta.ordering)
+            ordering += self.request.query_params.get('ordering', '').split(',')
+            # fields computed from the whole product (e.g. `WrappedFootprintField`) need additional columns
+            required_fields = [model_field for name in fields
+                               for model_field in getattr(serializer_fields[name], 'model_fields', ())]
+            # `metadata_date` is needed for conditional requests
+            only_fields = [name for name in fields + required_fields + [term.lstrip('-') for term in ordering] +
+                           ['metadata_date'] if name in model_fields]
+            queryset = queryset.only(*(only_fields + select_related))
+        queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+
+        # footprint reduction in the database
+        tolerance, precision = self._get_footprint_options()
+        if (tolerance is not None or precision is not None) and (fields is None or 'footprint' in fields):
+            if not any('footprint' in getattr(field, 'model_fields', ()) for field in serializer_class().fields.values()):
+                queryset = queryset.defer('footprint')
+            queryset = queryset.annotate(footprint_geojson=reduced_geojson('footprint', tolerance, precision))
 
         return queryset
 
+    def _get_footprint_options(self):
+        '''Return the footprint simplification tolerance and precision query params (None if not specified)'''
+        if self.request.method != 'GET':
+            return None, None
+        tolerance = self.request.query_params.get('simplify')
+        precision = self.request.query_params.get('precision')
+        try:
+            if tolerance is not None:
+                tolerance = float(tolerance)
+                if not tolerance >= 0:
+                    raise ValueError
+        except ValueError:
+            raise BadRequest('Invalid value for query param "%s": "%s"' % ('simplify', tolerance))
+        try:
+            if precision is not None:
+                precision = int(precision)
+                if not 0 <= precision <= 15:
+                    raise ValueError
+        except ValueError:
+            raise BadRequest('Invalid value for query param "%s": "%s"' % ('precision', precision))
+        return tolerance, precision
+
+    def _get_sparse_fieldsets(self):
+        '''
+        Return the lists of fields and namespaces requested with the `fields` and `namespaces` query params
+        (None if not specified)
+        '''
+        if self.request.method != 'GET':
+            return None, None
+        result = []
+        for param in ('fields', 'namespaces'):
+            value = self.request.query_params.get(param)
+            result.append(None if value is None else [name for name in value.split(',') if name])
+        return tuple(result)
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super(ProductViewSet, self).get_serializer(*args, **kwargs)
+        child = getattr(serializer, 'child', serializer)
+        fields, namespaces = self._get_sparse_fieldsets()
+        if fields is not None or namespaces is not None:
+            # remove the fields that were not requested
+            muninn_namespaces = getattr(child.Meta, 'muninn_namespaces', ())
+            for name in list(child.fields.keys()):
+                selection = namespaces if name in muninn_namespaces else fields
+                if selection is not None and name not in selection:
+                    child.fields.pop(name)
+        tolerance, precision = self._get_footprint_options()
+        if (tolerance is not None or precision is not None) and 'footprint' in child.fields:
+            # use the footprint as rendered by the database (see `get_queryset`)
+            child.fields['footprint'] = GeoJSONField(source='footprint_geojson')
+        return serializer
+
     def get_object(self):
         if 'product_type' in self.kwargs and 'product_name' in self.kwargs:
             # use product_type/product_name to lookup object
@@ -100,8 +321,248 @@ class ProductViewSet(viewsets.ModelViewSet):
             serializer_class = ProductSerializerFactory.get(self.muninn_archive, base_class_path='muninn_django.serializers.ProductCompleteSerializer')
         return serializer_class
 
-    def _get_partial_validated_data(self, request, item):
-        serializer = self.get_serializer(self.get_object(), data={item: request.data}, partial=True)
+    def _get_validators(self, last_modified, *values):
+        '''
+        Return the ETag and Last-Modified timestamp of a response that is determined by `values` (and the request)
+        '''
+        params = sorted((key, sorted(value)) for key, value in self.request.query_params.lists())
+        key = repr((self.muninn_archive, values, params, self.request.accepted_media_type))
+        etag = quote_etag(hashlib.md5(key.encode('utf-8')).hexdigest())
+        if last_modified is not None:
+            last_modified = calendar.timegm(last_modified.utctimetuple())
+        return etag, last_modified
+
+    def _conditional_response(self, etag, last_modified, get_response):
+        '''
+        Return a 304 Not Modified response if the client already has the current version,
+        otherwise the result of `get_response()`; both with ETag and Last-Modified headers.
+        '''
+        response = self._get_not_modified_response(etag, last_modified)
+        if response is None:
+            response = get_response()
+        return self._set_validators(response, etag, last_modified)
+
+    def _get_not_modified_response(self, etag, last_modified):
+        if self.request.method in ('GET', 'HEAD'):
+            return get_conditional_response(self.request, etag=etag, last_modified=last_modified)
+        return None
+
+    def _set_validators(self, response, etag, last_modified):
+        if response.status_code in (200, 304) and etag is not None:
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        etag, last_modified = self._get_validators(instance.metadata_date, str(instance.pk), instance.metadata_date)
+        return self._conditional_response(etag, last_modified, lambda: Response(self._serialize(instance)))
+
+    def list(self, request, *args, **kwargs):
+        if isinstance(request.accepted_renderer, StreamingRenderer):
+            # no validators (see `_has_list_validators`), so that the first rows are sent right away
+            return self._list(request, self.filter_queryset(self.get_queryset()))
+        return self._cached_response(request, lambda: self._conditional_list(request))
+
+    def _cached_response(self, request, get_response):
+        '''
+        Return the response from the response cache (if enabled with the `cache` archive setting),
+        otherwise the result of `get_response()`, which is then stored in the cache
+        '''
+        response_cache = ResponseCache.get(self.muninn_archive)
+        if response_cache is None:
+            return get_response()
+
+        key = response_cache.get_key(request)
+        response = self._get_cached_response(response_cache.get_response(key))
+        if response is None:
+            response = self._cache_response(response_cache, key, get_response())
+        return response
+
+    def _get_cached_response(self, cached):
+        '''the response for a response cache entry (or None, which is counted as a miss)'''
+        if self.metrics is not None:
+            self.metrics.count_cache(self.muninn_archive, 'miss' if cached is None else 'hit')
+        if cached is None:
+            return None
+        content, content_type, headers = cached
+        last_modified = headers.get('Last-Modified')
+        last_modified = parse_http_date(last_modified) if last_modified is not None else None
+        return self._conditional_response(headers.get('ETag'), last_modified,
+                                          lambda: HttpResponse(content, content_type=content_type))
+
+    def _cache_response(self, response_cache, key, response):
+        if response.status_code == 200:
+            if hasattr(response, 'add_post_render_callback'):
+                response.add_post_render_callback(partial(response_cache.set_response, key))
+            else:
+                response_cache.set_response(key, response)
+        return response
+
+    def _has_list_validators(self, paginated=True):
+        '''
+        Whether list responses get ETag/Last-Modified validators (enabled with the `conditional_list` archive setting).
+        These require an aggregate query over all products that match the query, so they are not used for streamed
+        responses or with keyset pagination (which are meant to avoid such a query).
+        '''
+        if not settings.MUNINN[self.muninn_archive].get('conditional_list', False):
+            return False
+        if paginated and isinstance(self.paginator, CursorPagination):
+            return False
+        return not isinstance(self.request.accepted_renderer, StreamingRenderer)
+
+    def _get_list_validators(self, summary, paginated=True):
+        '''the validators of a list, given the (aggregated) last metadata_date and number of its products'''
+        if paginated and isinstance(self.paginator, PageNumberPagination):
+            # the paginator does not need to count the products again
+            self.paginator.known_count = summary['count']
+        return self._get_validators(summary['last_modified'], summary['count'], summary['last_modified'])
+
+    def _conditional_list(self, request, queryset=None, get_response=None):
+        '''`get_response`: for other than the (paginated) product list'''
+        if queryset is None:
+            queryset = self.filter_queryset(self.get_queryset())
+        paginated = get_response is None
+        if get_response is None:
+            get_response = partial(self._list, request, queryset)
+        if not self._has_list_validators(paginated):
+            return get_response()
+        summary = queryset.order_by().aggregate(last_modified=Max('metadata_date'), count=Count('pk'))
+        etag, last_modified = self._get_list_validators(summary, paginated)
+        return self._conditional_response(etag, last_modified, get_response)
+
+    def _list(self, request, queryset):
+        if isinstance(request.accepted_renderer, StreamingRenderer):
+            return self._stream(request.accepted_renderer, queryset)
+
+        json_queryset = self._get_json_queryset(queryset)
+        if json_queryset is not None:
+            return self._json_response(json_queryset)
+
+        queryset = self._get_values_queryset(queryset)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self._serialize(page, many=True))
+        return Response(self._serialize(queryset, many=True))
+
+    def _serialize(self, instance, many=False):
+        serializer = self.get_serializer(instance, many=many)
+        with self._measure('serialize'):
+            data = serializer.data
+        self.rows = len(data) if many else 1
+        return data
+
+    def _get_ordering_paths(self, queryset):
+        '''the fields that the keyset pagination needs to construct its cursors'''
+        if isinstance(self.paginator, CursorPagination):
+            return [term.lstrip('-') for term in self.paginator.get_ordering(self.request, queryset, self)]
+        return []
+
+    def _get_values_queryset(self, queryset):
+        '''
+        Fetch plain rows instead of model instances if the serializer supports it (see `ValuesListSerializer`)
+        '''
+        serializer = self.get_serializer(many=True)
+        if not isinstance(serializer, ValuesListSerializer):
+            return queryset
+        paths = serializer.get_values_paths()
+        if paths is None:
+            return queryset
+        paths += [path for path in self._get_ordering_paths(queryset) if path not in paths]
+        return queryset.prefetch_related(None).values_list(*paths, named=True)
+
+    def _get_json_queryset(self, queryset):
+        '''
+        If enabled with the `database_rendering` archive setting, return a queryset of rows with the JSON
+        representation of each product (`json_representation`) rendered by PostgreSQL.
+        Returns None if not enabled or not supported (by the database or the serializer).
+        '''
+        if not settings.MUNINN[self.muninn_archive].get('database_rendering'):
+            return None
+        if connections[queryset.db].vendor != 'postgresql':
+            return None
+        if not isinstance(self.request.accepted_renderer, JSONRenderer):
+            return None
+        from .postgres import json_expression
+        expression = json_expression(self.get_serializer(many=True).child)
+        if expression is None:
+            return None
+        queryset = queryset.prefetch_related(None).annotate(json_representation=Cast(expression, TextField()))
+        paths = ['json_representation'] + self._get_ordering_paths(queryset)
+        return queryset.values_list(*paths, named=True)
+
+    def _json_response(self, queryset):
+        page = self.paginate_queryset(queryset)
+        return self._get_json_response([row.json_representation for row in (queryset if page is None else page)],
+                                       page is not None)
+
+    def _get_json_response(self, rows, paginated):
+        '''the response for the JSON representations of (a page of) the products'''
+        self.rows = len(rows)
+        results = '[%s]' % ','.join(rows)
+        if not paginated:
+            return HttpResponse(results, content_type='application/json')
+        # pagination envelope (with the results as last item)
+        envelope = self.get_paginated_response([]).data
+        envelope = OrderedDict((key, value) for key, value in envelope.items() if key != 'results')
+        content = JSONRenderer().render(envelope).decode('utf-8')
+        content = '%s%s"results":%s}' % (content[:-1], ',' if envelope else '', results)
+        return HttpResponse(content, content_type='application/json')
+
+    def _stream(self, renderer, queryset):
+        queryset = self._get_values_queryset(queryset)
+        header = renderer.get_header(self.get_serializer())
+        chunk_size = self.export_chunk_size
+        labels = self._get_metric_labels(self.request) if self.metrics is not None else None
+
+        def chunks():
+            yield renderer.render_header(header)
+            # `iterator` uses a server-side cursor (if supported by the database backend)
+            products = []
+            rows = 0
+            for product in queryset.iterator(chunk_size=chunk_size):
+                products.append(product)
+                rows += 1
+                if len(products) == chunk_size:
+                    yield renderer.render_rows(self.get_serializer(products, many=True).data, header)
+                    products = []
+            if products:
+                yield renderer.render_rows(self.get_serializer(products, many=True).data, header)
+            # streamed rows are only known at the end (after the request itself has been observed)
+            if labels is not None:
+                self.metrics.count_rows(labels, rows)
+
+        return self._get_streaming_response(renderer, chunks())
+
+    def _get_streaming_response(self, renderer, chunks):
+        response = StreamingHttpResponse(chunks, content_type='%s; charset=%s' % (renderer.media_type, renderer.charset))
+        if renderer.format == 'csv':
+            response['Content-Disposition'] = 'attachment; filename="%s.csv"' % self.muninn_archive
+        return response
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super(ProductViewSet, self).finalize_response(request, response, *args, **kwargs)
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+            # bulk inserts/updates do not send the signals that invalidate the response cache
+            response_cache = ResponseCache.get(self.muninn_archive)
+            if response_cache is not None:
+                response_cache.invalidate()
+        return response
+
+    def create(self, request, *args, **kwargs):
+        if not isinstance(request.data, list):
+            return super(ProductViewSet, self).create(request, *args, **kwargs)
+        # bulk creation: a list of products is created in a single transaction
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def _get_partial_validated_data(self, request, item, instance=None):
+        if instance is None:
+            instance = self.get_object()
+        serializer = self.get_serializer(instance, data={item: request.data}, partial=True)
         serializer.is_valid(raise_exception=True)
         result = serializer.validated_data[item]
         return result
@@ -110,44 +571,194 @@ class ProductViewSet(viewsets.ModelViewSet):
     def tag(self, request, pk=None):
         '''Add tags'''
         instance = self.get_object()
-        tags_data = self._get_partial_validated_data(request, 'tags')
-        existing = [tag.tag for tag in instance.tags.all()]
-        for tag in tags_data:
-            if tag not in existing:
-                instance.tags.create(tag=tag)
-        serializer = self.get_serializer(instance)
-        return Response(serializer.data)
+        tags_data = self._get_partial_validated_data(request, 'tags', instance)
+        tag_class = instance.tags.model
+        # only the tags that the product does not have yet, so that nothing changes (and metadata_date is kept)
+        # when re-tagging
+        existing = set(instance.tags.filter(tag__in=tags_data).values_list('tag', flat=True))
+        new_tags = [tag for tag in tags_data if tag not in existing]
+        if new_tags:
+            with transaction.atomic(using=instance._state.db):
+                tag_class.objects.bulk_create([tag_class(product=instance, tag=tag) for tag in new_tags],
+                                              ignore_conflicts=True)
+                instance.metadata_date = _set_metadata_date(type(instance), [instance.pk])
+        _clear_prefetched(instance, 'tags')
+        return Response(self._serialize(instance))
 
     @action(methods=['post'], detail=True)
     def untag(self, request, pk=None):
         '''Remove tags'''
         instance = self.get_object()
-        tags_data = self._get_partial_validated_data(request, 'tags')
-        for tag in instance.tags.all():
-            if tag.tag in tags_data:
-                tag.delete()
-        serializer = self.get_serializer(instance)
-        return Response(serializer.data)
+        tags_data = self._get_partial_validated_data(request, 'tags', instance)
+        with transaction.atomic(using=instance._state.db):
+            count, _ = instance.tags.filter(tag__in=tags_data).delete()
+            if count:
+                instance.metadata_date = _set_metadata_date(type(instance), [instance.pk])
+        _clear_prefetched(instance, 'tags')
+        return Response(self._serialize(instance))
+
+    def _get_bulk_queryset(self):
+        '''
+        the products that a bulk action applies to; without filter query params this would be all products of the
+        archive, which has to be requested explicitly with `all=true`
+        '''
+        queryset = self.filter_queryset(self.get_queryset())
+        filters = [name for name, value in self.request.query_params.items()
+                   if value and self.filterset_class is not None and name in self.filterset_class.base_filters]
+        if not filters and self.request.query_params.get('all') != 'true':
+            raise BadRequest('Filter query params (or "all=true") are required to change multiple products')
+        return queryset
+
+    @action(methods=['post'], detail=False, url_path='tag', url_name='bulk-tag')
+    def bulk_tag(self, request):
+        '''Add tags to all products that match the query'''
+        tags_data = self.get_serializer().fields['tags'].run_validation(request.data)
+        queryset = self._get_bulk_queryset()
+        tag_class = queryset.model._meta.get_field('tags').related_model
+        if not tags_data:
+            return Response({'count': 0})
+
+        # single INSERT ... SELECT; existing (product, tag) pairs are skipped
+        connection = connections[queryset.db]
+        products_query = queryset.order_by().values('pk').query
+        products_sql, products_params = products_query.get_compiler(using=queryset.db).as_sql()
+        tags_sql = ' UNION ALL '.join(['SELECT %s AS tag'] * len(tags_data))
+        quote_name = connection.ops.quote_name
+        product_column = quote_name(tag_class._meta.get_field('product').column)
+        sql = 'INSERT INTO %s (%s, %s) SELECT p.%s, t.tag FROM (%s) p CROSS JOIN (%s) t WHERE true ' \
+              'ON CONFLICT DO NOTHING RETURNING %s' % (
+            quote_name(tag_class._meta.db_table),
+            product_column,
+            quote_name(tag_class._meta.get_field('tag').column),
+            quote_name('pk'),
+            products_sql,
+            tags_sql,
+            product_column,
+        )
+        with transaction.atomic(using=queryset.db):
+            with connection.cursor() as cursor:
+                cursor.execute(sql, tuple(products_params) + tuple(tags_data))
+                # only the inserted rows are returned
+                tagged = cursor.fetchall()
+            if tagged:
+                _set_metadata_date(queryset.model, set(product for product, in tagged))
+        return Response({'count': len(tagged)})
+
+    @action(methods=['post'], detail=False, url_path='untag', url_name='bulk-untag')
+    def bulk_untag(self, request):
+        '''Remove tags from all products that match the query'''
+        tags_data = self.get_serializer().fields['tags'].run_validation(request.data)
+        queryset = self._get_bulk_queryset()
+        tag_class = queryset.model._meta.get_field('tags').related_model
+        tags = tag_class.objects.filter(tag__in=tags_data, product__in=queryset.order_by().values('pk'))
+        # single DELETE ... WHERE tag IN (...) AND uuid IN (SELECT ...); the products that have the tags are selected
+        # first, since updating their metadata_date may change whether they match the query
+        with transaction.atomic(using=queryset.db):
+            products = set(tags.values_list('product', flat=True))
+            if not products:
+                return Response({'count': 0})
+            count, _ = tags.delete()
+            _set_metadata_date(queryset.model, products)
+        return Response({'count': count})
+
+    def _get_group_by(self, model_class):
+        '''Return the `group_by` query param as a list of (name, expression)'''
+        result = []
+        for term in self.request.query_params.get('group_by', '').split(','):
+            if not term:
+                continue
+            path, _, bucket = term.partition(':')
+            model, field = model_class, None
+            try:
+                for name in path.split('__'):
+                    if field is not None:
+                        model = field.related_model
+                    field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                field = None
+            if field is None or field.is_relation or not field.concrete or \
+                    (bucket and (bucket not in self.group_by_buckets or not isinstance(field, DateField))):
+                raise BadRequest('Invalid value for query param "%s": "%s"' % ('group_by', term))
+            result.append((path, Trunc(path, bucket) if bucket else F(path)))
+        return result
+
+    @action(methods=['get'], detail=False)
+    def stats(self, request):
+        '''Number of products and total/min/max size of the products that match the query, per `group_by` group'''
+        queryset = self.filter_queryset(self.get_queryset())
+        group_by = self._get_group_by(queryset.model)
+        if queryset.query.distinct:
+            # filters that join multi-valued relations (e.g. tags) would make products count more than once
+            queryset = queryset.model.objects.filter(pk__in=queryset.values('pk'))
+
+        # single SELECT ... GROUP BY
+        aggregates = OrderedDict([('count', Count('pk')), ('size_sum', Sum('size')), ('size_min', Min('size')),
+                                  ('size_max', Max('size'))])
+        queryset = queryset.prefetch_related(None).order_by()
+        aliases = OrderedDict(('group_%d' % index, expression) for index, (_, expression) in enumerate(group_by))
+        if aliases:
+            rows = queryset.values(**aliases).annotate(**aggregates).order_by(*aliases.keys())
+        else:
+            rows = [queryset.aggregate(**aggregates)]
+
+        results = []
+        for row in rows:
+            result = OrderedDict()
+            for (name, _), alias in zip(group_by, aliases.keys()):
+                value = row[alias]
+                result[name] = value.isoformat() if isinstance(value, (datetime.date, datetime.datetime)) else value
+            for name in aggregates.keys():
+                result[name] = row[name]
+            results.append(result)
+        return Response(results)
+
+    def tiles(self, request, z, x, y, *args, **kwargs):
+        '''Mapbox Vector Tile with the footprints of the products that match the query (see `MuninnRouter`)'''
+        z, x, y = int(z), int(x), int(y)
+        if z > self.tile_max_zoom or x >= 2 ** z or y >= 2 ** z:
+            raise BadRequest('Invalid tile: "%d/%d/%d"' % (z, x, y))
+        queryset = self.filter_queryset(self.get_queryset())
+        if connections[queryset.db].vendor != 'postgresql':
+            raise BadRequest('Vector tiles require a PostGIS database')
+        from .postgres import mvt_tile
+        # only the products in (the buffer of) the tile, using the spatial index
+        queryset = queryset.filter(bbox_condition('footprint', tile_bbox(z, x, y, self.tile_buffer / 4096)))
+
+        def get_response():
+            tile = mvt_tile(queryset, z, x, y, self.muninn_archive, self.tile_attributes, buffer=self.tile_buffer)
+            return HttpResponse(tile, content_type='application/vnd.mapbox-vector-tile')
+
+        response = self._cached_response(request, lambda: self._conditional_list(request, queryset, get_response))
+        max_age = settings.MUNINN[self.muninn_archive].get('tile_max_age')
+        if max_age is not None and response.status_code in (200, 304):
+            patch_cache_control(response, max_age=max_age)
+        return response
 
     @action(methods=['post'], detail=True)
     def link(self, request, pk=None):
         '''Add source products'''
         instance = self.get_object()
-        source_products = self._get_partial_validated_data(request, 'source_products')
-        existing = list(instance.source_products.all())
-        for source in source_products:
-            if source not in existing:
-                instance.source_links.create(source=source)
-        serializer = self.get_serializer(instance)
-        return Response(serializer.data)
+        source_products = self._get_partial_validated_data(request, 'source_products', instance)
+        link_class = instance.source_links.model
+        # only the source products that are not linked yet (see `tag`)
+        existing = set(instance.source_links.filter(source__in=source_products).values_list('source', flat=True))
+        new_sources = [source for source in source_products if source.pk not in existing]
+        if new_sources:
+            with transaction.atomic(using=instance._state.db):
+                link_class.objects.bulk_create([link_class(product=instance, source=source)
+                                                for source in new_sources], ignore_conflicts=True)
+                instance.metadata_date = _set_metadata_date(type(instance), [instance.pk])
+        _clear_prefetched(instance, 'source_products')
+        return Response(self._serialize(instance))
 
     @action(methods=['post'], detail=True)
     def unlink(self, request, pk=None):
         '''Remove source products'''
         instance = self.get_object()
-        source_products = self._get_partial_validated_data(request, 'source_products')
-        for link in instance.source_links.all():
-            if link.source in source_products:
-                link.delete()
-        serializer = self.get_serializer(instance)
-        return Response(serializer.data)
+        source_products = self._get_partial_validated_data(request, 'source_products', instance)
+        with transaction.atomic(using=instance._state.db):
+            count, _ = instance.source_links.filter(source__in=source_products).delete()
+            if count:
+                instance.metadata_date = _set_metadata_date(type(instance), [instance.pk])
+        _clear_prefetched(instance, 'source_products')
+        return Response(self._serialize(instance))
@@ -0,0 +1,111 @@
+#
+# Copyright (C) 2018-2022 S[&]T, The Netherlands.
+#
+'''
+Test suite: runs the tests of muninn_django against a test archive (see `testarchive`), in an in-memory SQLite
+database by default, or in a SpatiaLite or PostGIS database (some tests only run on PostgreSQL).
+
+Usage: python tests/runtests.py [--database spatialite:<path> | postgis://<user>:<password>@<host>:<port>/<name>]
+                                [-v <verbosity>] [<test label> ...]
+
+GDAL_LIBRARY_PATH, GEOS_LIBRARY_PATH and SPATIALITE_LIBRARY_PATH are taken from the environment, if set.
+'''
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import os
+import sys
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+TESTS_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TESTS_PATH, os.pardir))
+sys.path.insert(0, TESTS_PATH)
+
+MODELS = {
+    'core': 'testarchive.models.Core',
+    'stuff': 'testarchive.models.Stuff',
+}
+
+SERIALIZERS = {
+    'default': 'muninn_django.serializers.ProductCoreSerializer',
+    'extended': 'muninn_django.serializers.ProductCompleteSerializer',
+    'wrapped': 'muninn_django.serializers.ProductWrappedFootprintSerializer',
+    'stuff': 'testarchive.serializers.ProductStuffSerializer',
+}
+
+
+def get_database(url):
+    '''Django database settings for `sqlite`, `spatialite:<path>` or `postgis://<user>:<password>@<host>:<port>/<name>`'''
+    if url == 'sqlite':
+        return {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}
+    if url.startswith('spatialite:'):
+        return {'ENGINE': 'django.contrib.gis.db.backends.spatialite', 'NAME': url[len('spatialite:'):]}
+    parsed = urlparse(url)
+    if parsed.scheme not in ('postgis', 'postgres', 'postgresql'):
+        raise ValueError('unsupported database: %s' % url)
+    return {
+        'ENGINE': 'django.contrib.gis.db.backends.postgis',
+        'NAME': parsed.path.lstrip('/'),
+        'USER': parsed.username or '',
+        'PASSWORD': parsed.password or '',
+        'HOST': parsed.hostname or '',
+        'PORT': str(parsed.port or ''),
+    }
+
+
+def configure(args):
+    from django.conf import settings
+    import django
+
+    options = dict((name, os.environ[name]) for name in ('GDAL_LIBRARY_PATH', 'GEOS_LIBRARY_PATH',
+                                                         'SPATIALITE_LIBRARY_PATH') if name in os.environ)
+    settings.configure(
+        DEBUG=False,
+        SECRET_KEY='test',
+        USE_TZ=False,
+        DEFAULT_AUTO_FIELD='django.db.models.AutoField',
+        ALLOWED_HOSTS=['testserver'],
+        INSTALLED_APPS=['django.contrib.contenttypes', 'django.contrib.auth', 'rest_framework', 'rest_framework_gis',
+                        'django_filters', 'muninn_django', 'testarchive'],
+        DATABASES={'default': get_database(args.database)},
+        ROOT_URLCONF='muninn_django.urls',
+        MUNINN={
+            'archive': {'models': MODELS, 'serializers': SERIALIZERS, 'metrics': True},
+            'cursor': {'models': MODELS, 'pagination': 'muninn_django.pagination.CursorPagination'},
+            'cached': {'models': MODELS, 'cache': True},
+        },
+        REST_FRAMEWORK={
+            'PAGE_SIZE': 10,
+            'MAX_PAGE_SIZE': 100,
+            'DEFAULT_PAGINATION_CLASS': 'muninn_django.pagination.PageNumberPagination',
+            'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend',
+                                        'muninn_django.filters.RelatedOrderingFilter'],
+        },
+        **options
+    )
+    django.setup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the muninn_django tests')
+    parser.add_argument('--database', default='sqlite',
+                        help='sqlite (default, in memory), spatialite:<path> or postgis://<user>:<password>@<host>:<port>/<name>')
+    parser.add_argument('-v', '--verbosity', type=int, default=1)
+    parser.add_argument('labels', nargs='*', default=['muninn_django'])
+    args = parser.parse_args()
+    configure(args)
+
+    from django.test.utils import get_runner
+    from django.conf import settings
+    runner = get_runner(settings)(verbosity=args.verbosity)
+    failures = runner.run_tests(args.labels)
+    sys.exit(bool(failures))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+#
+# Copyright (C) 2018-2022 S[&]T, The Netherlands.
+#
+
+from __future__ import absolute_import, division, print_function
+
+from django.conf import settings
+from django.contrib.gis.db import models
+from muninn_django import models as muninn_models
+
+# without a spatial database (plain SQLite), the products have no footprint
+SPATIAL = 'gis' in settings.DATABASES['default']['ENGINE']
+
+
+class Core(muninn_models.Core):
+    if not SPATIAL:
+        footprint = None
+
+    class Meta(muninn_models.Core.Meta):
+        db_table = 'test_core'
+
+
+class Tag(muninn_models.Tag):
+    class Meta(muninn_models.Tag.Meta):
+        db_table = 'test_tag'
+
+
+class Link(muninn_models.Link):
+    class Meta(muninn_models.Link.Meta):
+        db_table = 'test_link'
+
+
+class Stuff(models.Model):
+    _core = models.OneToOneField(Core, models.CASCADE, db_column='uuid', related_name='stuff', primary_key=True)
+    text_value = models.TextField(blank=True, null=True)
+    long_value = models.BigIntegerField(blank=True, null=True)
+
+    class Meta:
+        db_table = 'test_stuff'
+        verbose_name_plural = 'stuff'
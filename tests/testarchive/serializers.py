@@ -0,0 +1,13 @@
+#
+# Copyright (C) 2018-2022 S[&]T, The Netherlands.
+#
+
+from __future__ import absolute_import, division, print_function
+
+from muninn_django.serializers import ProductCoreSerializer
+
+
+class ProductStuffSerializer(ProductCoreSerializer):
+    '''the core metadata and the `stuff` namespace (which can be serialized from `values_list` rows)'''
+    class Meta(ProductCoreSerializer.Meta):
+        muninn_namespaces = ('stuff', )
@@ -0,0 +1,17 @@
+#
+# Copyright (C) 2018-2022 S[&]T, The Netherlands.
+#
+
+from __future__ import absolute_import, division, print_function
+
+from django.urls import re_path, include
+
+from muninn_django.routers import AsyncMuninnRouter
+
+# the test archive served by `AsyncProductViewSet`
+router = AsyncMuninnRouter()
+router.register_muninn('archive', prefix='archive')
+
+urlpatterns = [
+    re_path(r'^', include(router.urls))
+]